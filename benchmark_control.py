@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+控制链路基准测试 - 配合虚拟小车测量 HTTP 到串口线上的延迟、吞吐量和重连时间
+
+用法一：服务器已在运行，[serial] port 指向模拟器链接路径
+    python3 benchmark_control.py --url http://127.0.0.1:5800
+用法二：在本进程内启动串口和 Web 服务（不初始化摄像头）
+    python3 benchmark_control.py --in-process
+长连接测试：打开 N 个长连接后测量短请求延迟，进程内模式下可比较各服务器后端
+    python3 benchmark_control.py --in-process --streams 32 --backend all
+"""
+
+import json
+import time
+import threading
+import argparse
+import http.client
+import numpy as np
+from urllib.parse import urlparse
+
+from config_manager import config_manager
+from car_simulator import create_simulator
+from web_server import SERVER_BACKENDS, create_server
+
+class ControlClient:
+    """保持长连接的 HTTP 控制客户端"""
+
+    def __init__(self, url: str, client_id: str = 'benchmark'):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.client_id = client_id
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=5)
+
+    def request(self, method: str, path: str, body: dict = None) -> dict:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        data = json.dumps(body) if body is not None else None
+        try:
+            self.conn.request(method, path, body=data, headers=headers)
+            return json.loads(self.conn.getresponse().read())
+        except (http.client.HTTPException, OSError):
+            # 服务器关闭了连接，重新建立后重试一次
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=5)
+            self.conn.request(method, path, body=data, headers=headers)
+            return json.loads(self.conn.getresponse().read())
+
+    def control(self, command: str) -> dict:
+        return self.request('POST', '/control', {'command': command, 'client_id': self.client_id})
+
+    def status(self) -> dict:
+        return self.request('GET', '/status')
+
+def percentiles(samples) -> str:
+    """格式化毫秒样本的分位数"""
+    if len(samples) == 0:
+        return '无样本'
+    values = np.array(samples) * 1000
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return (f"p50 {p50:.2f}ms  p90 {p90:.2f}ms  p99 {p99:.2f}ms  "
+            f"max {values.max():.2f}ms  (n={len(values)})")
+
+def bench_latency(url: str, simulator, count: int, rate: float):
+    """逐条发送命令，测量请求发出到模拟器收到字节的时间
+
+    按 rate 控制发送节奏，避免被服务器限流。
+    """
+    # 与吞吐量测试的第一个客户端同名，由它继续持有驾驶者身份
+    client = ControlClient(url, 'bench-0')
+    commands = ('forward', 'backward')
+    wire_chars = {'forward': 'F', 'backward': 'B'}
+    wire_latency = []
+    http_latency = []
+    lost = 0
+
+    interval = 1.0 / rate if rate > 0 else 0.0
+    next_send = time.monotonic()
+    for i in range(count):
+        delay = next_send - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        next_send += interval
+        command = commands[i % 2]
+        since = simulator.command_count
+        sent = time.time()
+        result = client.control(command)
+        http_latency.append(time.time() - sent)
+        if not result.get('success'):
+            lost += 1
+            continue
+        received = simulator.wait_for_command(wire_chars[command], since, timeout=1.0)
+        if received is None:
+            lost += 1
+        else:
+            wire_latency.append(received - sent)
+
+    client.control('stop')
+    print("=== HTTP 到串口线上延迟 ===")
+    print(f"HTTP 往返:  {percentiles(http_latency)}")
+    print(f"请求到线上: {percentiles(wire_latency)}")
+    print(f"未到达线上: {lost}")
+
+def bench_throughput(url: str, simulator, concurrency: int, duration: float):
+    """多个客户端并发、不限速地发送命令，统计请求吞吐量、被拒绝的请求和实际写入线上的命令数
+
+    bench-0 为驾驶者，其余客户端模拟争抢控制权的其他页面。
+    """
+    counts = [0] * concurrency
+    results = {}
+    stop_event = threading.Event()
+    lock = threading.Lock()
+
+    def worker(index):
+        client = ControlClient(url, f'bench-{index}')
+        commands = ('forward', 'backward', 'left', 'right')
+        i = index
+        while not stop_event.is_set():
+            result = client.control(commands[i % len(commands)])
+            key = result.get('message') or ('accepted' if result.get('success') else 'failed')
+            with lock:
+                results[key] = results.get(key, 0) + 1
+            counts[index] += 1
+            i += 1
+
+    start_count = simulator.command_count
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop_event.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    elapsed = time.monotonic() - start
+    time.sleep(0.1)
+
+    ControlClient(url).control('stop')
+    requests = sum(counts)
+    wire = simulator.command_count - start_count
+    print(f"=== 吞吐量 ({concurrency} 并发, {elapsed:.1f}s) ===")
+    print(f"请求: {requests} ({requests / elapsed:.1f}/s)")
+    print(f"处理结果: {results}")
+    print(f"线上命令: {wire} ({wire / elapsed:.1f}/s)，合并率 {1 - wire / max(requests, 1):.1%}")
+
+def bench_reconnect(url: str, simulator, rounds: int, outage: float):
+    """注入断线，测量设备重新出现到服务器重新连上的时间"""
+    client = ControlClient(url, 'bench-reconnect')
+    recover_times = []
+    failed = 0
+
+    for _ in range(rounds):
+        online_before = simulator.last_online_time
+        simulator.inject_disconnect(outage)
+        # 等待设备重新出现
+        deadline = time.monotonic() + outage + 5
+        while simulator.last_online_time == online_before and time.monotonic() < deadline:
+            time.sleep(0.005)
+        back = simulator.last_online_time
+
+        while time.monotonic() < deadline:
+            if client.status().get('serial_status', {}).get('connected'):
+                recover_times.append(time.time() - back)
+                break
+            time.sleep(0.01)
+        else:
+            failed += 1
+
+    print(f"=== 重连时间 ({rounds} 次断线, 每次 {outage}s) ===")
+    print(f"设备恢复到重新连接: {percentiles(recover_times)}")
+    print(f"未恢复: {failed}")
+
+def bench_streams(url: str, streams: int, count: int, path: str):
+    """打开 streams 个长连接并持续读取，比较打开前后短请求 (/health) 的延迟"""
+    client = ControlClient(url)
+
+    def measure():
+        samples = []
+        for _ in range(count):
+            sent = time.time()
+            client.request('GET', '/health')
+            samples.append(time.time() - sent)
+        return samples
+
+    def drain(response):
+        try:
+            while response.read(4096):
+                pass
+        except (http.client.HTTPException, OSError):
+            pass
+
+    idle = measure()
+    connections = []
+    rejected = 0
+    for _ in range(streams):
+        conn = http.client.HTTPConnection(client.host, client.port, timeout=5)
+        conn.request('GET', path)
+        response = conn.getresponse()
+        if response.status == 200:
+            connections.append(conn)
+            threading.Thread(target=drain, args=(response,), daemon=True).start()
+        else:
+            rejected += 1
+            response.read()
+            conn.close()
+    loaded = measure()
+    for conn in connections:
+        conn.close()
+
+    print(f"=== 长连接下的请求延迟 ({streams} 个 {path}) ===")
+    print(f"无长连接:   {percentiles(idle)}")
+    print(f"长连接期间: {percentiles(loaded)}")
+    print(f"长连接: 接受 {len(connections)}，拒绝 {rejected}")
+
+def init_in_process(serial_port: str):
+    """在本进程内初始化默认小车的串口和状态推送（不初始化摄像头）"""
+    import car_web_control
+
+    car = car_web_control.get_car()
+    car.serial_port = serial_port
+    car_web_control.init_serial(car)
+    car_web_control.init_control_arbiter(car)
+    car_web_control.init_control_watchdog()
+    car_web_control.init_latency_tracker()
+    car_web_control.init_status_publisher()
+
+def start_in_process(port: int, backend: str = 'pooled'):
+    """在本进程内按指定后端启动 Web 服务"""
+    import car_web_control
+
+    server = create_server(
+        backend, '127.0.0.1', port, car_web_control.app,
+        workers=config_manager.getint('network', 'workers', 8),
+        stream_workers=config_manager.getint('network', 'stream_workers', 8),
+        is_long_lived=car_web_control.is_long_lived
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='控制链路基准测试')
+    parser.add_argument('--url', help='控制服务器地址（默认按 [network] port 访问本机）')
+    parser.add_argument('--in-process', action='store_true', help='在本进程内启动串口和 Web 服务')
+    parser.add_argument('--count', type=int, default=200, help='延迟测试命令数')
+    parser.add_argument('--rate', type=float, help='延迟测试每秒命令数（默认为 [control] rate_limit 的 80%%，0 为不限）')
+    parser.add_argument('--concurrency', type=int, default=4, help='吞吐量测试并发数')
+    parser.add_argument('--duration', type=float, default=5.0, help='吞吐量测试时长 (秒)')
+    parser.add_argument('--reconnects', type=int, default=5, help='重连测试次数，0 为跳过')
+    parser.add_argument('--outage', type=float, help='每次断线时长 (秒)，默认取 [simulator] disconnect_duration')
+    parser.add_argument('--streams', type=int, default=0, help='长连接测试的连接数，0 为跳过')
+    parser.add_argument('--stream-path', default='/status/stream',
+                        help='长连接路径（有摄像头时可用 /video_feed）')
+    parser.add_argument('--backend', choices=SERVER_BACKENDS + ('all',),
+                        help='进程内模式的服务器后端，all 为逐个比较长连接测试（默认取 [network] server）')
+
+    args = parser.parse_args()
+
+    simulator = create_simulator()
+    # 基准测试自行控制断线
+    simulator.disconnect_interval = 0
+    simulator.start()
+
+    port = config_manager.getint('network', 'port', 5800)
+    url = args.url or f'http://127.0.0.1:{port}'
+    server = None
+    backend = args.backend or config_manager.get('network', 'server', 'pooled')
+    backends = SERVER_BACKENDS if backend == 'all' else (backend,)
+    if args.in_process:
+        port = port + 1
+        url = f'http://127.0.0.1:{port}'
+        init_in_process(simulator.link)
+        server = start_in_process(port, backends[0])
+
+    try:
+        # 等待服务器连上模拟器
+        client = ControlClient(url)
+        deadline = time.monotonic() + 10
+        while not client.status().get('serial_status', {}).get('connected'):
+            if time.monotonic() > deadline:
+                print(f"❌ 服务器未连接到模拟器，请将 [serial] port 设置为 {simulator.link}")
+                return
+            time.sleep(0.1)
+
+        # 延迟测试的发送速率取服务器限流的 80%
+        rate = args.rate if args.rate is not None else \
+            config_manager.getfloat('control', 'rate_limit', 20.0) * 0.8
+        bench_latency(url, simulator, args.count, rate)
+        bench_throughput(url, simulator, args.concurrency, args.duration)
+        if args.reconnects > 0:
+            outage = args.outage if args.outage is not None else simulator.disconnect_duration
+            bench_reconnect(url, simulator, args.reconnects, outage)
+        if args.streams > 0:
+            if not args.in_process:
+                bench_streams(url, args.streams, args.count, args.stream_path)
+            for i, name in enumerate(backends if args.in_process else ()):
+                if i > 0:
+                    # 每个后端使用新端口，避免上一个服务器的连接仍在关闭
+                    server.shutdown()
+                    server = start_in_process(port + i, name)
+                    url = f'http://127.0.0.1:{port + i}'
+                print(f"--- 服务器后端: {name} ---")
+                bench_streams(url, args.streams, args.count, args.stream_path)
+    finally:
+        if server:
+            server.shutdown()
+        simulator.stop()
+
+if __name__ == '__main__':
+    main()
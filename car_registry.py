@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+小车注册表模块 - 一个服务进程控制多辆小车
+
+每辆小车由一个 [car.N] 配置节描述（N 为小车编号，用于 /car/<N>/... 路由）:
+
+    [car.1]
+    name = 一号车
+    serial_port = /dev/ttyUSB0
+    camera = 0
+
+serial_port 未配置时使用 [serial] port，camera 为摄像头编号，-1 表示没有摄像头。
+没有任何 [car.*] 配置节时按 [serial] 和 [camera] 创建一辆编号为 0 的小车，与单车部署兼容。
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from config_manager import config_manager
+
+class Car:
+    """一辆小车的串口、摄像头和控制状态"""
+
+    def __init__(self, car_id: str, name: str = '', serial_port: str = '/dev/ttyS0',
+                 camera_num: int = 0):
+        self.car_id = car_id
+        self.name = name or f'小车 {car_id}'
+        self.serial_port = serial_port
+        # 摄像头编号，-1 表示没有摄像头
+        self.camera_num = camera_num
+
+        # 串口和控制
+        self.serial_handler = None
+        self.telemetry = None
+        self.control_arbiter = None
+        self.current_cmd = 'S'
+        # 最近一次 drive 命令的 (速度, 转向)
+        self.current_drive = (0, 0)
+
+        # 摄像头和视频流
+        self.picam2 = None
+        self.camera_active = False
+        self.camera_has_lores = False
+        self.frame_broadcaster = None
+
+        # 连拍/定时拍摄和录像，只有带摄像头的小车才有
+        self.capture_manager = None
+        self.video_recorder = None
+
+        self.status = {
+            'serial_connected': False,
+            'camera_active': False,
+            'last_command_time': 0
+        }
+
+        # 当前命令或连接状态变化时调用（用于状态推送）
+        self.on_change: Optional[Callable] = None
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def send_command(self, cmd: str, drive=None, on_done=None):
+        """提交命令到串口写入队列，不等待串口写入
+
+        drive 为 (速度, 转向) 时发送 drive 命令（cmd 为 'D'）。
+        on_done 在命令写入、被合并或失败时由串口处理器调用。
+        返回队列中的命令，被拒绝时其 status 为 rejected、reason 说明原因；
+        串口处理器不存在或出错时返回 None。
+        """
+        if not self.serial_handler:
+            self.logger.warning(f"[{self.car_id}] 串口未初始化，无法发送命令")
+            return None
+        try:
+            if drive:
+                item = self.serial_handler.enqueue_drive(*drive, on_done=on_done)
+            else:
+                item = self.serial_handler.enqueue(cmd, on_done=on_done)
+            if item.status != 'rejected':
+                self.current_cmd = cmd
+                self.current_drive = drive or (0, 0)
+                # 小车开始动作，视频流立即恢复全帧率
+                if self.frame_broadcaster and cmd != 'S':
+                    self.frame_broadcaster.notify_activity()
+                self.status['last_command_time'] = time.time()
+                self.logger.info(f"[{self.car_id}] 已发送命令: {cmd}{drive or ''}")
+                self._changed()
+            else:
+                self.logger.error(f"[{self.car_id}] 发送命令失败: {item.reason}")
+            return item
+        except Exception as e:
+            self.logger.error(f"[{self.car_id}] 发送命令异常: {e}")
+            return None
+
+    def get_camera(self):
+        """获取当前摄像头实例（重新初始化后为新实例）"""
+        return self.picam2
+
+    def capture_frame(self):
+        """从当前摄像头实例捕获一帧
+
+        返回 (main, lores)，lores 与 main 来自同一次请求，未配置时为 None
+        """
+        if not self.picam2:
+            return None, None
+        if self.camera_has_lores:
+            (main_frame, lores_frame), _ = self.picam2.capture_arrays(["main", "lores"])
+            return main_frame, lores_frame
+        return self.picam2.capture_array(), None
+
+    def on_serial_connected(self):
+        """串口连接成功回调"""
+        self.status['serial_connected'] = True
+        self.logger.info(f"[{self.car_id}] 串口已连接")
+        self._changed()
+
+    def on_serial_disconnected(self):
+        """串口断开连接回调"""
+        self.status['serial_connected'] = False
+        self.logger.warning(f"[{self.car_id}] 串口连接丢失")
+        self._changed()
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def get_status(self) -> dict:
+        """获取小车概要状态"""
+        return {
+            'id': self.car_id,
+            'name': self.name,
+            'serial_port': self.serial_port,
+            'camera': self.camera_num,
+            'current_cmd': self.current_cmd,
+            **self.status
+        }
+
+class CarRegistry:
+    """小车注册表，按编号查找小车，第一辆为默认小车（无前缀的路由使用）"""
+
+    def __init__(self):
+        self.cars: Dict[str, Car] = OrderedDict()
+
+    def add(self, car: Car):
+        self.cars[car.car_id] = car
+
+    def get(self, car_id: Optional[str] = None) -> Optional[Car]:
+        """按编号获取小车，car_id 为 None 时返回默认小车"""
+        if car_id is None:
+            return self.default
+        return self.cars.get(str(car_id))
+
+    @property
+    def default(self) -> Optional[Car]:
+        return next(iter(self.cars.values()), None)
+
+    def all(self) -> List[Car]:
+        return list(self.cars.values())
+
+    def get_status(self) -> list:
+        return [car.get_status() for car in self.cars.values()]
+
+def create_car_registry() -> CarRegistry:
+    """按 [car.*] 配置创建小车注册表"""
+    registry = CarRegistry()
+    default_port = config_manager.get('serial', 'port', '/dev/ttyS0')
+    for section in config_manager.get_sections('car.'):
+        car_id = section[len('car.'):]
+        registry.add(Car(
+            car_id,
+            name=config_manager.get(section, 'name', ''),
+            serial_port=config_manager.get(section, 'serial_port', default_port),
+            camera_num=config_manager.getint(section, 'camera', -1)
+        ))
+    if not registry.cars:
+        registry.add(Car('0', serial_port=default_port, camera_num=0))
+    return registry
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+虚拟小车模拟器 - 用伪终端扮演下位机，脱离硬件测试控制链路
+
+模拟器打开一个伪终端，把从端链接到固定路径（默认 /tmp/ttyCAR），
+将 config.ini 中 [serial] port 指向该路径即可代替真实小车。
+它按 [serial] protocol 解析 F/B/L/R/S 单字节命令或帧协议，
+按遥测格式输出电池电压、编码器计数和命令确认，
+并可注入处理延迟和周期性断线，用于测试自动重连。
+
+独立运行:
+    python3 car_simulator.py [--link /tmp/ttyCAR] [--latency-ms 5]
+"""
+
+import os
+import tty
+import time
+import select
+import threading
+import logging
+import argparse
+from collections import deque
+from typing import Optional
+
+from config_manager import config_manager
+from motion_protocol import FrameParser, FRAME_STOP, ACTUATOR_SPEED, ACTUATOR_STEERING, \
+    values_to_legacy
+
+# 每条命令对应的左右轮速度 (-1 ~ 1)
+WHEEL_SPEEDS = {
+    'F': (1.0, 1.0),
+    'B': (-1.0, -1.0),
+    'L': (-1.0, 1.0),
+    'R': (1.0, -1.0),
+    'S': (0.0, 0.0)
+}
+
+# 全速时每秒的编码器计数
+TICKS_PER_SECOND = 200.0
+
+class CarSimulator:
+    """伪终端小车模拟器"""
+
+    def __init__(self, link: str = '/tmp/ttyCAR', latency: float = 0.0,
+                 telemetry_interval: float = 0.1, disconnect_interval: float = 0.0,
+                 disconnect_duration: float = 0.5, protocol: str = 'legacy'):
+        self.link = link
+        self.protocol = protocol
+        self.frame_parser = FrameParser()
+        # 收到命令到执行并回复确认的延迟（秒）
+        self.latency = latency
+        self.telemetry_interval = telemetry_interval
+        # 大于 0 时每隔该时长自动断线一次，持续 disconnect_duration 秒
+        self.disconnect_interval = disconnect_interval
+        self.disconnect_duration = disconnect_duration
+
+        self.master_fd: Optional[int] = None
+        self.slave_fd: Optional[int] = None
+        self.is_running = False
+        self.sim_thread = None
+        self.disconnect_request = 0.0
+
+        # 小车状态
+        self.command = 'S'
+        self.wheel_speeds = (0.0, 0.0)
+        self.encoder_left = 0.0
+        self.encoder_right = 0.0
+        self.battery = 8.4
+        self.last_update = time.monotonic()
+        self.pending = deque()
+
+        # 收到的命令 (接收时间, 命令)，供基准测试匹配线上时间
+        self.condition = threading.Condition()
+        self.received = deque(maxlen=10000)
+        self.command_count = 0
+
+        # 统计信息
+        self.invalid_bytes = 0
+        self.telemetry_sent = 0
+        self.telemetry_dropped = 0
+        self.disconnects = 0
+        self.last_online_time = 0.0
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """打开伪终端并启动模拟线程"""
+        if self.is_running:
+            return
+        self._open()
+        self.is_running = True
+        self.sim_thread = threading.Thread(target=self._run)
+        self.sim_thread.daemon = True
+        self.sim_thread.start()
+        self.logger.info(f"虚拟小车已启动: {self.link}")
+
+    def stop(self):
+        """停止模拟并删除链接"""
+        self.is_running = False
+        if self.sim_thread and self.sim_thread.is_alive():
+            self.sim_thread.join(timeout=2)
+        self._close()
+        self.logger.info("虚拟小车已停止")
+
+    def inject_disconnect(self, duration: Optional[float] = None):
+        """注入一次断线（设备消失 duration 秒后重新出现）"""
+        self.disconnect_request = duration if duration is not None else self.disconnect_duration
+
+    def _open(self):
+        """创建伪终端，从端链接到固定路径"""
+        master_fd, slave_fd = os.openpty()
+        # 原始模式，关闭回显和行缓冲
+        tty.setraw(slave_fd)
+        os.set_blocking(master_fd, False)
+        slave_name = os.ttyname(slave_fd)
+
+        if os.path.islink(self.link) or os.path.exists(self.link):
+            os.remove(self.link)
+        os.symlink(slave_name, self.link)
+
+        self.master_fd = master_fd
+        # 保持从端打开，串口未被打开时主端也不会读到 EIO
+        self.slave_fd = slave_fd
+        self.last_online_time = time.time()
+
+    def _close(self):
+        """关闭伪终端，模拟设备拔出"""
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.master_fd = None
+        self.slave_fd = None
+        try:
+            if os.path.islink(self.link):
+                os.remove(self.link)
+        except OSError:
+            pass
+
+    def _run(self):
+        """模拟循环：读取命令、更新状态、定时输出遥测"""
+        next_telemetry = time.monotonic()
+        next_disconnect = time.monotonic() + self.disconnect_interval
+
+        while self.is_running:
+            now = time.monotonic()
+
+            # 断线注入
+            duration = 0.0
+            if self.disconnect_request:
+                duration, self.disconnect_request = self.disconnect_request, 0.0
+            elif self.disconnect_interval > 0 and now >= next_disconnect:
+                duration = self.disconnect_duration
+            if duration:
+                self._disconnect(duration)
+                next_disconnect = time.monotonic() + self.disconnect_interval
+                continue
+
+            timeout = max(0.0, next_telemetry - now)
+            if self.pending:
+                timeout = min(timeout, max(0.0, self.pending[0][0] - now))
+            try:
+                readable, _, _ = select.select([self.master_fd], [], [], min(timeout, 0.05))
+                if readable:
+                    self._receive(os.read(self.master_fd, 256))
+            except OSError:
+                pass
+
+            now = time.monotonic()
+            self._apply_pending(now)
+            if now >= next_telemetry:
+                self._update(now)
+                self._write(f"bat:{self.battery:.2f},encl:{int(self.encoder_left)},"
+                            f"encr:{int(self.encoder_right)}\n")
+                next_telemetry = now + self.telemetry_interval
+
+    def _disconnect(self, duration: float):
+        """设备消失 duration 秒"""
+        self.disconnects += 1
+        self.logger.info(f"虚拟小车断线 {duration:.2f}s")
+        self._close()
+        deadline = time.monotonic() + duration
+        while self.is_running and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if self.is_running:
+            self._open()
+            self.logger.info("虚拟小车已重新上线")
+
+    def _receive(self, data: bytes):
+        """解析收到的命令，按协议分别处理"""
+        receive_time = time.time()
+        now = time.monotonic()
+        if self.protocol == 'framed':
+            commands = []
+            for seq, frame_type, values in self.frame_parser.feed(data):
+                if frame_type == FRAME_STOP:
+                    commands.append(('S', WHEEL_SPEEDS['S'], seq))
+                else:
+                    speed = values.get(ACTUATOR_SPEED, 0) / 100.0
+                    steering = values.get(ACTUATOR_STEERING, 0) / 100.0
+                    wheels = (max(-1.0, min(1.0, speed + steering)),
+                              max(-1.0, min(1.0, speed - steering)))
+                    commands.append((values_to_legacy(values), wheels, seq))
+            self.invalid_bytes = self.frame_parser.bad_frames
+        else:
+            commands = []
+            for byte in data:
+                command = chr(byte)
+                if command not in WHEEL_SPEEDS:
+                    self.invalid_bytes += 1
+                    continue
+                commands.append((command, WHEEL_SPEEDS[command], command))
+
+        for command, wheels, ack in commands:
+            with self.condition:
+                self.received.append((receive_time, command))
+                self.command_count += 1
+                self.condition.notify_all()
+            self.pending.append((now + self.latency, command, wheels, ack))
+
+    def _apply_pending(self, now: float):
+        """执行已到处理时间的命令并回复确认（帧协议回复帧序号）"""
+        while self.pending and self.pending[0][0] <= now:
+            _, command, wheels, ack = self.pending.popleft()
+            self._update(now)
+            self.command = command
+            self.wheel_speeds = wheels
+            self._write(f"ack:{ack}\n")
+
+    def _update(self, now: float):
+        """按当前轮速积分编码器计数和电池消耗"""
+        elapsed = now - self.last_update
+        self.last_update = now
+        left, right = self.wheel_speeds
+        self.encoder_left += left * TICKS_PER_SECOND * elapsed
+        self.encoder_right += right * TICKS_PER_SECOND * elapsed
+        load = (abs(left) + abs(right)) / 2
+        self.battery = max(6.0, self.battery - (0.0005 + 0.002 * load) * elapsed)
+
+    def _write(self, line: str):
+        """写出一行遥测，对端不读取导致缓冲区满时丢弃"""
+        try:
+            os.write(self.master_fd, line.encode())
+            self.telemetry_sent += 1
+        except (BlockingIOError, OSError):
+            self.telemetry_dropped += 1
+
+    def wait_for_command(self, command: str, since: int, timeout: float = 1.0) -> Optional[float]:
+        """等待第 since 条之后出现的指定命令，返回其接收时间，超时返回 None"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                # received 只保留最近的记录，按总数换算下标
+                start = max(0, since - (self.command_count - len(self.received)))
+                for index in range(start, len(self.received)):
+                    receive_time, received = self.received[index]
+                    if received == command:
+                        return receive_time
+                since = self.command_count
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def get_status(self) -> dict:
+        """获取模拟器状态"""
+        return {
+            'running': self.is_running,
+            'link': self.link,
+            'protocol': self.protocol,
+            'online': self.master_fd is not None,
+            'command': self.command,
+            'commands_received': self.command_count,
+            'invalid_bytes': self.invalid_bytes,
+            'telemetry_sent': self.telemetry_sent,
+            'telemetry_dropped': self.telemetry_dropped,
+            'disconnects': self.disconnects,
+            'battery': round(self.battery, 3),
+            'encoders': (int(self.encoder_left), int(self.encoder_right))
+        }
+
+def create_simulator() -> CarSimulator:
+    """按 [simulator] 配置创建模拟器"""
+    return CarSimulator(
+        link=config_manager.get('simulator', 'link', '/tmp/ttyCAR'),
+        latency=config_manager.getfloat('simulator', 'latency_ms', 0.0) / 1000.0,
+        telemetry_interval=config_manager.getfloat('simulator', 'telemetry_interval', 0.1),
+        disconnect_interval=config_manager.getfloat('simulator', 'disconnect_interval', 0.0),
+        disconnect_duration=config_manager.getfloat('simulator', 'disconnect_duration', 0.5),
+        protocol=config_manager.get('serial', 'protocol', 'legacy')
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='虚拟小车模拟器')
+    parser.add_argument('--link', help='伪终端链接路径（默认取 [simulator] link）')
+    parser.add_argument('--latency-ms', type=float, help='命令处理延迟 (毫秒)')
+    parser.add_argument('--disconnect-interval', type=float, help='自动断线间隔 (秒)，0 为不断线')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    simulator = create_simulator()
+    if args.link:
+        simulator.link = args.link
+    if args.latency_ms is not None:
+        simulator.latency = args.latency_ms / 1000.0
+    if args.disconnect_interval is not None:
+        simulator.disconnect_interval = args.disconnect_interval
+
+    simulator.start()
+    print(f"虚拟小车已就绪，将 [serial] port 设置为 {simulator.link}，按 Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(5)
+            print(simulator.get_status())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+
+if __name__ == '__main__':
+    main()
@@ -10,45 +10,91 @@ import cv2
 import time
 import threading
 import logging
-from flask import Flask, render_template, Response, request, jsonify
+from flask import Flask, render_template, Response, request, jsonify, send_file, g
 from picamera2 import Picamera2
 import numpy as np
 import io
 import base64
 import os
 import sys
+import json
+import struct
 
 # 导入自定义模块
 from serial_handler import SerialHandler
 from connection_monitor import ConnectionMonitor
 from config_manager import config_manager
 
+# WebSocket 为可选依赖，未安装 flask-sock 时只提供 MJPEG 视频流
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+except ImportError:
+    Sock = None
+from frame_broadcaster import FrameBroadcaster, StreamProfile, SceneChangeDetector
+from photo_capture import PhotoWorker, CaptureSessionManager
+from video_recorder import SegmentRecorder
+from jpeg_encoder import create_encoder
+from control_watchdog import ControlWatchdog
+from telemetry import TelemetryBuffer
+from motion_protocol import clamp
+from control_arbiter import ControlArbiter, DUPLICATE, RATE_LIMITED, NOT_DRIVER
+from latency_stats import LatencyTracker
+from car_registry import create_car_registry
+from status_publisher import StatusPublisher
+from metrics_history import MetricsHistory, parse_range
+from metrics_exporter import MetricsRegistry, MetricFamily, Histogram, CONTENT_TYPE
+from web_server import create_server
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import WebsocketMismatch
+
 # 配置日志
 logger = config_manager.setup_logging()
 
 # 初始化Flask应用
 app = Flask(__name__)
+sock = Sock(app) if Sock else None
+
+# WebSocket 视频帧头: 序号(uint32) + 捕获时间(float64 秒)，大端
+WS_FRAME_HEADER = struct.Struct('>Id')
+# 未确认帧的最大数量（信用值）
+WS_VIDEO_CREDITS = 2
+# 控制通道确认帧等待命令写入串口的最长时间（秒）
+WS_CONTROL_ACK_WAIT = 0.2
+
+# 照片保存目录
+PHOTOS_DIR = '/home/lenovo/SWS/photos'
 
 # 全局变量
-serial_handler = None
+# 各小车的串口、摄像头和控制状态，由 [car.N] 配置节创建；
+# 连接监控、看门狗、延迟统计和拍照写盘线程由所有小车共用
+car_registry = create_car_registry()
 connection_monitor = None
-picam2 = None
-current_cmd = 'S'
-camera_active = False
+photo_worker = None
+control_watchdog = None
+latency_tracker = None
+status_publisher = None
+metrics_history = None
+metrics_registry = None
+request_duration = None
+web_server = None
 system_status = {
-    'serial_connected': False,
-    'camera_active': False,
     'network_connected': False,
-    'uptime': 0,
-    'last_command_time': 0
+    'uptime': 0
 }
 
+def get_car(car_id=None):
+    """按编号获取小车，car_id 为 None 时为默认小车（无前缀的路由使用）"""
+    return car_registry.get(car_id)
+
+def unknown_car(car_id):
+    return jsonify({'success': False, 'message': f'小车不存在: {car_id}'}), 404
+
 # 初始化串口处理器
-def init_serial():
-    global serial_handler, system_status
+def init_serial(car):
     try:
-        # 从配置文件获取串口参数
-        port = config_manager.get('serial', 'port', '/dev/ttyS0')
+        # 从配置文件获取串口参数，端口由小车配置指定
+        port = car.serial_port
         baudrate = config_manager.getint('serial', 'baudrate', 9600)
         timeout = config_manager.getint('serial', 'timeout', 1)
         max_retries = config_manager.getint('serial', 'max_retries', 5)
@@ -57,58 +103,152 @@ def init_serial():
             port=port, 
             baudrate=baudrate, 
             timeout=timeout,
-            max_retries=max_retries
+            max_retries=max_retries,
+            reconnect_interval=config_manager.getfloat('serial', 'reconnect_interval', 2.0),
+            reconnect_initial=config_manager.getfloat('serial', 'reconnect_initial', 0.05),
+            auto_reconnect=config_manager.getboolean('serial', 'auto_reconnect', True),
+            protocol=config_manager.get('serial', 'protocol', 'legacy')
         )
         
+        car.serial_handler = serial_handler
+        
         # 设置连接状态回调
-        serial_handler.on_connected = on_serial_connected
-        serial_handler.on_disconnected = on_serial_disconnected
+        serial_handler.on_connected = car.on_serial_connected
+        serial_handler.on_disconnected = car.on_serial_disconnected
+        
+        # 下位机输出的遥测帧由读串口线程解析
+        if config_manager.getboolean('serial', 'telemetry_enabled', True):
+            car.telemetry = TelemetryBuffer(
+                capacity=config_manager.getint('serial', 'telemetry_capacity', 2048)
+            )
+            serial_handler.on_receive = car.telemetry.feed
         
         # 尝试连接
         if serial_handler.connect():
-            system_status['serial_connected'] = True
-            logger.info(f"串口初始化成功: {port} @ {baudrate}")
+            car.status['serial_connected'] = True
+            logger.info(f"[{car.car_id}] 串口初始化成功: {port} @ {baudrate}")
             return True
         else:
-            logger.error("串口初始化失败")
+            logger.error(f"[{car.car_id}] 串口初始化失败" +
+                         ("，将在后台自动重连" if serial_handler.auto_reconnect else ""))
             return False
     except Exception as e:
-        logger.error(f"串口初始化异常: {e}")
+        logger.error(f"[{car.car_id}] 串口初始化异常: {e}")
         return False
 
-def on_serial_connected():
-    """串口连接成功回调"""
-    global system_status
-    system_status['serial_connected'] = True
-    logger.info("串口已连接")
+# 初始化控制看门狗
+def init_control_watchdog():
+    global control_watchdog
+    timeout = config_manager.getfloat('control', 'watchdog_timeout', 1.0)
+    if timeout <= 0:
+        logger.warning("控制看门狗已禁用")
+        return False
+    try:
+        control_watchdog = ControlWatchdog(timeout=timeout, on_expire=on_control_timeout)
+        control_watchdog.start()
+        return True
+    except Exception as e:
+        logger.error(f"控制看门狗初始化失败: {e}")
+        return False
 
-def on_serial_disconnected():
-    """串口断开连接回调"""
-    global system_status
-    system_status['serial_connected'] = False
-    logger.warning("串口连接丢失")
+# 初始化控制仲裁，每辆小车各有一个驾驶者
+def init_control_arbiter(car):
+    try:
+        car.control_arbiter = ControlArbiter(
+            rate=config_manager.getfloat('control', 'rate_limit', 20.0),
+            burst=config_manager.getfloat('control', 'rate_burst', 10.0),
+            dedup_window=config_manager.getfloat('control', 'dedup_window', 0.5),
+            driver_timeout=config_manager.getfloat('control', 'driver_timeout', 3.0)
+        )
+        return True
+    except Exception as e:
+        logger.error(f"控制仲裁初始化失败: {e}")
+        return False
+
+# 初始化控制延迟统计
+def init_latency_tracker():
+    global latency_tracker
+    if not config_manager.getboolean('latency', 'enabled', True):
+        logger.info("控制延迟统计已禁用")
+        return False
+    latency_tracker = LatencyTracker(
+        sample_rate=config_manager.getfloat('latency', 'sample_rate', 1.0)
+    )
+    return True
+
+def on_control_timeout(key, client_id):
+    """控制心跳超时回调 - 发出运动命令的客户端失联，自动停车（key 为小车编号）"""
+    car = get_car(key)
+    if car and car.current_cmd != 'S':
+        car.send_command('S')
+
+# 读取视频流档位配置
+def load_stream_profiles():
+    """从 [stream.*] 配置节读取视频流档位，返回 (档位配置列表, lores尺寸)"""
+    profiles = []
+    lores_size = None
+    default_encoder = config_manager.get('camera', 'encoder', 'opencv')
+    for section in config_manager.get_sections('stream.'):
+        name = section[len('stream.'):]
+        width = config_manager.getint(section, 'width', 640)
+        height = config_manager.getint(section, 'height', 480)
+        source = config_manager.get(section, 'source', 'scale')
+        
+        # 硬件 lores 输出只有一个尺寸，其余 lores 档位改为共享缩放
+        if source == 'lores':
+            if lores_size is None:
+                lores_size = (width, height)
+            elif lores_size != (width, height):
+                logger.warning(f"视频流档位 {name} 的 lores 尺寸与已有配置冲突，改用缩放")
+                source = 'scale'
+        
+        profiles.append({
+            'name': name,
+            'width': width,
+            'height': height,
+            'jpeg_quality': config_manager.getint(section, 'jpeg_quality', 85),
+            'fps': config_manager.getint(section, 'fps', 30),
+            'source': source,
+            'encoder': config_manager.get(section, 'encoder', default_encoder)
+        })
+    return profiles, lores_size
 
 # 初始化摄像头
-def init_camera():
-    global picam2, camera_active, system_status
+def init_camera(car):
+    if car.camera_num < 0:
+        return False
     try:
         # 从配置文件获取摄像头参数
         width = config_manager.getint('camera', 'width', 960)
         height = config_manager.getint('camera', 'height', 720)
+        pixel_format = config_manager.get('camera', 'format', 'RGB888')
+        _, lores_size = load_stream_profiles()
+        
+        # RGB888 在内存中为BGR顺序，可直接编码，无需逐帧颜色转换
+        main_config = {"size": (width, height), "format": pixel_format}
         
-        picam2 = Picamera2()
-        config = picam2.create_preview_configuration(main={"size": (width, height)})
+        picam2 = Picamera2(car.camera_num)
+        if lores_size:
+            config = picam2.create_preview_configuration(
+                main=main_config,
+                lores={"size": lores_size, "format": "YUV420"}
+            )
+        else:
+            config = picam2.create_preview_configuration(main=main_config)
         picam2.configure(config)
         picam2.start()
-        camera_active = True
-        system_status['camera_active'] = True
-        logger.info(f"摄像头初始化成功: {width}x{height}")
+        car.picam2 = picam2
+        car.camera_active = True
+        car.camera_has_lores = lores_size is not None
+        car.status['camera_active'] = True
+        logger.info(f"[{car.car_id}] 摄像头 {car.camera_num} 初始化成功: {width}x{height} {pixel_format}"
+                    + (f", lores: {lores_size[0]}x{lores_size[1]}" if lores_size else ""))
         time.sleep(2)  # 等待摄像头稳定
         return True
     except Exception as e:
-        logger.error(f"摄像头初始化失败: {e}")
-        camera_active = False
-        system_status['camera_active'] = False
+        logger.error(f"[{car.car_id}] 摄像头初始化失败: {e}")
+        car.camera_active = False
+        car.status['camera_active'] = False
         return False
 
 # 初始化连接监控
@@ -118,7 +258,15 @@ def init_monitor():
         # 从配置文件获取监控参数
         check_interval = config_manager.getfloat('monitor', 'check_interval', 10.0)
         
-        connection_monitor = ConnectionMonitor(check_interval=check_interval)
+        connection_monitor = ConnectionMonitor(
+            check_interval=check_interval,
+            probe_interval=config_manager.getfloat('monitor', 'probe_interval', 30.0),
+            probe_host=config_manager.get('monitor', 'probe_host', '8.8.8.8'),
+            probe_port=config_manager.getint('monitor', 'probe_port', 53),
+            probe_timeout=config_manager.getfloat('monitor', 'probe_timeout', 2.0),
+            sample_interval=config_manager.getfloat('metrics', 'sample_interval', 1.0)
+                if metrics_history else None
+        )
         
         # 设置警告阈值
         temp_threshold = config_manager.getfloat('monitor', 'temp_threshold', 70.0)
@@ -134,6 +282,8 @@ def init_monitor():
         # 设置回调函数
         connection_monitor.on_network_change = on_network_change
         connection_monitor.on_system_alert = on_system_alert
+        if metrics_history:
+            connection_monitor.on_sample = on_monitor_sample
         
         # 启动监控
         connection_monitor.start_monitoring()
@@ -143,153 +293,400 @@ def init_monitor():
         logger.error(f"连接监控初始化失败: {e}")
         return False
 
+# 记录到指标历史的监控数值
+METRIC_SERIES = ('cpu_percent', 'memory_percent', 'disk_percent', 'temperature',
+                 'rx_rate', 'tx_rate')
+
+# 初始化指标历史
+def init_metrics_history():
+    global metrics_history
+    if not config_manager.getboolean('metrics', 'enabled', True):
+        logger.info("指标历史已禁用")
+        return False
+    try:
+        metrics_history = MetricsHistory(
+            series=METRIC_SERIES,
+            path=config_manager.get('metrics', 'history_file', 'metrics_history.npz')
+        )
+        metrics_history.load()
+        return True
+    except Exception as e:
+        logger.error(f"指标历史初始化失败: {e}")
+        return False
+
+def on_monitor_sample(network_status, system_status):
+    """监控采样回调 - 记录到指标历史"""
+    metrics_history.record({**system_status, 'rx_rate': network_status['rx_rate'],
+                            'tx_rate': network_status['tx_rate']})
+
 def on_network_change(network_status):
     """网络状态改变回调"""
     global system_status
     system_status['network_connected'] = network_status['connected']
+    if status_publisher:
+        status_publisher.notify()
     if network_status['connected']:
         logger.info(f"网络已连接: {network_status['interface']} - {network_status['ip']}")
     else:
         logger.warning("网络连接丢失")
 
+# 初始化 Prometheus 指标导出
+def init_metrics_exporter():
+    global metrics_registry, request_duration
+    if not config_manager.getboolean('metrics', 'exporter', True):
+        logger.info("指标导出已禁用")
+        return False
+    metrics_registry = MetricsRegistry()
+    request_duration = metrics_registry.register(Histogram(
+        'sws_http_request_duration_seconds',
+        '请求处理耗时 (流式响应只计到开始输出)',
+        ('route', 'method', 'status')
+    ))
+    metrics_registry.add_collector(collect_stream_metrics)
+    metrics_registry.add_collector(collect_serial_metrics)
+    metrics_registry.add_collector(collect_monitor_metrics)
+    return True
+
+def collect_stream_metrics():
+    """收集摄像头和视频流指标"""
+    captured = MetricFamily('sws_camera_frames_captured', 'counter', '摄像头捕获的帧数')
+    static = MetricFamily('sws_camera_encodes_skipped_static', 'counter', '静止画面跳过的编码次数')
+    encoded = MetricFamily('sws_stream_frames_encoded', 'counter', '各档位编码的帧数')
+    republished = MetricFamily('sws_stream_frames_republished', 'counter',
+                               '各档位静止画面保活重发的帧数（不计入编码帧数）')
+    dropped = MetricFamily('sws_stream_frames_dropped', 'counter', '客户端跳过的帧数（含已断开的客户端）')
+    streamed = MetricFamily('sws_stream_bytes', 'counter', '视频流发送的字节数（含已断开的客户端）')
+    clients = MetricFamily('sws_stream_clients', 'gauge', '当前视频流客户端数')
+    encode_time = MetricFamily('sws_stream_encode_seconds', 'histogram', '每帧JPEG编码耗时')
+    client_bytes = MetricFamily('sws_stream_client_bytes', 'counter', '每个视频流客户端发送的字节数')
+    client_dropped = MetricFamily('sws_stream_client_frames_dropped', 'counter', '每个视频流客户端跳过的帧数')
+    for car in car_registry.all():
+        broadcaster = car.frame_broadcaster
+        if not broadcaster:
+            continue
+        captured.add({'car': car.car_id}, broadcaster.frames_captured)
+        static.add({'car': car.car_id}, broadcaster.frames_static)
+        for profile in broadcaster.profiles.values():
+            labels = {'car': car.car_id, 'profile': profile.name}
+            # 先读已断开客户端的累计值再读当前客户端，客户端恰好断开时少计而不会重复计
+            closed_bytes, closed_skipped = profile.closed_bytes_sent, profile.closed_frames_skipped
+            active = list(profile.clients)
+            encoded.add(labels, profile.frames_encoded)
+            republished.add(labels, profile.frames_republished)
+            clients.add(labels, len(active))
+            streamed.add(labels, closed_bytes + sum(c.bytes_sent for c in active))
+            dropped.add(labels, closed_skipped + sum(c.frames_skipped for c in active))
+            encode_time.add_histogram(labels, profile.encode_time)
+            for client in active:
+                client_labels = {**labels, 'client': client.client_id, 'addr': client.name}
+                client_bytes.add(client_labels, client.bytes_sent)
+                client_dropped.add(client_labels, client.frames_skipped)
+    return [captured, static, encoded, republished, dropped, streamed, clients, encode_time,
+            client_bytes, client_dropped]
+
+def collect_serial_metrics():
+    """收集串口指标"""
+    families = {
+        'bytes_written': MetricFamily('sws_serial_bytes_written', 'counter', '写入串口的字节数'),
+        'bytes_received': MetricFamily('sws_serial_bytes_received', 'counter', '从串口读取的字节数'),
+        'writes': MetricFamily('sws_serial_writes', 'counter', '串口 write() 次数'),
+        'commands_sent': MetricFamily('sws_serial_commands_written', 'counter', '写入串口的命令数'),
+        'commands_coalesced': MetricFamily('sws_serial_commands_coalesced', 'counter', '在队列中被合并的命令数'),
+        'commands_rejected': MetricFamily('sws_serial_commands_rejected', 'counter', '入队被拒绝的命令数'),
+        'commands_failed': MetricFamily('sws_serial_commands_failed', 'counter', '写入失败的命令数'),
+        'reconnect_attempts': MetricFamily('sws_serial_reconnect_attempts', 'counter', '自动重连尝试次数'),
+        'reconnect_successes': MetricFamily('sws_serial_reconnects', 'counter', '自动重连成功次数'),
+        'disconnect_count': MetricFamily('sws_serial_disconnects', 'counter', '串口异常断开次数')
+    }
+    connected = MetricFamily('sws_serial_connected', 'gauge', '串口是否已连接')
+    queue_depth = MetricFamily('sws_serial_queue_depth', 'gauge', '串口写入队列长度')
+    for car in car_registry.all():
+        handler = car.serial_handler
+        if not handler:
+            continue
+        labels = {'car': car.car_id}
+        for attr, family in families.items():
+            family.add(labels, getattr(handler, attr))
+        connected.add(labels, 1 if car.status['serial_connected'] else 0)
+        queue_depth.add(labels, handler.queue_depth)
+    return list(families.values()) + [connected, queue_depth]
+
+def collect_monitor_metrics():
+    """收集连接监控的仪表（读取监控线程最近一次采样）"""
+    if not connection_monitor:
+        return []
+    network = connection_monitor.network_status
+    system = connection_monitor.system_status
+    reachable = network['reachable']
+    return [
+        MetricFamily('sws_system_cpu_percent', 'gauge', 'CPU 使用率').add({}, system['cpu_percent']),
+        MetricFamily('sws_system_memory_percent', 'gauge', '内存使用率').add({}, system['memory_percent']),
+        MetricFamily('sws_system_disk_percent', 'gauge', '磁盘使用率').add({}, system['disk_percent']),
+        MetricFamily('sws_system_temperature_celsius', 'gauge', 'CPU 温度').add({}, system['temperature']),
+        MetricFamily('sws_network_connected', 'gauge', '网卡是否有地址').add({}, int(network['connected'])),
+        MetricFamily('sws_network_reachable', 'gauge', '连通性探测结果（未探测时无样本）')
+            .add({}, None if reachable is None else int(reachable)),
+        MetricFamily('sws_network_receive_bytes_per_second', 'gauge', '网卡接收速率')
+            .add({'interface': network['interface']}, network['rx_rate']),
+        MetricFamily('sws_network_transmit_bytes_per_second', 'gauge', '网卡发送速率')
+            .add({'interface': network['interface']}, network['tx_rate']),
+        MetricFamily('sws_monitor_samples', 'counter', '监控采样次数').add({}, connection_monitor.samples),
+        MetricFamily('sws_monitor_probe_failures', 'counter', '连通性探测失败次数')
+            .add({}, connection_monitor.probe_failures)
+    ]
+
+# 初始化状态推送
+def init_status_publisher():
+    global status_publisher
+    try:
+        status_publisher = StatusPublisher(
+            build_stream_state,
+            interval=config_manager.getfloat('network', 'status_push_interval', 0.5)
+        )
+        for car in car_registry.all():
+            car.on_change = status_publisher.notify
+        status_publisher.start()
+        return True
+    except Exception as e:
+        logger.error(f"状态推送初始化失败: {e}")
+        return False
+
+def build_stream_state():
+    """状态推送的内容：只包含变化时才需要推送的字段
+
+    运行时间由页面按 start_time 自行计算，监控数值取一位小数，避免每次生成都产生增量。
+    """
+    monitor = {}
+    if connection_monitor:
+        monitor_status = connection_monitor.get_status()
+        network = monitor_status['network']
+        monitor = {
+            'network': {'connected': network['connected'], 'interface': network['interface'],
+                        'ip': network['ip']},
+            'system': {key: round(value, 1) for key, value in monitor_status['system'].items()
+                       if key != 'last_check'},
+            'thresholds': monitor_status['thresholds']
+        }
+    
+    cars = {}
+    for car in car_registry.all():
+        serial_status = car.serial_handler.get_status() if car.serial_handler else {}
+        cars[car.car_id] = {
+            'name': car.name,
+            'current_cmd': car.current_cmd,
+            'serial_connected': car.status['serial_connected'],
+            'camera_active': car.status['camera_active'],
+            'serial_state': serial_status.get('state', ''),
+            'retry_count': serial_status.get('retry_count', 0),
+            'driver': car.control_arbiter.driver if car.control_arbiter else None
+        }
+    
+    return {
+        'system': {
+            'start_time': start_time,
+            'network_connected': system_status['network_connected'],
+            'monitor': monitor,
+            'latency': latency_tracker.get_compact() if latency_tracker else {}
+        },
+        'cars': cars
+    }
+
 def on_system_alert(alerts):
     """系统警告回调"""
     for alert in alerts:
         logger.warning(f"系统警告: {alert}")
 
-# 发送控制命令
-def send_command(cmd):
-    global serial_handler, current_cmd, system_status
-    if serial_handler and serial_handler.is_connected:
-        try:
-            if serial_handler.send_command(cmd):
-                current_cmd = cmd
-                system_status['last_command_time'] = time.time()
-                logger.info(f"已发送命令: {cmd}")
-                return True
-            else:
-                logger.error("发送命令失败")
-                return False
-        except Exception as e:
-            logger.error(f"发送命令异常: {e}")
-            return False
-    else:
-        logger.warning("串口未连接，无法发送命令")
+# 初始化帧广播，每个摄像头一个采集线程
+def init_frame_broadcaster(car):
+    try:
+        # 从配置文件获取帧率和视频流档位
+        fps = config_manager.getint('camera', 'fps', 30)
+        default_profile = config_manager.get('camera', 'default_profile', 'high')
+        profile_configs, _ = load_stream_profiles()
+        
+        # 每个档位按配置选择编码后端，硬件编码器不可用时自动回退
+        profiles = []
+        for cfg in profile_configs:
+            encoder = create_encoder(
+                cfg.pop('encoder'),
+                jpeg_quality=cfg['jpeg_quality'],
+                fps=cfg['fps'],
+                camera_getter=car.get_camera,
+                stream_name=cfg['source']
+            )
+            profiles.append(StreamProfile(encoder=encoder, **cfg))
+        
+        frame_broadcaster = FrameBroadcaster(
+            capture_func=car.capture_frame,
+            profiles=profiles,
+            default_profile=default_profile,
+            fps=fps,
+            pixel_format=config_manager.get('camera', 'format', 'RGB888'),
+            snapshot_frames=config_manager.getint('camera', 'snapshot_frames', 15)
+        )
+        frame_broadcaster.on_error_limit = lambda: reinit_camera(car)
+        car.frame_broadcaster = frame_broadcaster
+        
+        # 静止画面检测，阈值为 0 时关闭
+        static_threshold = config_manager.getfloat('camera', 'static_threshold', 2.0)
+        if static_threshold > 0:
+            frame_broadcaster.scene_detector = SceneChangeDetector(
+                threshold=static_threshold,
+                static_seconds=config_manager.getfloat('camera', 'static_seconds', 2.0),
+                keepalive_fps=config_manager.getfloat('camera', 'static_keepalive_fps', 1.0)
+            )
+        
+        frame_broadcaster.start()
+        return True
+    except Exception as e:
+        logger.error(f"[{car.car_id}] 帧广播初始化失败: {e}")
+        return False
+
+def car_file_prefix(car):
+    """多车时照片文件名带小车编号前缀，单车保持原有文件名"""
+    return f'car{car.car_id}_' if len(car_registry.all()) > 1 else ''
+
+# 初始化拍照写盘线程（所有小车共用）
+def init_photo_worker():
+    global photo_worker
+    if photo_worker:
+        return True
+    try:
+        photo_worker = PhotoWorker(
+            photos_dir=PHOTOS_DIR,
+            jpeg_quality=config_manager.getint('camera', 'photo_quality', 95),
+            max_pending=config_manager.getint('camera', 'photo_queue_size', 32)
+        )
+        photo_worker.start()
+        return True
+    except Exception as e:
+        logger.error(f"拍照写盘线程初始化失败: {e}")
+        return False
+
+# 初始化 car 的连拍和定时拍摄
+def init_capture_manager(car):
+    if not photo_worker:
+        return False
+    # 连拍和定时拍摄从最近帧缓存取帧，与视频流共用同一采集线程
+    car.capture_manager = CaptureSessionManager(
+        worker=photo_worker,
+        frame_source=car.frame_broadcaster.get_snapshot,
+        prefix=car_file_prefix(car)
+    )
+    return True
+
+# 初始化 car 的录像模块，多车时每辆车录像到 output_dir 下以编号命名的子目录
+def init_recorder(car):
+    output_dir = config_manager.get('recorder', 'output_dir', '/home/lenovo/SWS/recordings')
+    if len(car_registry.all()) > 1:
+        output_dir = os.path.join(output_dir, car.car_id)
+    try:
+        car.video_recorder = SegmentRecorder(
+            broadcaster=car.frame_broadcaster,
+            output_dir=output_dir,
+            profile_name=config_manager.get('recorder', 'profile', 'mid'),
+            segment_seconds=config_manager.getfloat('recorder', 'segment_seconds', 60.0),
+            preroll_seconds=config_manager.getfloat('recorder', 'preroll_seconds', 5.0),
+            max_total_mb=config_manager.getfloat('recorder', 'max_total_mb', 1024.0)
+        )
+        # 启用时开机即以被动订阅者维护预录缓冲（只在采集运行时），否则在第一次录像时启动
+        if config_manager.getboolean('recorder', 'enabled', True):
+            car.video_recorder.start()
+        return True
+    except Exception as e:
+        logger.error(f"[{car.car_id}] 录像模块初始化失败: {e}")
         return False
 
 # 生成摄像头帧
-def generate_frames():
-    global picam2, camera_active
-    frame_count = 0
-    error_count = 0
-    max_errors = 10
-    
-    # 从配置文件获取JPEG质量
-    jpeg_quality = config_manager.getint('camera', 'jpeg_quality', 85)
-    fps = config_manager.getint('camera', 'fps', 30)
-    frame_interval = 1.0 / fps  # 帧间隔
-    
-    logger.info(f"开始生成视频帧，质量: {jpeg_quality}, FPS: {fps}")
+def generate_frames(car, client_name='', profile_name=None):
+    """视频流客户端 - 按自身节拍取共享的最新帧输出，不自行捕获或编码"""
+    frame_broadcaster = car.frame_broadcaster
+    if not frame_broadcaster:
+        return
     
-    while camera_active:
-        try:
-            if picam2:
-                # 捕获帧
-                frame = picam2.capture_array()
-                
-                # 检查帧是否有效
-                if frame is None or frame.size == 0:
-                    error_count += 1
-                    logger.warning(f"捕获到空帧 (错误计数: {error_count})")
-                    time.sleep(0.1)
-                    continue
-                
-                # 确保颜色空间转换正确
-                if len(frame.shape) == 3:
-                    if frame.shape[2] == 3:  # RGB
-                        # 如果是RGB，转换为BGR用于OpenCV
-                        frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                    else:  # 可能是RGBA
-                        frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-                else:
-                    # 灰度图像
-                    frame_bgr = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-                
-                # 编码为JPEG，使用更兼容的参数
-                encode_param = [
-                    cv2.IMWRITE_JPEG_QUALITY, jpeg_quality,
-                    cv2.IMWRITE_JPEG_PROGRESSIVE, 0,  # 禁用渐进式JPEG
-                    cv2.IMWRITE_JPEG_OPTIMIZE, 1      # 启用优化
-                ]
-                
-                ret, buffer = cv2.imencode('.jpg', frame_bgr, encode_param)
-                
-                if ret and buffer is not None:
-                    frame_bytes = buffer.tobytes()
-                    
-                    # 确保帧数据不为空
-                    if len(frame_bytes) > 0:
-                        # 使用标准的多部分响应格式
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n'
-                               b'Content-Length: ' + str(len(frame_bytes)).encode() + b'\r\n'
-                               b'\r\n' + frame_bytes + b'\r\n')
-                        
-                        frame_count += 1
-                        error_count = 0  # 重置错误计数
-                        
-                        # 每1000帧记录一次统计
-                        if frame_count % 1000 == 0:
-                            logger.info(f"已生成 {frame_count} 帧")
-                    else:
-                        error_count += 1
-                        logger.warning(f"编码后帧数据为空 (错误计数: {error_count})")
-                else:
-                    error_count += 1
-                    logger.warning(f"帧编码失败 (错误计数: {error_count})")
-                
-        except Exception as e:
-            error_count += 1
-            logger.error(f"摄像头帧生成错误: {e} (错误计数: {error_count})")
+    client = frame_broadcaster.add_client(client_name, profile_name)
+    try:
+        while car.camera_active and frame_broadcaster.is_running:
+            frame_bytes = client.next_frame(timeout=1.0)
+            if frame_bytes is None:
+                continue
             
-            # 如果错误过多，尝试重新初始化摄像头
-            if error_count >= max_errors:
-                logger.warning("摄像头错误过多，尝试重新初始化")
-                if reinit_camera():
-                    error_count = 0
-                    frame_count = 0  # 重置帧计数
-                else:
-                    logger.error("摄像头重新初始化失败")
-                    break
-        
-        time.sleep(frame_interval)
-
-def reinit_camera():
+            # 使用标准的多部分响应格式
+            write_start = time.monotonic()
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n'
+                   b'Content-Length: ' + str(len(frame_bytes)).encode() + b'\r\n'
+                   b'\r\n' + frame_bytes + b'\r\n')
+            # 生成器恢复前服务器已完成该块的套接字写入
+            client.record_write(len(frame_bytes), time.monotonic() - write_start)
+    finally:
+        frame_broadcaster.remove_client(client)
+
+def reinit_camera(car):
     """重新初始化摄像头"""
-    global picam2, camera_active
     try:
-        if picam2:
-            picam2.stop()
-            picam2.close()
+        if car.picam2:
+            car.picam2.stop()
+            car.picam2.close()
             time.sleep(1)
         
-        return init_camera()
+        return init_camera(car)
     except Exception as e:
-        logger.error(f"重新初始化摄像头失败: {e}")
+        logger.error(f"[{car.car_id}] 重新初始化摄像头失败: {e}")
         return False
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    """按路由规则（而不是具体路径）记录请求耗时"""
+    if request_duration and 'request_start' in g:
+        rule = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_duration.labels(rule, request.method, response.status_code).observe(
+            time.perf_counter() - g.request_start)
+    return response
+
+def long_lived(view):
+    """标记长连接路由（视频流、WebSocket、状态推送），pooled 后端为其单独分配连接名额
+
+    需放在 @app.route 之下，使登记的视图函数带有该标记。
+    """
+    view.long_lived = True
+    return view
+
 # 路由定义
+# 每辆小车的路由带 /car/<car_id> 前缀，无前缀的路由对应默认小车
 @app.route('/')
-def index():
-    return render_template('car_control.html')
+@app.route('/car/<car_id>/')
+def index(car_id=None):
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    return render_template('car_control.html', websocket_enabled=sock is not None,
+                           heartbeat_interval=config_manager.getfloat('control', 'heartbeat_interval', 0.25),
+                           car_prefix=f'/car/{car_id}' if car_id is not None else '',
+                           car_id=car.car_id,
+                           car_name=car.name, cars=car_registry.get_status())
+
+@app.route('/cars')
+def cars():
+    """列出所有小车"""
+    return jsonify({'success': True, 'cars': car_registry.get_status()})
 
 @app.route('/video_feed')
-def video_feed():
-    """视频流端点 - 提供MJPEG视频流"""
+@app.route('/car/<car_id>/video_feed')
+@long_lived
+def video_feed(car_id=None):
+    """视频流端点 - 提供MJPEG视频流，可用 ?profile=low|mid|high 选择档位"""
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
     try:
         # 添加必要的响应头，确保兼容性
         response = Response(
-            generate_frames(),
+            generate_frames(car, request.remote_addr or '', request.args.get('profile')),
             mimetype='multipart/x-mixed-replace; boundary=frame',
             headers={
                 'Cache-Control': 'no-cache, no-store, must-revalidate',
@@ -308,7 +705,66 @@ def video_feed():
             mimetype='text/plain'
         )
 
+@long_lived
+def ws_video(ws, car_id=None):
+    """WebSocket 视频流 - 每条二进制消息为帧头 + JPEG
+
+    客户端显示一帧后回传该帧序号作为确认，服务器最多有 WS_VIDEO_CREDITS 帧未确认，
+    信用值用完时不再发送，客户端恢复后直接从最新帧继续。
+    """
+    car = get_car(car_id)
+    frame_broadcaster = car.frame_broadcaster if car else None
+    if not frame_broadcaster:
+        ws.close()
+        return
+    
+    client = frame_broadcaster.add_client(f"ws:{request.remote_addr or ''}",
+                                          request.args.get('profile'))
+    credits = WS_VIDEO_CREDITS
+    in_flight = {}  # 序号 -> 捕获时间
+    try:
+        while car.camera_active and frame_broadcaster.is_running and ws.connected:
+            # 处理客户端确认，信用值用完时阻塞等待
+            message = ws.receive(timeout=0 if credits > 0 else 1.0)
+            while message is not None:
+                try:
+                    capture_time = in_flight.pop(int(message), None)
+                except (TypeError, ValueError):
+                    capture_time = None
+                if capture_time is not None:
+                    credits += 1
+                    client.record_ack(time.time() - capture_time)
+                message = ws.receive(timeout=0)
+            
+            if credits <= 0:
+                # 确认丢失时避免永久停止发送
+                if in_flight and time.time() - min(in_flight.values()) > 5.0:
+                    in_flight.clear()
+                    credits = WS_VIDEO_CREDITS
+                continue
+            
+            frame_bytes = client.next_frame(timeout=1.0)
+            if frame_bytes is None:
+                continue
+            
+            send_start = time.monotonic()
+            ws.send(WS_FRAME_HEADER.pack(client.last_seq, client.last_capture_time) + frame_bytes)
+            client.record_write(len(frame_bytes), time.monotonic() - send_start)
+            in_flight[client.last_seq] = client.last_capture_time
+            credits -= 1
+    except ConnectionClosed:
+        pass
+    except Exception as e:
+        logger.error(f"WebSocket 视频流错误: {e}")
+    finally:
+        frame_broadcaster.remove_client(client)
+
+if sock:
+    sock.route('/ws/video')(ws_video)
+    sock.route('/car/<car_id>/ws/video', endpoint='car_ws_video')(ws_video)
+
 @app.route('/video_test')
+@long_lived
 def video_test():
     """测试视频流端点 - 生成简单的测试图像"""
     def generate_test_frames():
@@ -359,44 +815,222 @@ def video_test():
         }
     )
 
-@app.route('/control', methods=['POST'])
-def control():
-    data = request.get_json()
-    command = data.get('command', 'S')
+# 命令映射
+CMD_MAP = {
+    'forward': 'F',
+    'backward': 'B',
+    'left': 'L',
+    'right': 'R',
+    'stop': 'S'
+}
+
+def process_control(car, command, client_id='', wait: float = 0.0, speed=0, steering=0,
+                    client_addr='', timing=None):
+    """处理一条控制命令（HTTP 和 WebSocket 共用），返回结果字典
+
+    command 为 drive 时按 speed 和 steering (-100 ~ 100) 连续控制，
+    串口使用旧版协议时会转换为最接近的单字节命令。
+    命令先经过仲裁：按 client_addr 限流，按 client_id 去重，非驾驶者只能停车。
+    运动命令由发出它的 client_id 负责维持心跳，超时由看门狗自动停车。
+    wait > 0 时最多等待该时长直到命令写入串口，结果中带上写入状态和时间。
+    timing 为延迟统计的时间戳（见 LatencyTracker.record_command），命令被抽样时记录各阶段耗时。
+    """
+    drive = None
+    if command == 'drive':
+        drive = (clamp(speed), clamp(steering))
+        cmd = 'D' if drive != (0, 0) else 'S'
+        if cmd == 'S':
+            drive = None
+    else:
+        cmd = CMD_MAP.get(command, 'S')
     
-    # 命令映射
-    cmd_map = {
-        'forward': 'F',
-        'backward': 'B',
-        'left': 'L',
-        'right': 'R',
-        'stop': 'S'
-    }
+    # 去重键：drive 命令带上速度和转向
+    key = ('D', drive) if drive else cmd
+    current_key = ('D', car.current_drive) if car.current_cmd == 'D' else car.current_cmd
+    if car.control_arbiter:
+        decision = car.control_arbiter.check(client_id, client_addr or client_id, key,
+                                         current_key, cmd == 'S')
+    else:
+        # 避免重复发送相同命令（除了停止命令）
+        decision = DUPLICATE if cmd != 'S' and key == current_key else None
     
-    cmd = cmd_map.get(command, 'S')
+    if decision in (RATE_LIMITED, NOT_DRIVER):
+        return {
+            'success': False,
+            'command': cmd,
+            'current_cmd': car.current_cmd,
+            'message': decision
+        }
     
-    # 避免重复发送相同命令（除了停止命令）
-    global current_cmd
-    if cmd != 'S' and current_cmd == cmd:
-        return jsonify({
+    if control_watchdog:
+        if cmd == 'S':
+            control_watchdog.disarm(car.car_id)
+        else:
+            # 重复的运动命令也会刷新截止时间，并把心跳责任交给最新发出命令的客户端
+            control_watchdog.arm(car.car_id, client_id)
+    
+    if decision == DUPLICATE:
+        return {
             'success': True,
             'command': cmd,
-            'current_cmd': current_cmd,
+            'current_cmd': car.current_cmd,
             'message': 'duplicate_command_ignored'
-        })
-    
-    success = send_command(cmd)
+        }
     
-    return jsonify({
-        'success': success,
+    on_done = None
+    if latency_tracker and timing and latency_tracker.should_sample():
+        on_done = lambda item: latency_tracker.record_command(item, timing)
+    item = car.send_command(cmd, drive, on_done)
+    result = {
+        'success': item is not None and item.status != 'rejected',
         'command': cmd,
-        'current_cmd': current_cmd
-    })
+        'current_cmd': car.current_cmd
+    }
+    if drive:
+        result['speed'], result['steering'] = drive
+    if item and item.status == 'rejected':
+        result['message'] = item.reason
+    elif item and wait > 0:
+        item.wait(wait)
+        result['status'] = item.status
+        result['wire_time'] = item.wire_time
+        if item.seq:
+            result['frame_seq'] = item.seq
+    return result
+
+@app.route('/control', methods=['POST'])
+@app.route('/car/<car_id>/control', methods=['POST'])
+def control(car_id=None):
+    received_time = time.time()
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    data = request.get_json()
+    command = data.get('command', 'S')
+    client_id = data.get('client_id') or request.remote_addr or ''
+    try:
+        speed = float(data.get('speed', 0))
+        steering = float(data.get('steering', 0))
+        timing = parse_timing(data.get('client_time'), data.get('keydown_delay'), received_time)
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'参数错误: {e}'}), 400
+    result = process_control(car, command, client_id, speed=speed, steering=steering,
+                             client_addr=request.remote_addr or '', timing=timing)
+    result['received_time'] = received_time
+    return jsonify(result)
+
+def parse_timing(client_time, keydown_delay, received_time):
+    """页面上报的时间戳（毫秒）转换为延迟统计使用的秒
+
+    client_time 为页面发出请求的时间，已由页面按估计的时钟偏差换算到服务器时钟，
+    页面尚未估计出偏差时为空。
+    """
+    return {
+        'received': received_time,
+        'client_time': float(client_time) / 1000.0 if client_time not in (None, '') else None,
+        'keydown_delay': float(keydown_delay) / 1000.0 if keydown_delay not in (None, '') else None
+    }
+
+@app.route('/heartbeat', methods=['POST'])
+@app.route('/car/<car_id>/heartbeat', methods=['POST'])
+def heartbeat(car_id=None):
+    """控制心跳 - 维持本客户端发出的运动命令"""
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    data = request.get_json(silent=True) or {}
+    client_id = data.get('client_id') or request.remote_addr or ''
+    if control_watchdog:
+        control_watchdog.feed(car.car_id, client_id)
+    if car.control_arbiter:
+        car.control_arbiter.touch(client_id)
+    return jsonify({'success': True, 'current_cmd': car.current_cmd})
+
+@long_lived
+def ws_control(ws, car_id=None):
+    """WebSocket 控制通道 - 一条长连接代替每次按键一个 HTTP 请求
+
+    客户端发送文本帧 "序号:命令"（如 "12:forward"，命令同 /control），
+    连续控制为 "序号:drive:速度:转向"（如 "13:drive:60:-20"），
+    命令后可附加 "@发出时间,按键延迟"（毫秒，同 /control 的 client_time 和 keydown_delay），
+    服务器对每条命令回复确认，包含序号、执行结果和串口写入时间。
+    命令为 heartbeat 时只刷新看门狗，不回复。
+    客户端标识由连接参数 ?client= 指定，默认使用远端地址和端口。
+    """
+    car = get_car(car_id)
+    if car is None:
+        ws.close()
+        return
+    client_name = request.remote_addr or ''
+    client_id = request.args.get('client') or \
+        f"{client_name}:{request.environ.get('REMOTE_PORT', '')}"
+    logger.info(f"控制通道已连接: {client_name}")
+    try:
+        while True:
+            message = ws.receive()
+            if message is None:
+                break
+            
+            received_time = time.time()
+            seq, sep, command = str(message).partition(':')
+            if not sep:
+                seq, command = '', seq
+            command, _, timing_field = command.strip().partition('@')
+            
+            if command == 'heartbeat':
+                if control_watchdog:
+                    control_watchdog.feed(car.car_id, client_id)
+                if car.control_arbiter:
+                    car.control_arbiter.touch(client_id)
+                continue
+            
+            speed = steering = 0
+            if command.startswith('drive:'):
+                try:
+                    _, speed, steering = command.split(':')
+                    command, speed, steering = 'drive', float(speed), float(steering)
+                except ValueError:
+                    ws.send(json.dumps({'seq': seq, 'success': False, 'message': 'invalid_drive'}))
+                    continue
+            
+            timing = {'received': received_time}
+            if timing_field:
+                try:
+                    client_time, _, keydown_delay = timing_field.partition(',')
+                    timing = parse_timing(client_time, keydown_delay, received_time)
+                except ValueError:
+                    pass
+            
+            # 确认帧需要带上串口写入时间，在本连接线程中短暂等待写入完成
+            result = process_control(car, command, client_id, wait=WS_CONTROL_ACK_WAIT,
+                                     speed=speed, steering=steering, client_addr=client_name,
+                                     timing=timing)
+            result['seq'] = seq
+            result['received_time'] = received_time
+            result.setdefault('wire_time', 0)
+            ws.send(json.dumps(result, separators=(',', ':')))
+    except ConnectionClosed:
+        pass
+    except Exception as e:
+        logger.error(f"控制通道错误: {e}")
+    finally:
+        # 驾驶者关闭页面后其他客户端无需等待租约到期
+        if car.control_arbiter:
+            car.control_arbiter.release(client_id)
+        logger.info(f"控制通道已断开: {client_name}")
+
+if sock:
+    sock.route('/ws/control')(ws_control)
+    sock.route('/car/<car_id>/ws/control', endpoint='car_ws_control')(ws_control)
 
 @app.route('/status')
-def status():
-    """获取系统状态"""
+@app.route('/car/<car_id>/status')
+def status(car_id=None):
+    """获取系统状态和小车状态"""
     global system_status, connection_monitor
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
     
     # 更新运行时间
     system_status['uptime'] = time.time() - start_time
@@ -408,37 +1042,168 @@ def status():
     
     # 获取串口状态
     serial_status = {}
-    if serial_handler:
-        serial_status = serial_handler.get_status()
+    if car.serial_handler:
+        serial_status = car.serial_handler.get_status()
+    
+    # 获取视频流状态
+    stream_status = {}
+    if car.frame_broadcaster:
+        stream_status = car.frame_broadcaster.get_status()
+    if photo_worker:
+        stream_status['photo_worker'] = photo_worker.get_status()
+    
+    # 获取控制看门狗和仲裁状态
+    watchdog_status = {}
+    if control_watchdog:
+        watchdog_status = control_watchdog.get_status()
+    control_status = {}
+    if car.control_arbiter:
+        control_status = car.control_arbiter.get_status()
+        if car.serial_handler:
+            control_status['coalesced'] = car.serial_handler.commands_coalesced
+            control_status['serial_rejected'] = car.serial_handler.commands_rejected
+    
+    # 控制延迟各阶段 p50/p99
+    latency_status = {}
+    if latency_tracker:
+        latency_status = latency_tracker.get_compact()
+    
+    # 获取遥测最新值
+    telemetry_status = {}
+    if car.telemetry:
+        telemetry_status = car.telemetry.get_status()
+        telemetry_status['latest'] = car.telemetry.get_latest()
     
     return jsonify({
-        'current_cmd': current_cmd,
-        'system_status': system_status,
+        'car': car.car_id,
+        'current_cmd': car.current_cmd,
+        'system_status': {**system_status, **car.status},
+        'watchdog_status': watchdog_status,
+        'control_status': control_status,
+        'latency': latency_status,
+        'status_stream': status_publisher.get_status() if status_publisher else {},
+        'metrics_history': metrics_history.get_status() if metrics_history else {},
+        'metrics_exporter': metrics_registry.get_status() if metrics_registry else {},
+        'web_server': web_server.get_status() if web_server else {'backend': 'werkzeug'},
+        'telemetry': telemetry_status,
         'monitor_status': monitor_status,
         'serial_status': serial_status,
+        'stream_status': stream_status,
+        'timestamp': time.time()
+    })
+
+@app.route('/status/stream')
+@long_lived
+def status_stream():
+    """状态推送 (Server-Sent Events)
+
+    连接后先发送一次完整快照 (event: snapshot)，包含 system 和所有小车 cars，
+    之后只在状态变化时发送增量 (event: delta，JSON Merge Patch)。
+    """
+    if not status_publisher:
+        return jsonify({'success': False, 'message': '状态推送未启用'})
+    return Response(
+        status_publisher.events(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 指标 (文本格式)"""
+    if not metrics_registry:
+        return jsonify({'success': False, 'message': '指标导出未启用'}), 404
+    return Response(metrics_registry.render(), content_type=CONTENT_TYPE)
+
+@app.route('/metrics/history')
+def metrics_history_route():
+    """获取监控指标历史
+
+    参数: series 逗号分隔的序列名（默认全部），range 时间范围（秒或 90s/10m/24h/7d，默认10分钟）。
+    按范围自动选择分辨率：10分钟内每秒，24小时内每10秒，7天内每分钟，每点含 min/max/avg。
+    """
+    if not metrics_history:
+        return jsonify({'success': False, 'message': '指标历史未启用'})
+    
+    series = request.args.get('series', '')
+    names = [name.strip() for name in series.split(',') if name.strip()]
+    try:
+        seconds = parse_range(request.args.get('range', ''))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'参数错误: {e}'}), 400
+    return jsonify({
+        'success': True,
+        'range': seconds,
+        **metrics_history.get_history(names or None, seconds),
         'timestamp': time.time()
     })
 
+@app.route('/telemetry/history')
+@app.route('/car/<car_id>/telemetry/history')
+def telemetry_history(car_id=None):
+    """获取遥测历史数据
+
+    参数: channels 逗号分隔的通道名（默认全部），seconds 时间窗口（默认60秒）
+    """
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    telemetry = car.telemetry
+    if not telemetry:
+        return jsonify({'success': False, 'message': '遥测未启用'})
+    
+    channels = request.args.get('channels', '')
+    names = [name.strip() for name in channels.split(',') if name.strip()]
+    seconds = request.args.get('seconds', 60.0, type=float)
+    return jsonify({
+        'success': True,
+        'seconds': seconds,
+        'channels': telemetry.get_history(names or None, seconds),
+        'timestamp': time.time()
+    })
+
+@app.route('/latency')
+def latency():
+    """获取控制延迟统计：各阶段的计数、最小/平均/最大值和 p50/p90/p99/p99.9（毫秒）"""
+    if not latency_tracker:
+        return jsonify({'success': False, 'message': '延迟统计未启用'})
+    return jsonify({'success': True, **latency_tracker.get_status(), 'timestamp': time.time()})
+
+@app.route('/latency/reset', methods=['POST'])
+def latency_reset():
+    """清空控制延迟统计"""
+    if not latency_tracker:
+        return jsonify({'success': False, 'message': '延迟统计未启用'})
+    latency_tracker.reset()
+    return jsonify({'success': True})
+
 @app.route('/health')
 def health():
     """健康检查端点"""
+    cars = car_registry.all()
     return jsonify({
         'status': 'ok',
         'timestamp': time.time(),
         'services': {
-            'serial': system_status['serial_connected'],
-            'camera': system_status['camera_active'],
+            'serial': all(car.status['serial_connected'] for car in cars),
+            'camera': all(car.status['camera_active'] for car in cars if car.camera_num >= 0),
             'network': system_status['network_connected']
         }
     })
 
 # 添加新的路由用于手动重连
 @app.route('/reconnect', methods=['POST'])
-def reconnect():
+@app.route('/car/<car_id>/reconnect', methods=['POST'])
+def reconnect(car_id=None):
     """手动重连串口"""
-    global serial_handler
-    if serial_handler:
-        success = serial_handler.connect()
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    if car.serial_handler:
+        success = car.serial_handler.connect()
         return jsonify({
             'success': success,
             'message': '重连成功' if success else '重连失败'
@@ -452,28 +1217,32 @@ def video_debug():
 
 # 添加拍照功能
 @app.route('/capture_photo', methods=['POST'])
-def capture_photo():
-    """拍照功能 - 捕获当前帧并保存"""
-    global picam2, camera_active
-    
+@app.route('/car/<car_id>/capture_photo', methods=['POST'])
+def capture_photo(car_id=None):
+    """拍照功能 - 从最近帧缓存取帧，后台编码保存，立即返回任务编号
+
+    可选参数 offset_ms: 取多少毫秒之前的画面，用于补偿操作反应时间。
+    响应中 frame_age_ms 为所取画面在请求时的实际时长，offset_applied 表示 offset_ms 是否生效
+    （摄像头空闲时缓存为空，或 offset_ms 超出缓存范围时不能完全回溯）。
+    """
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
     try:
-        if not camera_active or not picam2:
+        frame_broadcaster = car.frame_broadcaster
+        if not car.camera_active or not frame_broadcaster or not photo_worker:
             return jsonify({
                 'success': False,
                 'message': '摄像头未激活',
                 'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
             })
         
-        # 生成照片文件名
-        timestamp = time.strftime('%Y%m%d_%H%M%S')
-        photo_filename = f"photo_{timestamp}.jpg"
-        photo_path = os.path.join('/home/lenovo/SWS/photos', photo_filename)
+        data = request.get_json(silent=True) or {}
+        offset_ms = max(0, int(data.get('offset_ms', request.args.get('offset_ms', 0))))
         
-        # 确保photos目录存在
-        os.makedirs('/home/lenovo/SWS/photos', exist_ok=True)
-        
-        # 捕获一帧
-        frame = picam2.capture_array()
+        # 从最近帧缓存取一帧，不在请求线程中捕获
+        request_time = time.time()
+        frame, frame_time = frame_broadcaster.get_snapshot(age=offset_ms / 1000.0)
         
         if frame is None or frame.size == 0:
             return jsonify({
@@ -482,26 +1251,28 @@ def capture_photo():
                 'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
             })
         
-        # 确保颜色空间正确
-        if len(frame.shape) == 3:
-            if frame.shape[2] == 3:  # RGB
-                frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-            else:  # RGBA
-                frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-        else:
-            frame_bgr = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-        
-        # 保存照片
-        cv2.imwrite(photo_path, frame_bgr, [cv2.IMWRITE_JPEG_QUALITY, 95])
-        
-        # 记录日志
-        logger.info(f"照片已保存: {photo_path}")
+        # 提交后台保存
+        job = photo_worker.submit(frame, frame_time, prefix=car_file_prefix(car) + 'photo')
+        if job is None:
+            return jsonify({
+                'success': False,
+                'message': '拍照队列已满，请稍后再试',
+                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+            })
         
+        # 所取画面与目标时刻相差不超过一帧即视为回溯生效
+        frame_age_ms = max(0, int((request_time - frame_time) * 1000))
+        offset_applied = frame_age_ms >= offset_ms - 1000 / frame_broadcaster.fps
         return jsonify({
             'success': True,
-            'message': '拍照成功',
-            'filename': photo_filename,
-            'path': photo_path,
+            'message': '拍照成功' if offset_applied else '拍照成功，最近帧缓存不足，未能回溯 offset_ms',
+            'job_id': job['job_id'],
+            'filename': job['filename'],
+            'path': job['path'],
+            'frame_time': frame_time,
+            'frame_age_ms': frame_age_ms,
+            'offset_applied': offset_applied,
+            'max_offset_ms': int(frame_broadcaster.max_snapshot_age * 1000),
             'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
         })
         
@@ -513,11 +1284,160 @@ def capture_photo():
             'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
         })
 
+@app.route('/photo_job/<job_id>')
+@app.route('/car/<car_id>/photo_job/<job_id>')
+def photo_job(job_id, car_id=None):
+    """查询拍照任务状态（任务编号在所有小车间唯一）"""
+    if not photo_worker:
+        return jsonify({'success': False, 'message': '拍照功能未初始化'})
+    
+    job = photo_worker.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/capture_burst', methods=['POST'])
+@app.route('/car/<car_id>/capture_burst', methods=['POST'])
+def capture_burst(car_id=None):
+    """连拍 - 参数 count (张数) 和 interval_ms (间隔毫秒)，立即返回任务编号"""
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    if not car.capture_manager or not car.camera_active:
+        return jsonify({'success': False, 'message': '摄像头未激活'})
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        count = int(data.get('count', 10))
+        interval_ms = float(data.get('interval_ms', 100))
+        session = car.capture_manager.start_burst(count, interval_ms / 1000.0)
+        return jsonify({'success': True, 'session': session.get_status()})
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'参数错误: {e}'}), 400
+
+@app.route('/capture_burst/<session_id>')
+@app.route('/car/<car_id>/capture_burst/<session_id>')
+def capture_burst_status(session_id, car_id=None):
+    """查询连拍或定时拍摄任务状态，包括因写盘跟不上而丢弃的帧数"""
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    session = car.capture_manager.get_session(session_id) if car.capture_manager else None
+    if session is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    return jsonify({'success': True, 'session': session.get_status()})
+
+@app.route('/timelapse/start', methods=['POST'])
+@app.route('/car/<car_id>/timelapse/start', methods=['POST'])
+def timelapse_start(car_id=None):
+    """开始定时拍摄 - 参数 interval_ms (间隔毫秒)，count 为 0 表示直到停止"""
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    if not car.capture_manager or not car.camera_active:
+        return jsonify({'success': False, 'message': '摄像头未激活'})
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        interval_ms = float(data.get('interval_ms', 1000))
+        count = int(data.get('count', 0))
+        session = car.capture_manager.start_timelapse(interval_ms / 1000.0, count)
+        return jsonify({'success': True, 'session': session.get_status()})
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'参数错误: {e}'}), 400
+
+@app.route('/timelapse/stop', methods=['POST'])
+@app.route('/car/<car_id>/timelapse/stop', methods=['POST'])
+def timelapse_stop(car_id=None):
+    """停止定时拍摄"""
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    session = car.capture_manager.stop_timelapse() if car.capture_manager else None
+    if session is None:
+        return jsonify({'success': False, 'message': '没有正在进行的定时拍摄'})
+    return jsonify({'success': True, 'session': session.get_status()})
+
+@app.route('/timelapse/status')
+@app.route('/car/<car_id>/timelapse/status')
+def timelapse_status(car_id=None):
+    """获取定时拍摄状态"""
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    if not car.capture_manager:
+        return jsonify({'success': False, 'message': '拍照功能未初始化'})
+    return jsonify({'success': True, **car.capture_manager.get_status()})
+
+@app.route('/record/start', methods=['POST'])
+@app.route('/car/<car_id>/record/start', methods=['POST'])
+def record_start(car_id=None):
+    """开始录像，包含点击前几秒的预录画面"""
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    recorder = car.video_recorder
+    if not recorder or not car.camera_active:
+        return jsonify({'success': False, 'message': '摄像头未激活'})
+    
+    response = {'success': True}
+    if not recorder.is_running:
+        # 录像模块此前未运行，预录缓冲为空
+        response['message'] = '预录缓冲未启用，本次录像不含点击前的画面'
+    recorder.start()
+    response['recorder'] = recorder.start_recording()
+    return jsonify(response)
+
+@app.route('/record/stop', methods=['POST'])
+@app.route('/car/<car_id>/record/stop', methods=['POST'])
+def record_stop(car_id=None):
+    """停止录像"""
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    if not car.video_recorder:
+        return jsonify({'success': False, 'message': '录像模块未初始化'})
+    return jsonify({'success': True, 'recorder': car.video_recorder.stop_recording()})
+
+@app.route('/record/status')
+@app.route('/car/<car_id>/record/status')
+def record_status(car_id=None):
+    """获取录像状态和分段列表"""
+    car = get_car(car_id)
+    if car is None:
+        return unknown_car(car_id)
+    if not car.video_recorder:
+        return jsonify({'success': False, 'message': '录像模块未初始化'})
+    return jsonify({
+        'success': True,
+        'recorder': car.video_recorder.get_status(),
+        'segments': car.video_recorder.list_segments()
+    })
+
+@app.route('/recordings/<filename>')
+@app.route('/car/<car_id>/recordings/<filename>')
+def download_recording(filename, car_id=None):
+    """下载录像分段"""
+    car = get_car(car_id)
+    if car is None or not car.video_recorder:
+        return Response("录像模块未初始化", status=404)
+    
+    output_dir = car.video_recorder.output_dir
+    file_path = os.path.join(output_dir, filename)
+    
+    # 安全检查，确保文件在录像目录内
+    if not os.path.abspath(file_path).startswith(os.path.abspath(output_dir)):
+        return Response("非法访问", status=403)
+    if not os.path.exists(file_path):
+        return Response("录像不存在", status=404)
+    
+    return send_file(file_path, mimetype='video/x-msvideo', as_attachment=True)
+
 @app.route('/get_photos')
 def get_photos():
     """获取照片列表"""
     try:
-        photos_dir = '/home/lenovo/SWS/photos'
+        photos_dir = PHOTOS_DIR
         if not os.path.exists(photos_dir):
             return jsonify({
                 'success': True,
@@ -559,7 +1479,7 @@ def get_photos():
 def view_photo(filename):
     """查看照片"""
     try:
-        photos_dir = '/home/lenovo/SWS/photos'
+        photos_dir = PHOTOS_DIR
         file_path = os.path.join(photos_dir, filename)
         
         if not os.path.exists(file_path):
@@ -582,7 +1502,7 @@ def view_photo(filename):
 def delete_photo(filename):
     """删除照片"""
     try:
-        photos_dir = '/home/lenovo/SWS/photos'
+        photos_dir = PHOTOS_DIR
         file_path = os.path.join(photos_dir, filename)
         
         if not os.path.exists(file_path):
@@ -625,10 +1545,23 @@ def init_all():
     
     logger.info("正在初始化系统...")
     
-    # 初始化各个组件
-    serial_ok = init_serial()
-    camera_ok = init_camera()
+    # 初始化各个组件，串口和摄像头按小车逐一初始化
+    serial_ok = camera_ok = False
+    for car in car_registry.all():
+        serial_ok = init_serial(car) or serial_ok
+        init_control_arbiter(car)
+        if init_camera(car) and init_frame_broadcaster(car):
+            # 拍照写盘线程所有小车共用，连拍/定时拍摄和录像每辆小车各一个
+            init_photo_worker()
+            init_capture_manager(car)
+            init_recorder(car)
+            camera_ok = True
+    init_control_watchdog()
+    init_latency_tracker()
+    init_metrics_history()
     monitor_ok = init_monitor()
+    init_status_publisher()
+    init_metrics_exporter()
     
     if not serial_ok:
         logger.warning("串口初始化失败，控制功能将不可用")
@@ -642,32 +1575,101 @@ def init_all():
 
 # 清理资源
 def cleanup():
-    global serial_handler, picam2, camera_active, connection_monitor
+    global connection_monitor, photo_worker, control_watchdog
     
     logger.info("正在清理资源...")
     
-    # 发送停止命令
-    if serial_handler and serial_handler.is_connected:
-        send_command('S')
-        time.sleep(0.1)
-        serial_handler.disconnect()
-        logger.info("串口已关闭")
+    # 停止状态推送，订阅者的连接随之结束
+    if status_publisher:
+        status_publisher.stop()
+    
+    # 停止看门狗，随后由这里直接发送停止命令
+    if control_watchdog:
+        control_watchdog.stop()
+    
+    # 所有小车发送停止命令，等待停止命令写入串口后再断开
+    cars = car_registry.all()
+    items = [car.send_command('S') for car in cars if car.serial_handler]
+    for item in items:
+        if item:
+            item.wait(1.0)
+    for car in cars:
+        if car.serial_handler:
+            car.serial_handler.disconnect()
+            logger.info(f"[{car.car_id}] 串口已关闭")
+    
+    # 停止录像，关闭当前分段
+    for car in cars:
+        if car.video_recorder:
+            car.video_recorder.stop()
+    
+    # 停止帧广播
+    for car in cars:
+        if car.frame_broadcaster:
+            car.frame_broadcaster.stop()
+    
+    # 停止连拍/定时拍摄，等待排队的照片写完
+    for car in cars:
+        if car.capture_manager:
+            car.capture_manager.stop_all()
+    if photo_worker:
+        photo_worker.stop()
     
     # 停止摄像头
-    if picam2:
-        camera_active = False
+    cameras = [car for car in cars if car.picam2]
+    for car in cameras:
+        car.camera_active = False
+    if cameras:
         time.sleep(0.5)  # 等待帧生成线程结束
+    for car in cameras:
         try:
-            picam2.stop()
-            picam2.close()
-            logger.info("摄像头已停止")
+            car.picam2.stop()
+            car.picam2.close()
+            logger.info(f"[{car.car_id}] 摄像头已停止")
         except Exception as e:
-            logger.error(f"停止摄像头时出错: {e}")
+            logger.error(f"[{car.car_id}] 停止摄像头时出错: {e}")
     
     # 停止监控
     if connection_monitor:
         connection_monitor.stop_monitoring()
         logger.info("连接监控已停止")
+    
+    # 保存指标历史，下次启动时加载
+    if metrics_history:
+        metrics_history.save()
+
+def is_long_lived(path):
+    """按路由表匹配路径，视图函数带有 @long_lived 标记时为长连接
+
+    请求行中看不到 Upgrade 头，普通路由匹配不到时再按 WebSocket 路由匹配。
+    """
+    adapter = app.url_map.bind('localhost')
+    for websocket in (False, True):
+        try:
+            endpoint, _ = adapter.match(path, method='GET', websocket=websocket)
+        except WebsocketMismatch:
+            continue
+        except HTTPException:
+            return False
+        return getattr(app.view_functions.get(endpoint), 'long_lived', False)
+    return False
+
+def run_server(host, port, debug=False):
+    """按 [network] server 启动 Web 服务器，调试模式始终使用 Flask 自带服务器"""
+    global web_server
+    backend = config_manager.get('network', 'server', 'pooled')
+    if debug or backend == 'werkzeug':
+        app.run(host=host, port=port, debug=debug, threaded=True)
+        return
+    web_server = create_server(
+        backend, host, port, app,
+        workers=config_manager.getint('network', 'workers', 8),
+        stream_workers=config_manager.getint('network', 'stream_workers', 8),
+        is_long_lived=is_long_lived
+    )
+    logger.info(f"Web服务器: {backend}，短请求线程 {web_server.request_pool.size}，"
+                f"长连接名额 {web_server.stream_pool.size}")
+    web_server.serve_forever()
 
 # 信号处理
 def signal_handler(signum, frame):
@@ -703,8 +1705,8 @@ if __name__ == '__main__':
             logger.info(f"网页控制界面: http://localhost:{port}")
             logger.info("按 Ctrl+C 退出")
             
-            # 启动Flask应用
-            app.run(host=host, port=port, debug=debug, threaded=True)
+            # 启动Web服务器
+            run_server(host, port, debug)
         else:
             logger.error("系统初始化失败")
             sys.exit(1)
@@ -22,25 +22,101 @@ class ConfigManager:
                 'baudrate': '9600',
                 'timeout': '1',
                 'max_retries': '5',
-                'reconnect_interval': '2.0'
+                'reconnect_interval': '2.0',
+                'reconnect_initial': '0.05',
+                'auto_reconnect': 'true',
+                'protocol': 'legacy',
+                'telemetry_enabled': 'true',
+                'telemetry_capacity': '2048'
+            },
+            'simulator': {
+                'link': '/tmp/ttyCAR',
+                'latency_ms': '0',
+                'telemetry_interval': '0.1',
+                'disconnect_interval': '0',
+                'disconnect_duration': '0.5'
+            },
+            'control': {
+                'watchdog_timeout': '1.0',
+                'heartbeat_interval': '0.25',
+                'rate_limit': '20',
+                'rate_burst': '10',
+                'dedup_window': '0.5',
+                'driver_timeout': '3.0'
+            },
+            'latency': {
+                'enabled': 'true',
+                'sample_rate': '1.0'
             },
             'camera': {
                 'width': '960',
                 'height': '720',
                 'fps': '30',
-                'jpeg_quality': '85'
+                'jpeg_quality': '85',
+                'format': 'RGB888',
+                'encoder': 'opencv',
+                'snapshot_frames': '15',
+                'photo_quality': '95',
+                'photo_queue_size': '32',
+                'static_threshold': '2.0',
+                'static_seconds': '2.0',
+                'static_keepalive_fps': '1.0',
+                'default_profile': 'high'
+            },
+            'stream.high': {
+                'width': '960',
+                'height': '720',
+                'fps': '30',
+                'jpeg_quality': '85',
+                'source': 'main'
+            },
+            'stream.mid': {
+                'width': '640',
+                'height': '480',
+                'fps': '20',
+                'jpeg_quality': '75',
+                'source': 'scale'
+            },
+            'stream.low': {
+                'width': '320',
+                'height': '240',
+                'fps': '10',
+                'jpeg_quality': '60',
+                'source': 'lores'
+            },
+            'recorder': {
+                'enabled': 'true',
+                'output_dir': '/home/lenovo/SWS/recordings',
+                'profile': 'mid',
+                'segment_seconds': '60',
+                'preroll_seconds': '5',
+                'max_total_mb': '1024'
             },
             'network': {
                 'host': '0.0.0.0',
                 'port': '5800',
-                'debug': 'false'
+                'debug': 'false',
+                'status_push_interval': '0.5',
+                'server': 'pooled',
+                'workers': '8',
+                'stream_workers': '8'
             },
             'monitor': {
                 'check_interval': '10.0',
+                'probe_interval': '30.0',
+                'probe_host': '8.8.8.8',
+                'probe_port': '53',
+                'probe_timeout': '2.0',
                 'temp_threshold': '70.0',
                 'memory_threshold': '80.0',
                 'disk_threshold': '90.0'
             },
+            'metrics': {
+                'enabled': 'true',
+                'sample_interval': '1.0',
+                'history_file': 'metrics_history.npz',
+                'exporter': 'true'
+            },
             'logging': {
                 'level': 'INFO',
                 'log_file': 'car_web_control.log',
@@ -168,6 +244,13 @@ class ConfigManager:
             print(f"设置配置值失败: {e}")
             return False
     
+    def get_sections(self, prefix):
+        """获取以指定前缀开头的配置节名称，配置文件中没有时使用默认配置"""
+        sections = [s for s in self.config.sections() if s.startswith(prefix)]
+        if not sections:
+            sections = [s for s in self.defaults if s.startswith(prefix)]
+        return sections
+    
     def get_all_config(self):
         """获取所有配置"""
         config_dict = {}
@@ -4,26 +4,107 @@
 连接监控模块 - 监控网络连接和系统状态
 """
 
+import os
 import time
+import errno
+import select
+import socket
 import threading
 import logging
 import psutil
-import subprocess
-from typing import Optional, Callable, Dict, List
+from typing import Optional, Callable, Dict, List, Tuple
+
+class ReachabilityProbe:
+    """非阻塞 TCP 连接探测，连接建立即视为可达
+
+    start() 发起连接后立即返回，之后由 poll() 检查结果，不占用监控线程等待。
+    host 应为 IP 地址，避免 DNS 解析阻塞。
+    """
+    
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock: Optional[socket.socket] = None
+        self.deadline = 0.0
+        self.started = 0.0
+    
+    @property
+    def pending(self) -> bool:
+        return self.sock is not None
+    
+    def start(self, now: float) -> Optional[bool]:
+        """发起探测，立即完成时返回结果，否则返回 None"""
+        self.close()
+        self.started = now
+        self.deadline = now + self.timeout
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setblocking(False)
+            code = self.sock.connect_ex((self.host, self.port))
+        except OSError:
+            self.close()
+            return False
+        if code in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+            return None
+        self.close()
+        return code == 0
+    
+    def poll(self, now: float) -> Optional[bool]:
+        """检查探测结果，仍在进行时返回 None"""
+        if not self.sock:
+            return None
+        try:
+            _, writable, _ = select.select([], [self.sock], [], 0)
+            if writable:
+                code = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                self.close()
+                return code == 0
+        except OSError:
+            self.close()
+            return False
+        if now >= self.deadline:
+            self.close()
+            return False
+        return None
+    
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
 
 class ConnectionMonitor:
-    """连接监控类"""
+    """连接监控类
+    
+    监控线程按固定的单调时钟截止时间采样，CPU 和网卡流量从 /proc 计数器的两次差值计算，
+    不在循环中睡眠等待；连通性探测为非阻塞套接字连接，有独立的周期（probe_interval 为 0 时关闭）。
+    采样周期 sample_interval 默认与检查周期相同，可单独调短用于记录历史曲线，
+    每次采样后调用 on_sample(网络状态, 系统状态)；警告条件仍按 check_interval 检查。
+    每次采样生成新的状态字典后整体替换，get_status() 读到的总是完整的一次结果。
+    """
     
-    def __init__(self, check_interval: float = 10.0):
+    def __init__(self, check_interval: float = 10.0, probe_interval: float = 30.0,
+                 probe_host: str = '8.8.8.8', probe_port: int = 53, probe_timeout: float = 2.0,
+                 sample_interval: Optional[float] = None):
         self.check_interval = check_interval
+        self.sample_interval = min(sample_interval or check_interval, check_interval)
+        self.probe_interval = probe_interval
+        self.probe = ReachabilityProbe(probe_host, probe_port, probe_timeout)
         self.is_monitoring = False
         self.monitor_thread = None
+        self.stop_event = threading.Event()
         
-        # 状态信息
+        # 状态信息（只整体替换，不原地修改）
         self.network_status = {
             'connected': False,
             'interface': '',
             'ip': '',
+            'rx_rate': 0.0,
+            'tx_rate': 0.0,
+            'reachable': None,
             'last_check': 0
         }
         
@@ -42,21 +123,35 @@ class ConnectionMonitor:
             'disk': 90.0
         }
         
+        # 上一次采样的计数器，用于计算差值
+        self.last_cpu_times: Optional[Tuple[int, int]] = None
+        self.last_net_counters: Optional[Tuple[float, str, int, int]] = None
+        
+        # 统计信息
+        self.samples = 0
+        self.last_sample_ms = 0.0
+        self.probes = 0
+        self.probe_failures = 0
+        self.last_probe_ms = 0.0
+        
         # 回调函数
         self.on_network_change: Optional[Callable] = None
         self.on_system_alert: Optional[Callable] = None
+        self.on_sample: Optional[Callable] = None
         
         # 日志设置
         self.logger = logging.getLogger(__name__)
         
     def set_thresholds(self, temp: float = None, memory: float = None, disk: float = None):
         """设置系统警告阈值"""
+        thresholds = dict(self.thresholds)
         if temp is not None:
-            self.thresholds['temp'] = temp
+            thresholds['temp'] = temp
         if memory is not None:
-            self.thresholds['memory'] = memory
+            thresholds['memory'] = memory
         if disk is not None:
-            self.thresholds['disk'] = disk
+            thresholds['disk'] = disk
+        self.thresholds = thresholds
             
         self.logger.info(f"警告阈值已设置: 温度={self.thresholds['temp']}°C, "
                         f"内存={self.thresholds['memory']}%, 磁盘={self.thresholds['disk']}%")
@@ -68,6 +163,7 @@ class ConnectionMonitor:
             return
             
         self.is_monitoring = True
+        self.stop_event.clear()
         self.monitor_thread = threading.Thread(target=self._monitor_loop)
         self.monitor_thread.daemon = True
         self.monitor_thread.start()
@@ -76,105 +172,181 @@ class ConnectionMonitor:
     def stop_monitoring(self):
         """停止监控"""
         self.is_monitoring = False
+        self.stop_event.set()
         if self.monitor_thread and self.monitor_thread.is_alive():
             self.monitor_thread.join(timeout=5)
+        self.probe.close()
         self.logger.info("连接监控已停止")
     
+    @staticmethod
+    def _next_deadline(deadline: float, interval: float, now: float) -> float:
+        """按固定周期推进截止时间，落后超过一个周期时从当前时间重新计算，不补跑"""
+        deadline += interval
+        if deadline <= now:
+            deadline = now + interval
+        return deadline
+    
     def _monitor_loop(self):
-        """监控循环"""
-        while self.is_monitoring:
+        """监控循环：采样和探测各自按截止时间执行，其余时间等待"""
+        now = time.monotonic()
+        next_sample = now
+        next_check = now
+        next_probe = now if self.probe_interval > 0 else None
+        
+        while not self.stop_event.is_set():
             try:
-                # 检查网络状态
-                self._check_network_status()
-                
-                # 检查系统状态
-                self._check_system_status()
+                now = time.monotonic()
+                if now >= next_sample:
+                    self._sample()
+                    next_sample = self._next_deadline(next_sample, self.sample_interval, now)
+                if now >= next_check:
+                    self._check_alerts()
+                    next_check = self._next_deadline(next_check, self.check_interval, now)
                 
-                # 检查警告条件
-                self._check_alerts()
+                if next_probe is not None and not self.probe.pending and now >= next_probe:
+                    self.probes += 1
+                    result = self.probe.start(now)
+                    if result is not None:
+                        self._finish_probe(result, now)
+                    next_probe = self._next_deadline(next_probe, self.probe_interval, now)
+                if self.probe.pending:
+                    result = self.probe.poll(time.monotonic())
+                    if result is not None:
+                        self._finish_probe(result, time.monotonic())
                 
+                deadline = min(next_sample, next_check)
+                if next_probe is not None:
+                    deadline = min(deadline, next_probe)
+                timeout = max(0.0, deadline - time.monotonic())
+                if self.probe.pending:
+                    # 探测进行中时等待连接完成，最多等到探测超时
+                    timeout = min(timeout, max(0.0, self.probe.deadline - time.monotonic()))
+                    select.select([], [self.probe.sock], [], min(timeout, 0.5))
+                else:
+                    self.stop_event.wait(timeout)
+                    
             except Exception as e:
                 self.logger.error(f"监控循环错误: {e}")
-            
-            time.sleep(self.check_interval)
+                self.stop_event.wait(1.0)
+    
+    def _sample(self):
+        """采样一次网络和系统状态"""
+        start = time.monotonic()
+        self._check_network_status()
+        self._check_system_status()
+        self.samples += 1
+        self.last_sample_ms = (time.monotonic() - start) * 1000
+        if self.on_sample:
+            self.on_sample(self.network_status, self.system_status)
+    
+    def _finish_probe(self, reachable: bool, now: float):
+        """记录探测结果，连通性变化时重新发布网络状态"""
+        self.last_probe_ms = (now - self.probe.started) * 1000
+        if not reachable:
+            self.probe_failures += 1
+        if reachable != self.network_status['reachable']:
+            self.logger.info(f"连通性探测 {self.probe.host}:{self.probe.port}: "
+                             f"{'可达' if reachable else '不可达'}")
+            status = dict(self.network_status)
+            status['reachable'] = reachable
+            self._publish_network(status)
+    
+    def _publish_network(self, status: Dict):
+        """计算连接状态后整体替换网络状态，变化时回调"""
+        # 有可用网卡地址即视为已连接；没有时以探测结果为准
+        status['connected'] = bool(status['interface']) or bool(status['reachable'])
+        old_connected = self.network_status['connected']
+        self.network_status = status
+        
+        if old_connected != status['connected']:
+            self.logger.info(f"网络状态变化: {old_connected} -> {status['connected']}")
+            if self.on_network_change:
+                self.on_network_change(status)
     
     def _check_network_status(self):
-        """检查网络连接状态"""
+        """检查网卡地址和流量"""
         try:
-            old_status = self.network_status.copy()
-            
-            # 获取网络接口信息
-            interfaces = psutil.net_if_addrs()
-            connected = False
             interface_name = ''
             ip_address = ''
-            
-            for interface, addrs in interfaces.items():
+            for interface, addrs in psutil.net_if_addrs().items():
                 if interface.startswith(('eth', 'wlan', 'enp', 'wlp')):
                     for addr in addrs:
-                        if addr.family == 2:  # IPv4
-                            if not addr.address.startswith('127.'):
-                                connected = True
-                                interface_name = interface
-                                ip_address = addr.address
-                                break
-                    if connected:
+                        if addr.family == socket.AF_INET and not addr.address.startswith('127.'):
+                            interface_name = interface
+                            ip_address = addr.address
+                            break
+                    if interface_name:
                         break
             
-            # 如果没有找到有效接口，尝试ping测试
-            if not connected:
-                try:
-                    result = subprocess.run(
-                        ['ping', '-c', '1', '-W', '3', '8.8.8.8'],
-                        capture_output=True,
-                        timeout=5
-                    )
-                    connected = result.returncode == 0
-                except:
-                    connected = False
-            
-            # 更新状态
-            self.network_status.update({
-                'connected': connected,
+            rx_rate, tx_rate = self._interface_rates(interface_name)
+            self._publish_network({
+                'connected': False,
                 'interface': interface_name,
                 'ip': ip_address,
+                'rx_rate': rx_rate,
+                'tx_rate': tx_rate,
+                'reachable': self.network_status['reachable'],
                 'last_check': time.time()
             })
-            
-            # 检查状态变化
-            if old_status['connected'] != connected:
-                self.logger.info(f"网络状态变化: {old_status['connected']} -> {connected}")
-                if self.on_network_change:
-                    self.on_network_change(self.network_status)
                     
         except Exception as e:
             self.logger.error(f"检查网络状态错误: {e}")
     
+    def _interface_rates(self, interface: str) -> Tuple[float, float]:
+        """从 /proc/net/dev 计算网卡收发速率 (字节/秒)"""
+        if not interface:
+            self.last_net_counters = None
+            return 0.0, 0.0
+        counters = read_net_counters(interface)
+        if counters is None:
+            return 0.0, 0.0
+        now = time.monotonic()
+        last = self.last_net_counters
+        self.last_net_counters = (now, interface, *counters)
+        if not last or last[1] != interface or now <= last[0]:
+            return 0.0, 0.0
+        elapsed = now - last[0]
+        return (round(max(0, counters[0] - last[2]) / elapsed, 1),
+                round(max(0, counters[1] - last[3]) / elapsed, 1))
+    
     def _check_system_status(self):
         """检查系统状态"""
         try:
-            # CPU使用率
-            cpu_percent = psutil.cpu_percent(interval=1)
+            # CPU使用率：两次采样之间 /proc/stat 计数器的差值
+            cpu_times = read_cpu_times()
+            if cpu_times is None:
+                cpu_percent = psutil.cpu_percent(interval=None)
+            else:
+                cpu_percent = self.system_status['cpu_percent']
+                if self.last_cpu_times:
+                    idle = cpu_times[0] - self.last_cpu_times[0]
+                    total = cpu_times[1] - self.last_cpu_times[1]
+                    if total > 0:
+                        cpu_percent = round(100.0 * (1.0 - idle / total), 1)
+                self.last_cpu_times = cpu_times
             
             # 内存使用率
-            memory = psutil.virtual_memory()
-            memory_percent = memory.percent
+            memory_percent = read_memory_percent()
+            if memory_percent is None:
+                memory_percent = psutil.virtual_memory().percent
             
             # 磁盘使用率
-            disk = psutil.disk_usage('/')
-            disk_percent = disk.percent
+            disk = os.statvfs('/')
+            used = (disk.f_blocks - disk.f_bfree) * disk.f_frsize
+            available = disk.f_bavail * disk.f_frsize
+            disk_percent = round(100.0 * used / (used + available), 1) if used + available else 0.0
             
             # CPU温度 (树莓派)
             temperature = self._get_cpu_temperature()
             
             # 更新状态
-            self.system_status.update({
+            self.system_status = {
                 'cpu_percent': cpu_percent,
                 'memory_percent': memory_percent,
                 'disk_percent': disk_percent,
                 'temperature': temperature,
                 'last_check': time.time()
-            })
+            }
             
         except Exception as e:
             self.logger.error(f"检查系统状态错误: {e}")
@@ -228,7 +400,15 @@ class ConnectionMonitor:
             'network': self.network_status.copy(),
             'system': self.system_status.copy(),
             'thresholds': self.thresholds.copy(),
-            'monitoring': self.is_monitoring
+            'monitoring': self.is_monitoring,
+            'sampler': {
+                'sample_interval': self.sample_interval,
+                'samples': self.samples,
+                'last_sample_ms': round(self.last_sample_ms, 2),
+                'probes': self.probes,
+                'probe_failures': self.probe_failures,
+                'last_probe_ms': round(self.last_probe_ms, 1)
+            }
         }
     
     def get_network_status(self) -> Dict:
@@ -240,15 +420,53 @@ class ConnectionMonitor:
         return self.system_status.copy()
     
     def force_check(self):
-        """强制执行一次检查"""
+        """强制执行一次采样和警告检查（不含连通性探测）"""
         try:
-            self._check_network_status()
-            self._check_system_status()
+            self._sample()
             self._check_alerts()
             self.logger.info("强制检查完成")
         except Exception as e:
             self.logger.error(f"强制检查错误: {e}")
 
+def read_cpu_times() -> Optional[Tuple[int, int]]:
+    """读取 /proc/stat 的 (空闲, 总计) CPU 时间，不可用时返回 None"""
+    try:
+        with open('/proc/stat', 'r') as f:
+            values = [int(v) for v in f.readline().split()[1:9]]
+        # idle + iowait 为空闲；guest 已计入 user，不重复统计
+        return values[3] + values[4], sum(values)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def read_memory_percent() -> Optional[float]:
+    """从 /proc/meminfo 计算内存使用率，不可用时返回 None"""
+    try:
+        info = {}
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('MemTotal', 'MemAvailable'):
+                    info[key] = int(value.split()[0])
+                    if len(info) == 2:
+                        break
+        total = info['MemTotal']
+        return round(100.0 * (total - info['MemAvailable']) / total, 1)
+    except (OSError, ValueError, KeyError, ZeroDivisionError):
+        return None
+
+def read_net_counters(interface: str) -> Optional[Tuple[int, int]]:
+    """读取 /proc/net/dev 中网卡的 (接收字节, 发送字节)，不可用时返回 None"""
+    try:
+        with open('/proc/net/dev', 'r') as f:
+            for line in f:
+                name, sep, data = line.partition(':')
+                if sep and name.strip() == interface:
+                    fields = data.split()
+                    return int(fields[0]), int(fields[8])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
 # 使用示例
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+控制仲裁模块 - 按客户端限流、去重，并保证同一时间只有一个驾驶者
+"""
+
+import time
+import threading
+import logging
+from typing import Dict, Optional
+
+# 判定结果
+ACCEPT = 'accept'
+DUPLICATE = 'duplicate_command_ignored'
+RATE_LIMITED = 'rate_limited'
+NOT_DRIVER = 'not_driver'
+
+class TokenBucket:
+    """令牌桶 - 每秒补充 rate 个令牌，最多积累 burst 个"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def consume(self, now: float) -> bool:
+        """取一个令牌，不足时返回 False"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class ControlArbiter:
+    """控制仲裁类
+
+    - 限流: 每个来源地址一个令牌桶，停止命令不受限流影响
+    - 去重: 同一客户端在 dedup_window 内重复发送与当前状态相同的命令时忽略，
+      超过窗口后允许重发，用于补偿串口上丢失的字节；停止命令从不去重
+    - 驾驶者: 第一个发出运动命令的客户端成为驾驶者，
+      driver_timeout 内没有命令或心跳后释放；其他客户端只能发送停止命令
+    """
+
+    def __init__(self, rate: float = 20.0, burst: float = 10.0, dedup_window: float = 0.5,
+                 driver_timeout: float = 3.0, client_ttl: float = 300.0):
+        self.rate = rate
+        self.burst = burst
+        self.dedup_window = dedup_window
+        self.driver_timeout = driver_timeout
+        self.client_ttl = client_ttl
+
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.clients: Dict[str, dict] = {}
+        self.driver: Optional[str] = None
+        self.driver_deadline = 0.0
+        self.last_prune = time.monotonic()
+
+        # 统计信息
+        self.totals = {ACCEPT: 0, DUPLICATE: 0, RATE_LIMITED: 0, NOT_DRIVER: 0}
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def _client(self, client_id: str, now: float) -> dict:
+        """获取客户端记录（需持有锁）"""
+        client = self.clients.get(client_id)
+        if client is None:
+            client = {
+                'last_key': None,
+                'last_time': 0.0,
+                'seen': now,
+                ACCEPT: 0, DUPLICATE: 0, RATE_LIMITED: 0, NOT_DRIVER: 0
+            }
+            self.clients[client_id] = client
+        client['seen'] = now
+        return client
+
+    def check(self, client_id: str, address: str, key, current_key, is_stop: bool) -> str:
+        """判定一条命令是否放行
+
+        key 为命令的去重键（命令字母，drive 命令带上速度和转向），
+        current_key 为小车当前状态的去重键。
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._prune(now)
+            client = self._client(client_id, now)
+
+            # 驾驶者仲裁，任何人都可以停车
+            if self.driver and self.driver != client_id and now >= self.driver_deadline:
+                self.logger.info(f"驾驶者 {self.driver} 租约到期，已释放")
+                self.driver = None
+            if not is_stop:
+                if self.driver is None:
+                    self.driver = client_id
+                    self.logger.info(f"驾驶者变更: {client_id}")
+                elif self.driver != client_id:
+                    return self._record(client, NOT_DRIVER)
+            if self.driver == client_id:
+                self.driver_deadline = now + self.driver_timeout
+
+            # 去重：状态未变且在窗口内的重复命令；停止命令从不去重，
+            # current_key 在命令入队时即更新，串口写入失败或重连时小车可能仍在运动
+            if (not is_stop and key == client['last_key'] and key == current_key
+                    and now - client['last_time'] < self.dedup_window):
+                return self._record(client, DUPLICATE)
+
+            # 限流，停止命令始终放行
+            bucket = self.buckets.get(address)
+            if bucket is None:
+                bucket = self.buckets[address] = TokenBucket(self.rate, self.burst)
+            if not bucket.consume(now) and not is_stop:
+                return self._record(client, RATE_LIMITED)
+
+            client['last_key'] = key
+            client['last_time'] = now
+            return self._record(client, ACCEPT)
+
+    def _record(self, client: dict, result: str) -> str:
+        client[result] += 1
+        self.totals[result] += 1
+        return result
+
+    def touch(self, client_id: str):
+        """驾驶者的心跳续租"""
+        with self.lock:
+            if self.driver == client_id:
+                self.driver_deadline = time.monotonic() + self.driver_timeout
+
+    def release(self, client_id: str):
+        """客户端断开时释放驾驶者身份"""
+        with self.lock:
+            if self.driver == client_id:
+                self.driver = None
+                self.logger.info(f"驾驶者 {client_id} 已释放")
+
+    def _prune(self, now: float):
+        """清理长时间不活动的客户端（需持有锁）"""
+        if now - self.last_prune < 10.0:
+            return
+        self.last_prune = now
+        for client_id in [c for c, v in self.clients.items() if now - v['seen'] > self.client_ttl]:
+            del self.clients[client_id]
+        for address in [a for a, b in self.buckets.items() if now - b.updated > self.client_ttl]:
+            del self.buckets[address]
+
+    def get_status(self) -> dict:
+        """获取仲裁状态"""
+        now = time.monotonic()
+        with self.lock:
+            driver_remaining = max(0.0, self.driver_deadline - now) if self.driver else 0.0
+            clients = {
+                client_id: {
+                    'accepted': client[ACCEPT],
+                    'deduplicated': client[DUPLICATE],
+                    'rate_limited': client[RATE_LIMITED],
+                    'not_driver': client[NOT_DRIVER],
+                    'idle': round(now - client['seen'], 1)
+                }
+                for client_id, client in self.clients.items()
+            }
+            return {
+                'driver': self.driver,
+                'driver_remaining': round(driver_remaining, 2),
+                'rate': self.rate,
+                'burst': self.burst,
+                'dedup_window': self.dedup_window,
+                'accepted': self.totals[ACCEPT],
+                'deduplicated': self.totals[DUPLICATE],
+                'rate_limited': self.totals[RATE_LIMITED],
+                'not_driver': self.totals[NOT_DRIVER],
+                'clients': clients
+            }
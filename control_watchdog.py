@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+控制看门狗模块 - 运动命令需要发出它的客户端持续发送心跳，超时自动停车
+"""
+
+import time
+import heapq
+import itertools
+import threading
+import logging
+from typing import Optional, Callable, Dict
+
+class ControlWatchdog:
+    """死人开关看门狗
+
+    每个受控对象（小车）记录当前运动命令的发出者和截止时间，
+    只有该客户端的心跳能延长截止时间，其他客户端的心跳不会让它继续运动。
+    所有截止时间放在一个最小堆中，由单个线程等待最早的截止时间，
+    心跳只更新记录，不入堆；到期弹出时如发现已被延长则按新截止时间重新入堆。
+    """
+
+    def __init__(self, timeout: float = 1.0,
+                 on_expire: Optional[Callable[[str, str], None]] = None):
+        self.timeout = timeout
+        # on_expire(key, client_id) 在看门狗线程中调用
+        self.on_expire = on_expire
+
+        self.is_running = False
+        self.watchdog_thread = None
+
+        # key -> {'client': 客户端, 'deadline': 截止时间, 'gen': 代号}
+        self.entries: Dict[str, dict] = {}
+        self.heap = []
+        self.generation = itertools.count(1)
+        self.condition = threading.Condition()
+
+        # 统计信息
+        self.expired_count = 0
+        self.last_expired = None
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """启动看门狗线程"""
+        if self.is_running:
+            return
+
+        self.is_running = True
+        self.watchdog_thread = threading.Thread(target=self._watchdog_loop)
+        self.watchdog_thread.daemon = True
+        self.watchdog_thread.start()
+        self.logger.info(f"控制看门狗已启动，超时 {self.timeout}s")
+
+    def stop(self):
+        """停止看门狗线程"""
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+        if self.watchdog_thread and self.watchdog_thread.is_alive():
+            self.watchdog_thread.join(timeout=2)
+        self.logger.info("控制看门狗已停止")
+
+    def arm(self, key: str, client_id: str):
+        """客户端对 key 发出运动命令，由该客户端接管心跳"""
+        with self.condition:
+            deadline = time.monotonic() + self.timeout
+            entry = self.entries.get(key)
+            if entry and entry['client'] == client_id:
+                # 同一客户端连续发出运动命令，等同于心跳
+                entry['deadline'] = deadline
+                return
+            gen = next(self.generation)
+            self.entries[key] = {'client': client_id, 'deadline': deadline, 'gen': gen}
+            heapq.heappush(self.heap, (deadline, gen, key))
+            self.condition.notify()
+
+    def disarm(self, key: str):
+        """key 已停止，不再需要心跳"""
+        with self.condition:
+            # 堆中的旧记录在到期时按代号丢弃
+            self.entries.pop(key, None)
+
+    def feed(self, key: str, client_id: str):
+        """客户端对 key 的心跳，只延长该客户端自己对 key 发出的运动命令"""
+        with self.condition:
+            entry = self.entries.get(key)
+            if entry and entry['client'] == client_id:
+                entry['deadline'] = time.monotonic() + self.timeout
+
+    def _watchdog_loop(self):
+        """等待最早的截止时间"""
+        while True:
+            expired = None
+            with self.condition:
+                if not self.is_running:
+                    break
+                if not self.heap:
+                    self.condition.wait(timeout=1.0)
+                    continue
+
+                deadline, gen, key = self.heap[0]
+                now = time.monotonic()
+                if deadline > now:
+                    self.condition.wait(timeout=deadline - now)
+                    continue
+
+                heapq.heappop(self.heap)
+                entry = self.entries.get(key)
+                if entry is None or entry['gen'] != gen:
+                    continue
+                if entry['deadline'] > now:
+                    # 期间收到过心跳，按新的截止时间重新入堆
+                    heapq.heappush(self.heap, (entry['deadline'], gen, key))
+                    continue
+
+                del self.entries[key]
+                expired = (key, entry['client'])
+                self.expired_count += 1
+                self.last_expired = {'key': key, 'client': entry['client'], 'time': time.time()}
+
+            self.logger.warning(f"控制心跳超时，自动停止: {expired[0]} (客户端 {expired[1]})")
+            if self.on_expire:
+                try:
+                    self.on_expire(*expired)
+                except Exception as e:
+                    self.logger.error(f"看门狗停止回调错误: {e}")
+
+    def get_status(self) -> dict:
+        """获取看门狗状态"""
+        now = time.monotonic()
+        with self.condition:
+            armed = {
+                key: {
+                    'client': entry['client'],
+                    'remaining': round(max(0.0, entry['deadline'] - now), 3)
+                }
+                for key, entry in self.entries.items()
+            }
+        return {
+            'running': self.is_running,
+            'timeout': self.timeout,
+            'armed': armed,
+            'expired_count': self.expired_count,
+            'last_expired': self.last_expired
+        }
@@ -0,0 +1,687 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+视频帧广播模块 - 单一采集/编码线程，向所有视频流客户端分发同一帧
+"""
+
+import cv2
+import time
+import numpy as np
+import threading
+import logging
+from typing import Optional, Callable, Tuple, List, Dict
+
+from jpeg_encoder import OpenCVJpegEncoder
+from metrics_exporter import HistogramValue
+
+# 编码耗时直方图分桶 (秒)
+ENCODE_BUCKETS = (0.001, 0.0025, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.1)
+
+# 摄像头像素格式到BGR的转换方式，None 表示内存布局已经是BGR
+# Picamera2 的格式名按大端描述，RGB888 在内存中的顺序为 [B, G, R]
+COLOR_CONVERSIONS = {
+    'RGB888': None,
+    'BGR888': cv2.COLOR_RGB2BGR,
+    'XRGB8888': cv2.COLOR_BGRA2BGR,
+    'XBGR8888': cv2.COLOR_RGBA2BGR,
+    'YUV420': cv2.COLOR_YUV2BGR_I420
+}
+
+class FrameConverter:
+    """帧格式转换器 - 复用预分配的输出缓冲区，避免每帧分配新数组
+
+    RGB888 格式可直接交给 cv2.imencode，不做任何转换。
+    转换结果在下一次调用时会被覆盖，调用方需在此之前用完或自行复制。
+    """
+
+    def __init__(self, pixel_format: Optional[str] = None):
+        self.pixel_format = pixel_format
+        self.buffer = None
+        self.input_shape = None
+
+    def _conversion_code(self, frame):
+        """按像素格式选择转换方式，未知格式时按通道数推断"""
+        if self.pixel_format in COLOR_CONVERSIONS:
+            return COLOR_CONVERSIONS[self.pixel_format]
+        if len(frame.shape) == 3:
+            if frame.shape[2] == 3:  # RGB
+                return cv2.COLOR_RGB2BGR
+            return cv2.COLOR_RGBA2BGR  # 可能是RGBA
+        return cv2.COLOR_GRAY2BGR  # 灰度图像
+
+    def to_bgr(self, frame):
+        """转换为OpenCV使用的BGR格式"""
+        code = self._conversion_code(frame)
+        if code is None:
+            return frame
+
+        # 输入尺寸不变时写入同一块缓冲区
+        if self.buffer is not None and frame.shape == self.input_shape:
+            return cv2.cvtColor(frame, code, dst=self.buffer)
+
+        self.buffer = cv2.cvtColor(frame, code)
+        self.input_shape = frame.shape
+        return self.buffer
+
+
+class FrameRing:
+    """原始帧环形缓存 - 保存最近N帧及其时间戳
+
+    生产者独占的新数组 (owned=True) 直接保存引用，不复制；
+    会被生产者复用的缓冲区则复制到按帧尺寸预分配的槽位。clear() 释放全部缓冲区。
+    """
+
+    def __init__(self, size: int = 15):
+        self.size = max(1, size)
+        self.buffers: List[Optional[np.ndarray]] = [None] * self.size
+        # 预分配的复制槽位，与 buffers 中保存的引用分开，避免写入生产者交出的数组
+        self.copies: List[Optional[np.ndarray]] = [None] * self.size
+        self.timestamps = [0.0] * self.size
+        # count 为累计写入数，stored 为 clear() 之后写入的帧数
+        self.count = 0
+        self.stored = 0
+        self.condition = threading.Condition()
+
+    def push(self, frame, timestamp: float, owned: bool = False):
+        """写入一帧到下一个槽位，owned 为 True 时只保存引用"""
+        with self.condition:
+            index = self.count % self.size
+            if owned:
+                self.buffers[index] = frame
+            else:
+                buffer = self.copies[index]
+                if buffer is None or buffer.shape != frame.shape or buffer.dtype != frame.dtype:
+                    buffer = self.copies[index] = np.empty_like(frame)
+                np.copyto(buffer, frame)
+                self.buffers[index] = buffer
+            self.timestamps[index] = timestamp
+            self.count += 1
+            self.stored += 1
+            self.condition.notify_all()
+
+    def clear(self):
+        """丢弃缓存的帧并释放缓冲区"""
+        with self.condition:
+            self.buffers = [None] * self.size
+            self.copies = [None] * self.size
+            self.timestamps = [0.0] * self.size
+            self.stored = 0
+
+    def latest_time(self) -> float:
+        """最新一帧的时间戳，没有帧时返回 0"""
+        with self.condition:
+            if self.stored == 0:
+                return 0.0
+            return self.timestamps[(self.count - 1) % self.size]
+
+    def wait_for_new(self, last_count: int, timeout: float) -> bool:
+        """等待新帧写入"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.count != last_count, timeout=timeout)
+
+    def get(self, age: float = 0.0) -> Tuple[Optional[np.ndarray], float]:
+        """取拍摄时间最接近 age 秒之前的一帧，返回 (副本, 时间戳)"""
+        with self.condition:
+            if self.stored == 0:
+                return None, 0.0
+
+            target = time.time() - age
+            best = None
+            for i in range(min(self.stored, self.size)):
+                index = (self.count - 1 - i) % self.size
+                if best is None or abs(self.timestamps[index] - target) < \
+                        abs(self.timestamps[best] - target):
+                    best = index
+            # 槽位会被生产者覆盖，返回独立副本
+            return self.buffers[best].copy(), self.timestamps[best]
+
+
+class SceneChangeDetector:
+    """静止画面检测 - 在大幅降采样的缩略图上计算平均绝对差
+
+    与参考缩略图比较而不是只与上一帧比较，缓慢的变化也会累积触发；
+    连续 static_seconds 秒低于阈值后判定为静止，有变化或收到控制命令时立即恢复。
+    """
+
+    def __init__(self, threshold: float = 2.0, static_seconds: float = 2.0,
+                 keepalive_fps: float = 1.0, step: int = 16, activity_hold: float = 5.0):
+        self.threshold = threshold
+        self.static_seconds = static_seconds
+        self.keepalive_interval = 1.0 / max(keepalive_fps, 0.1)
+        self.step = step
+        self.activity_hold = activity_hold
+
+        # 预分配的缩略图缓冲区
+        self.reference: Optional[np.ndarray] = None
+        self.current: Optional[np.ndarray] = None
+        self.diff: Optional[np.ndarray] = None
+
+        self.last_change = time.monotonic()
+        self.active_until = 0.0
+        self.is_static = False
+        self.change_value = 0.0
+
+    def notify_activity(self):
+        """收到控制命令，保持全帧率一段时间"""
+        self.active_until = time.monotonic() + self.activity_hold
+        self.is_static = False
+
+    def update(self, frame) -> bool:
+        """输入一帧，返回当前是否为静止画面"""
+        # 只取一个通道做步进降采样，切片为视图，不复制整帧
+        small = frame[::self.step, ::self.step, 1] if frame.ndim == 3 else \
+            frame[::self.step, ::self.step]
+
+        if self.reference is None or self.reference.shape != small.shape:
+            self.reference = small.astype(np.int16)
+            self.current = np.empty_like(self.reference)
+            self.diff = np.empty_like(self.reference)
+            self.last_change = time.monotonic()
+            self.is_static = False
+            return False
+
+        np.copyto(self.current, small, casting='unsafe')
+        np.subtract(self.current, self.reference, out=self.diff)
+        np.abs(self.diff, out=self.diff)
+        self.change_value = float(self.diff.mean())
+
+        now = time.monotonic()
+        if self.change_value >= self.threshold or now < self.active_until:
+            # 画面变化：更新参考帧，恢复全帧率
+            self.reference, self.current = self.current, self.reference
+            self.last_change = now
+            self.is_static = False
+        else:
+            self.is_static = now - self.last_change >= self.static_seconds
+        return self.is_static
+
+
+class StreamProfile:
+    """视频流档位 - 保存一个分辨率/质量组合及其"最新帧"槽位"""
+
+    def __init__(self, name: str, width: int, height: int, jpeg_quality: int = 85,
+                 fps: int = 30, source: str = 'main', encoder=None):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.jpeg_quality = jpeg_quality
+        self.fps = fps
+        # 帧来源: main(主输出) / lores(硬件低分辨率输出) / scale(共享缩放)
+        self.source = source
+
+        # 最新帧槽位
+        self.condition = threading.Condition()
+        self.frame_seq = 0
+        self.frame_bytes: Optional[bytes] = None
+        self.frame_time = 0.0
+        self.capture_time = 0.0
+        self.last_encode = 0.0
+
+        # 客户端列表
+        self.clients: List['StreamClient'] = []
+        self.frames_encoded = 0
+        self.frames_republished = 0
+        # 已断开客户端的发送字节数和跳过帧数
+        self.closed_bytes_sent = 0
+        self.closed_frames_skipped = 0
+
+        # 编码后端，默认为 OpenCV 软件编码
+        self.encoder = encoder or OpenCVJpegEncoder(jpeg_quality)
+        self.encode_time_avg = 0.0
+        self.encode_time = HistogramValue(ENCODE_BUCKETS)
+
+    def publish(self, frame_bytes: bytes, capture_time: float = 0.0, repeat: bool = False):
+        """发布新帧并唤醒该档位上等待的客户端，repeat 为静止画面保活重发的旧帧"""
+        with self.condition:
+            self.frame_seq += 1
+            self.frame_bytes = frame_bytes
+            self.frame_time = time.time()
+            self.capture_time = capture_time or self.frame_time
+            if repeat:
+                self.frames_republished += 1
+            else:
+                self.frames_encoded += 1
+            self.condition.notify_all()
+
+    def get_status(self) -> dict:
+        """获取档位状态"""
+        return {
+            'size': f"{self.width}x{self.height}",
+            'jpeg_quality': self.jpeg_quality,
+            'fps': self.fps,
+            'source': self.source,
+            'encoder': self.encoder.name,
+            'encode_time_avg': round(self.encode_time_avg, 4),
+            'clients': len(self.clients),
+            'frame_seq': self.frame_seq,
+            'frames_encoded': self.frames_encoded,
+            'frames_republished': self.frames_republished,
+            'last_frame_size': len(self.frame_bytes) if self.frame_bytes else 0
+        }
+
+
+class FrameBroadcaster:
+    """视频帧广播类
+
+    生产者线程每帧只捕获一次；每个有客户端订阅的档位每帧最多编码一次，
+    结果写入该档位带序号的"最新帧"槽位；各客户端在条件变量上等待新序号，
+    直接取用共享的JPEG数据。低分辨率档位来自摄像头硬件 lores 输出，
+    或由生产者统一缩放一次，不会按客户端单独缩放。
+    """
+
+    def __init__(self, capture_func: Callable, profiles: List[StreamProfile],
+                 default_profile: str = 'high', fps: int = 30, max_errors: int = 10,
+                 pixel_format: Optional[str] = None, snapshot_frames: int = 15,
+                 snapshot_keepalive: float = 10.0):
+        # capture_func 返回 (main, lores)，未配置 lores 输出时 lores 为 None；
+        # main 须为每次新分配的数组 (Picamera2 capture_array 即如此)，环形缓存直接保存其引用
+        self.capture_func = capture_func
+        self.profiles: Dict[str, StreamProfile] = {p.name: p for p in profiles}
+        self.default_profile = default_profile if default_profile in self.profiles \
+            else profiles[0].name
+        self.fps = fps
+        self.max_errors = max_errors
+
+        # 生产者线程专用的转换和缩放缓冲区
+        self.main_converter = FrameConverter(pixel_format)
+        self.lores_converter = FrameConverter('YUV420')
+        self.scale_buffers: Dict[Tuple[int, int], object] = {}
+
+        # 最近N帧原始画面，供拍照使用，采集期间始终写入，停止采集时释放
+        self.frame_ring = FrameRing(snapshot_frames)
+        self.snapshot_keepalive = snapshot_keepalive
+        self.active_until = 0.0
+
+        self.is_running = False
+        self.producer_thread = None
+
+        # 客户端数变化通知生产者
+        self.clients_changed = threading.Condition()
+        self.client_count = 0
+        self.next_client_id = 0
+
+        # 统计信息
+        self.frames_captured = 0
+        self.error_count = 0
+
+        # 错误过多时的恢复回调，返回是否恢复成功
+        self.on_error_limit: Optional[Callable[[], bool]] = None
+
+        # 静止画面检测，为 None 时始终全帧率编码
+        self.scene_detector: Optional[SceneChangeDetector] = None
+        self.frames_static = 0
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """启动生产者线程"""
+        if self.is_running:
+            self.logger.warning("帧广播已在运行")
+            return
+
+        self.is_running = True
+        self.producer_thread = threading.Thread(target=self._producer_loop)
+        self.producer_thread.daemon = True
+        self.producer_thread.start()
+        self.logger.info(f"帧广播已启动，FPS: {self.fps}, "
+                         f"档位: {', '.join(self.profiles)}")
+
+    def stop(self):
+        """停止生产者线程并唤醒所有等待的客户端"""
+        self.is_running = False
+        with self.clients_changed:
+            self.clients_changed.notify_all()
+        for profile in self.profiles.values():
+            with profile.condition:
+                profile.condition.notify_all()
+        if self.producer_thread and self.producer_thread.is_alive():
+            self.producer_thread.join(timeout=2)
+        for profile in self.profiles.values():
+            profile.encoder.close()
+        self.logger.info("帧广播已停止")
+
+    def get_profile(self, name: Optional[str]) -> StreamProfile:
+        """按名称获取档位，未知名称返回默认档位"""
+        return self.profiles.get(name or self.default_profile,
+                                 self.profiles[self.default_profile])
+
+    def add_client(self, name: str = '', profile_name: Optional[str] = None,
+                   passive: bool = False) -> 'StreamClient':
+        """登记一个视频流客户端，返回其节拍控制对象
+
+        passive 客户端只在其他客户端或拍照请求使采集运行时收到帧，不计入 client_count，
+        不会让生产者在无人观看时继续采集。
+        """
+        profile = self.get_profile(profile_name)
+        client = StreamClient(self, profile, name=name)
+        client.passive = passive
+        with self.clients_changed:
+            self.next_client_id += 1
+            client.client_id = self.next_client_id
+            if not passive:
+                self.client_count += 1
+            self.clients_changed.notify_all()
+        with profile.condition:
+            profile.clients.append(client)
+        self.logger.info(f"视频流客户端接入: {name} [{profile.name}]，"
+                         f"当前客户端数: {self.client_count}")
+        return client
+
+    def remove_client(self, client: 'StreamClient'):
+        """注销一个视频流客户端"""
+        profile = client.profile
+        with profile.condition:
+            if client in profile.clients:
+                profile.clients.remove(client)
+                profile.closed_bytes_sent += client.bytes_sent
+                profile.closed_frames_skipped += client.frames_skipped
+        with self.clients_changed:
+            if not client.passive:
+                self.client_count = max(0, self.client_count - 1)
+        self.logger.info(f"视频流客户端断开: {client.name} [{profile.name}]，"
+                         f"已发送 {client.frames_sent} 帧，跳过 {client.frames_skipped} 帧，"
+                         f"当前客户端数: {self.client_count}")
+
+    def set_passive(self, client: 'StreamClient', passive: bool):
+        """切换客户端是否计入采集需求"""
+        with self.clients_changed:
+            if client.passive == passive:
+                return
+            client.passive = passive
+            self.client_count += -1 if passive else 1
+            self.clients_changed.notify_all()
+
+    def wait_for_frame(self, profile: StreamProfile, last_seq: int,
+                       timeout: float = 1.0) -> Tuple[int, Optional[bytes], float]:
+        """等待档位中比 last_seq 更新的帧
+
+        返回 (序号, JPEG数据, 捕获时间)，超时返回 (last_seq, None, 0.0)
+        """
+        with profile.condition:
+            profile.condition.wait_for(
+                lambda: profile.frame_seq != last_seq or not self.is_running,
+                timeout=timeout
+            )
+            if profile.frame_seq == last_seq or profile.frame_bytes is None:
+                return last_seq, None, 0.0
+            return profile.frame_seq, profile.frame_bytes, profile.capture_time
+
+    def _producer_loop(self):
+        """生产者循环：捕获一次，按订阅档位各编码一次并发布"""
+        frame_interval = 1.0 / self.fps
+
+        next_deadline = time.monotonic()
+        while self.is_running:
+            # 没有客户端且无拍照请求时不占用摄像头和CPU
+            with self.clients_changed:
+                if not self._has_demand():
+                    # 停止采集时释放环形缓存
+                    if self.frame_ring.stored:
+                        self.frame_ring.clear()
+                    self.clients_changed.wait_for(
+                        lambda: self._has_demand() or not self.is_running,
+                        timeout=1.0
+                    )
+                    next_deadline = time.monotonic()
+                    continue
+
+            try:
+                main_frame, lores_frame = self.capture_func()
+                capture_time = time.time()
+
+                # 检查帧是否有效
+                if main_frame is None or main_frame.size == 0:
+                    self.error_count += 1
+                    self.logger.warning(f"捕获到空帧 (错误计数: {self.error_count})")
+                    time.sleep(0.1)
+                    continue
+
+                self.frames_captured += 1
+                main_bgr = self.main_converter.to_bgr(main_frame)
+                # 采集期间始终写入环形缓存，拍照才能回溯 offset_ms；
+                # 未做格式转换时 main_bgr 就是 capture_func 新返回的数组，只保存引用
+                self.frame_ring.push(main_bgr, capture_time, owned=main_bgr is main_frame)
+                static = self.scene_detector.update(main_bgr) if self.scene_detector else False
+                self._encode_profiles(main_bgr, lores_frame, capture_time, static)
+                self.error_count = 0  # 重置错误计数
+
+                # 每1000帧记录一次统计
+                if self.frames_captured % 1000 == 0:
+                    self.logger.info(f"已捕获 {self.frames_captured} 帧，"
+                                     f"客户端数: {self.client_count}")
+
+            except Exception as e:
+                self.error_count += 1
+                self.logger.error(f"摄像头帧生成错误: {e} (错误计数: {self.error_count})")
+
+                # 如果错误过多，尝试重新初始化摄像头
+                if self.error_count >= self.max_errors:
+                    self.logger.warning("摄像头错误过多，尝试重新初始化")
+                    if self.on_error_limit and self.on_error_limit():
+                        self.error_count = 0
+                    else:
+                        self.logger.error("摄像头重新初始化失败，帧广播停止")
+                        self.stop_async()
+                        break
+
+            # 按截止时间节拍，编码耗时计入帧间隔
+            next_deadline += frame_interval
+            delay = next_deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_deadline = time.monotonic()
+
+    def _has_demand(self) -> bool:
+        """是否有客户端或拍照请求需要采集"""
+        return self.client_count > 0 or time.monotonic() < self.active_until
+
+    def wake(self, duration: float):
+        """在没有视频流客户端时保持采集一段时间"""
+        with self.clients_changed:
+            self.active_until = max(self.active_until, time.monotonic() + duration)
+            self.clients_changed.notify_all()
+
+    def get_snapshot(self, age: float = 0.0, timeout: float = 1.0):
+        """从环形缓存取一帧原始画面，返回 (帧副本, 拍摄时间)
+
+        采集期间环形缓存始终写入，age 最多回溯到缓存内最早一帧 (max_snapshot_age)；
+        采集空闲时缓存为空，唤醒生产者并等待一帧新画面，此时 age 不起作用。
+        调用方可比较返回的拍摄时间与请求时间，判断 age 是否生效。
+        """
+        self.wake(self.snapshot_keepalive)
+        if time.time() - self.frame_ring.latest_time() > age + 0.5:
+            count = self.frame_ring.count
+            if not self.frame_ring.wait_for_new(count, timeout):
+                return None, 0.0
+        return self.frame_ring.get(age)
+
+    @property
+    def max_snapshot_age(self) -> float:
+        """环形缓存能回溯的最长时间 (秒)"""
+        return (self.frame_ring.size - 1) / self.fps
+
+    def stop_async(self):
+        """在生产者线程内停止广播（不等待自身线程结束）"""
+        self.is_running = False
+        for profile in self.profiles.values():
+            with profile.condition:
+                profile.condition.notify_all()
+
+    def notify_activity(self):
+        """收到控制命令时调用，立即退出静止画面模式"""
+        if self.scene_detector:
+            self.scene_detector.notify_activity()
+
+    def _encode_profiles(self, main_bgr, lores_frame, capture_time: float, static: bool = False):
+        """为每个有客户端且到达编码时间的档位编码一次
+
+        静止画面时不编码，按保活帧率重发上一帧的JPEG数据。
+        """
+        now = time.monotonic()
+        lores_bgr = None
+        scaled = {}
+
+        for profile in self.profiles.values():
+            if not profile.clients:
+                continue
+            if now - profile.last_encode < 1.0 / profile.fps - 0.002:
+                continue
+
+            if static and profile.frame_bytes is not None:
+                if now - profile.last_encode >= self.scene_detector.keepalive_interval:
+                    profile.last_encode = now
+                    profile.publish(profile.frame_bytes, profile.capture_time, repeat=True)
+                self.frames_static += 1
+                continue
+
+            # 选择帧来源，缩放结果按尺寸在本帧内共享；推送式编码器自行取帧
+            if not profile.encoder.uses_frame:
+                source = None
+            elif profile.source == 'lores' and lores_frame is not None:
+                if lores_bgr is None:
+                    lores_bgr = self.lores_converter.to_bgr(lores_frame)
+                source = lores_bgr
+            elif (profile.width, profile.height) == (main_bgr.shape[1], main_bgr.shape[0]):
+                source = main_bgr
+            else:
+                size = (profile.width, profile.height)
+                if size not in scaled:
+                    scaled[size] = self._resize(main_bgr, size)
+                source = scaled[size]
+
+            encode_start = time.monotonic()
+            frame_bytes = profile.encoder.encode(source)
+            encode_time = time.monotonic() - encode_start
+            profile.encode_time_avg = 0.9 * profile.encode_time_avg + 0.1 * encode_time
+            profile.encode_time.observe(encode_time)
+            if frame_bytes:
+                profile.last_encode = now
+                profile.publish(frame_bytes, capture_time)
+            else:
+                self.logger.warning(f"帧编码失败 [{profile.name}]")
+
+    def _resize(self, frame, size: Tuple[int, int]):
+        """缩放到指定尺寸，同一尺寸复用同一块缓冲区"""
+        buffer = self.scale_buffers.get(size)
+        if buffer is not None and buffer.shape[2:] == frame.shape[2:]:
+            return cv2.resize(frame, size, dst=buffer, interpolation=cv2.INTER_AREA)
+        buffer = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        self.scale_buffers[size] = buffer
+        return buffer
+
+    def get_status(self) -> dict:
+        """获取广播状态"""
+        return {
+            'running': self.is_running,
+            'clients': self.client_count,
+            'frames_captured': self.frames_captured,
+            'error_count': self.error_count,
+            'snapshot_frames': min(self.frame_ring.stored, self.frame_ring.size),
+            'scene_static': self.scene_detector.is_static if self.scene_detector else False,
+            'scene_change': round(self.scene_detector.change_value, 2) if self.scene_detector else 0,
+            'encodes_skipped_static': self.frames_static,
+            'default_profile': self.default_profile,
+            'profiles': {name: p.get_status() for name, p in self.profiles.items()},
+            'client_details': [client.get_status()
+                               for p in self.profiles.values() for client in list(p.clients)]
+        }
+
+
+class StreamClient:
+    """单个视频流客户端的自适应节拍控制
+
+    按下一帧截止时间休眠而不是固定休眠；每次只取最新帧，旧帧直接跳过。
+    通过 yield 到下次恢复之间的耗时估计套接字写入阻塞时间，
+    写入变慢时降低该客户端的有效帧率，写入恢复后逐步回到目标帧率。
+    """
+
+    def __init__(self, broadcaster: FrameBroadcaster, profile: StreamProfile,
+                 min_fps: float = 2.0, name: str = ''):
+        self.broadcaster = broadcaster
+        self.profile = profile
+        self.name = name
+        # 广播内唯一的客户端编号，由 add_client 分配
+        self.client_id = 0
+        # 不计入采集需求的客户端（如维护预录缓冲的录像模块）
+        self.passive = False
+        self.min_interval = 1.0 / profile.fps
+        self.max_interval = 1.0 / min(min_fps, profile.fps)
+        self.interval = self.min_interval
+
+        self.last_seq = profile.frame_seq
+        self.last_capture_time = 0.0
+        self.next_deadline = time.monotonic()
+
+        # 写入耗时的指数滑动平均
+        self.write_time_avg = 0.0
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.bytes_sent = 0
+
+        # 客户端确认的端到端延迟（捕获到显示）
+        self.latency_avg = 0.0
+        self.frames_acked = 0
+
+    def next_frame(self, timeout: float = 1.0) -> Optional[bytes]:
+        """等到下一帧截止时间后取最新帧，超时返回 None"""
+        delay = self.next_deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        seq, frame_bytes, capture_time = self.broadcaster.wait_for_frame(
+            self.profile, self.last_seq, timeout=timeout)
+        if frame_bytes is None:
+            return None
+
+        # 中间未发送的帧全部跳过，不排队
+        if self.frames_sent and seq - self.last_seq > 1:
+            self.frames_skipped += seq - self.last_seq - 1
+        self.last_seq = seq
+        self.last_capture_time = capture_time
+        return frame_bytes
+
+    def record_write(self, frame_size: int, write_time: float):
+        """记录一次写入耗时并调整该客户端的帧间隔"""
+        self.frames_sent += 1
+        self.bytes_sent += frame_size
+        self.write_time_avg = 0.8 * self.write_time_avg + 0.2 * write_time
+
+        if self.write_time_avg > self.interval * 0.5:
+            # 写入阻塞：乘性降低帧率
+            self.interval = min(self.max_interval,
+                                max(self.interval * 1.25, self.write_time_avg * 2))
+        elif self.interval > self.min_interval:
+            # 写入顺畅：逐步恢复到目标帧率
+            self.interval = max(self.min_interval,
+                                self.interval - (self.interval - self.min_interval) * 0.1)
+
+        # 截止时间从上一个截止时间推进，落后时从当前时间重新计
+        now = time.monotonic()
+        self.next_deadline += self.interval
+        if self.next_deadline < now:
+            self.next_deadline = now
+
+    def record_ack(self, latency: float):
+        """记录客户端确认一帧时测得的捕获到显示延迟"""
+        self.frames_acked += 1
+        if self.frames_acked == 1:
+            self.latency_avg = latency
+        else:
+            self.latency_avg = 0.9 * self.latency_avg + 0.1 * latency
+
+    def get_status(self) -> dict:
+        """获取客户端状态"""
+        return {
+            'id': self.client_id,
+            'name': self.name,
+            'profile': self.profile.name,
+            'effective_fps': round(1.0 / self.interval, 1),
+            'write_time_avg': round(self.write_time_avg, 4),
+            'frames_sent': self.frames_sent,
+            'frames_skipped': self.frames_skipped,
+            'bytes_sent': self.bytes_sent,
+            'frames_acked': self.frames_acked,
+            'latency_avg': round(self.latency_avg, 4)
+        }
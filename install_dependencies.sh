@@ -49,7 +49,7 @@ pip install --upgrade pip
 
 # 安装依赖
 echo "📦 安装Python依赖..."
-pip install flask pyserial opencv-python numpy configparser
+pip install flask pyserial opencv-python numpy configparser flask-sock
 
 # 检查树莓派相关包
 echo "📦 检查树莓派相关包..."
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JPEG编码模块 - 可插拔的视频帧编码后端
+
+可选后端 ([camera] encoder 或 [stream.*] encoder):
+    opencv          OpenCV 软件编码，启用 Huffman 优化 (原有行为)
+    opencv_fast     OpenCV 软件编码，关闭优化，CPU 占用更低
+    hardware        Picamera2 MJPEGEncoder (V4L2 硬件编码)
+    picamera_jpeg   Picamera2 JpegEncoder，在编码器线程中压缩
+    software_mjpeg  推送式软件编码器，与硬件编码器走同一输出路径，用于脱离树莓派测试
+
+脱离设备自检（合成图像，检查各后端输出及回退路径）:
+    python3 jpeg_encoder.py
+"""
+
+import io
+import sys
+import cv2
+import time
+import argparse
+import threading
+import logging
+import numpy as np
+from abc import ABC, abstractmethod
+from typing import Optional, Callable
+
+# Picamera2 编码器为可选依赖，缺失时自动回退到 OpenCV
+try:
+    from picamera2.encoders import MJPEGEncoder, JpegEncoder, Quality
+    from picamera2.outputs import FileOutput
+    PICAMERA_ENCODERS_AVAILABLE = True
+except ImportError:
+    PICAMERA_ENCODERS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ENCODER_BACKENDS = ('opencv', 'opencv_fast', 'hardware', 'picamera_jpeg', 'software_mjpeg')
+
+
+class OpenCVJpegEncoder:
+    """OpenCV 软件JPEG编码器"""
+
+    name = 'opencv'
+    uses_frame = True
+
+    def __init__(self, jpeg_quality: int = 85, optimize: bool = True):
+        self.jpeg_quality = jpeg_quality
+        self.optimize = optimize
+        if not optimize:
+            self.name = 'opencv_fast'
+
+        # 编码参数只构建一次
+        self.encode_param = [
+            cv2.IMWRITE_JPEG_QUALITY, jpeg_quality,
+            cv2.IMWRITE_JPEG_PROGRESSIVE, 0,  # 禁用渐进式JPEG
+            cv2.IMWRITE_JPEG_OPTIMIZE, 1 if optimize else 0
+        ]
+
+    def encode(self, frame) -> Optional[bytes]:
+        """编码一帧BGR图像，失败返回 None"""
+        ret, buffer = cv2.imencode('.jpg', frame, self.encode_param)
+        if ret and buffer is not None and buffer.size > 0:
+            return buffer.tobytes()
+        return None
+
+    def close(self):
+        """释放资源"""
+        pass
+
+
+class FrameOutput(io.BufferedIOBase):
+    """内存输出 - 接收推送式编码器写入的JPEG帧，只保留最新一帧"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame: Optional[bytes] = None
+        self.seq = 0
+
+    def writable(self):
+        return True
+
+    def write(self, buf):
+        """编码器每写入一次即为一帧完整JPEG"""
+        with self.condition:
+            self.frame = bytes(buf)
+            self.seq += 1
+            self.condition.notify_all()
+        return len(buf)
+
+    def wait_for_frame(self, last_seq: int, timeout: float):
+        """等待比 last_seq 更新的帧，超时返回 (last_seq, None)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq != last_seq, timeout=timeout)
+            if self.seq == last_seq:
+                return last_seq, None
+            return self.seq, self.frame
+
+
+class PushEncoder(ABC):
+    """推送式编码器基类
+
+    编码器独立产生JPEG并写入 FrameOutput，encode() 不处理传入的帧，
+    而是返回编码器最近产生的一帧；启动或运行失败时自动回退到 OpenCV 编码。
+    """
+
+    name = 'push'
+
+    def __init__(self, jpeg_quality: int = 85, fps: int = 30):
+        self.jpeg_quality = jpeg_quality
+        self.frame_timeout = 2.0 / fps
+        self.output = FrameOutput()
+        self.last_seq = 0
+        self.started = False
+        self.fallback: Optional[OpenCVJpegEncoder] = None
+
+    @abstractmethod
+    def start(self):
+        """启动编码器，失败时抛出异常以回退到 OpenCV 编码"""
+
+    @abstractmethod
+    def stop(self):
+        """停止编码器"""
+
+    @property
+    def uses_frame(self) -> bool:
+        """是否需要调用方提供原始帧"""
+        return self.fallback is not None
+
+    def needs_restart(self) -> bool:
+        """编码器输入源是否已变化，需要重新启动"""
+        return False
+
+    def submit(self, frame):
+        """向编码器提交原始帧，硬件编码器直接从摄像头取帧，无需提交"""
+        pass
+
+    def encode(self, frame) -> Optional[bytes]:
+        """返回编码器最新输出的JPEG帧"""
+        if self.fallback:
+            return self.fallback.encode(frame)
+
+        try:
+            if self.started and self.needs_restart():
+                self.stop()
+                self.started = False
+            if not self.started:
+                self.start()
+                self.started = True
+                logger.info(f"编码器已启动: {self.name}")
+
+            self.submit(frame)
+            seq, frame_bytes = self.output.wait_for_frame(self.last_seq, self.frame_timeout)
+            if frame_bytes is None:
+                return None
+            self.last_seq = seq
+            return frame_bytes
+        except Exception as e:
+            logger.warning(f"编码器 {self.name} 不可用，回退到 OpenCV 编码: {e}")
+            self.close()
+            self.fallback = OpenCVJpegEncoder(self.jpeg_quality)
+            self.name = f"{self.name}->opencv"
+            # 本次调用方未提供原始帧，从下一帧开始由 OpenCV 编码
+            return self.fallback.encode(frame) if frame is not None else None
+
+    def close(self):
+        """停止编码器"""
+        if self.started:
+            try:
+                self.stop()
+            except Exception as e:
+                logger.error(f"停止编码器 {self.name} 出错: {e}")
+            self.started = False
+
+
+class PicameraJpegEncoder(PushEncoder):
+    """Picamera2 编码器 - MJPEGEncoder(硬件) 或 JpegEncoder，输出到内存"""
+
+    def __init__(self, camera_getter: Callable, jpeg_quality: int = 85, fps: int = 30,
+                 stream_name: str = 'main', hardware: bool = True):
+        super().__init__(jpeg_quality, fps)
+        # 摄像头重新初始化后 camera_getter 返回新实例
+        self.camera_getter = camera_getter
+        self.stream_name = stream_name
+        self.hardware = hardware
+        self.name = 'hardware' if hardware else 'picamera_jpeg'
+        self.camera = None
+        self.encoder = None
+
+    def needs_restart(self) -> bool:
+        return self.camera_getter() is not self.camera
+
+    def start(self):
+        camera = self.camera_getter()
+        if camera is None:
+            raise RuntimeError("摄像头未初始化")
+
+        if self.hardware:
+            self.encoder = MJPEGEncoder()
+            quality = Quality.VERY_HIGH if self.jpeg_quality >= 90 else \
+                Quality.HIGH if self.jpeg_quality >= 75 else \
+                Quality.MEDIUM if self.jpeg_quality >= 50 else Quality.LOW
+            camera.start_encoder(self.encoder, FileOutput(self.output),
+                                 name=self.stream_name, quality=quality)
+        else:
+            self.encoder = JpegEncoder(q=self.jpeg_quality)
+            camera.start_encoder(self.encoder, FileOutput(self.output), name=self.stream_name)
+        self.camera = camera
+
+    def stop(self):
+        if self.camera and self.encoder:
+            self.camera.stop_encoder(self.encoder)
+        self.encoder = None
+        self.camera = None
+
+
+class SoftwareMJPEGEncoder(PushEncoder):
+    """推送式软件编码器 - 在独立线程中用 OpenCV 编码并写入 FrameOutput
+
+    与硬件编码器具有相同的异步输出行为（输出比输入晚一帧），
+    可在没有摄像头的开发机上测试推送式编码路径。
+    """
+
+    name = 'software_mjpeg'
+    uses_frame = True
+
+    def __init__(self, jpeg_quality: int = 85, fps: int = 30):
+        super().__init__(jpeg_quality, fps)
+        self.encoder = OpenCVJpegEncoder(jpeg_quality, optimize=False)
+        self.pending = None
+        self.pending_lock = threading.Condition()
+        self.is_running = False
+        self.worker = None
+
+    def start(self):
+        self.is_running = True
+        self.worker = threading.Thread(target=self._encode_loop)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def stop(self):
+        self.is_running = False
+        with self.pending_lock:
+            self.pending_lock.notify_all()
+        if self.worker and self.worker.is_alive():
+            self.worker.join(timeout=1)
+
+    def submit(self, frame):
+        # 只保留最新一帧，编码线程来不及处理的帧直接丢弃
+        with self.pending_lock:
+            self.pending = frame.copy()
+            self.pending_lock.notify_all()
+
+    def _encode_loop(self):
+        """编码线程：取最新提交的帧编码后写入输出"""
+        while self.is_running:
+            with self.pending_lock:
+                self.pending_lock.wait_for(
+                    lambda: self.pending is not None or not self.is_running,
+                    timeout=1.0
+                )
+                frame, self.pending = self.pending, None
+            if frame is None:
+                continue
+            frame_bytes = self.encoder.encode(frame)
+            if frame_bytes:
+                self.output.write(frame_bytes)
+
+
+def create_encoder(backend: str, jpeg_quality: int = 85, fps: int = 30,
+                   camera_getter: Optional[Callable] = None, stream_name: str = 'main'):
+    """按名称创建编码器，不可用时回退到 OpenCV 软件编码"""
+    if backend == 'opencv_fast':
+        return OpenCVJpegEncoder(jpeg_quality, optimize=False)
+    if backend == 'software_mjpeg':
+        return SoftwareMJPEGEncoder(jpeg_quality, fps)
+    if backend in ('hardware', 'picamera_jpeg'):
+        if not PICAMERA_ENCODERS_AVAILABLE or camera_getter is None:
+            logger.warning(f"Picamera2 编码器不可用，{backend} 回退到 OpenCV 编码")
+            return OpenCVJpegEncoder(jpeg_quality)
+        if stream_name not in ('main', 'lores'):
+            logger.warning(f"{backend} 编码器只能用于 main/lores 输出，回退到 OpenCV 编码")
+            return OpenCVJpegEncoder(jpeg_quality)
+        return PicameraJpegEncoder(camera_getter, jpeg_quality, fps, stream_name,
+                                   hardware=(backend == 'hardware'))
+    if backend != 'opencv':
+        logger.warning(f"未知的编码器后端: {backend}，使用 OpenCV 编码")
+    return OpenCVJpegEncoder(jpeg_quality)
+
+
+def self_test(frames: int = 30, width: int = 640, height: int = 480) -> bool:
+    """用合成图像检查各后端及回退路径，不需要摄像头或 Picamera2"""
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    frame[:, :, 1] = np.linspace(0, 255, width, dtype=np.uint8)
+
+    def check(label: str, encoder, expected_name: str) -> bool:
+        # 推送式编码器输出晚一帧，连续送入多帧后取最后一次输出
+        output = None
+        start = time.perf_counter()
+        for i in range(frames):
+            frame[:, :, 2] = i * 8
+            output = encoder.encode(frame) or output
+        elapsed = (time.perf_counter() - start) * 1000 / frames
+        encoder.close()
+
+        decoded = cv2.imdecode(np.frombuffer(output, np.uint8), cv2.IMREAD_COLOR) \
+            if output else None
+        ok = decoded is not None and decoded.shape == frame.shape and \
+            encoder.name == expected_name
+        print(f"{'通过' if ok else '失败'}  {label:<28} {encoder.name:<20} "
+              f"{len(output) if output else 0:>7} 字节  {elapsed:6.2f} 毫秒/帧")
+        return ok
+
+    results = [
+        check('opencv', create_encoder('opencv'), 'opencv'),
+        check('opencv_fast', create_encoder('opencv_fast'), 'opencv_fast'),
+        check('software_mjpeg', create_encoder('software_mjpeg'), 'software_mjpeg'),
+        # 无摄像头时 create_encoder 直接回退
+        check('hardware (无摄像头)', create_encoder('hardware'), 'opencv'),
+        check('未知后端', create_encoder('unknown'), 'opencv'),
+        # 推送式编码器启动失败时在 encode() 中回退
+        check('hardware (启动失败)', PicameraJpegEncoder(lambda: None), 'hardware->opencv'),
+    ]
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JPEG 编码后端自检')
+    parser.add_argument('--frames', type=int, default=30, help='每个后端编码的帧数')
+    parser.add_argument('--size', default='640x480', help='合成图像尺寸，如 1280x720')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    sys.exit(0 if self_test(args.frames, width, height) else 1)
+
+
+if __name__ == '__main__':
+    main()
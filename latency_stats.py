@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+延迟统计模块 - 记录控制命令从页面按键到串口写入各阶段的耗时
+
+各阶段 (毫秒):
+    keydown_to_send   按键到页面发出请求（页面测量）
+    client_to_server  页面发出到服务器收到（页面按估计的时钟偏差换算到服务器时钟）
+    server_to_enqueue 服务器收到到进入串口写入队列
+    queue_wait        在写入队列中等待
+    write_flush       write() 和 flush() 耗时
+    receive_to_flush  服务器收到到写入完成
+    total             按键到写入完成
+"""
+
+import time
+import random
+import threading
+import logging
+import numpy as np
+from typing import Dict
+
+STAGES = ('keydown_to_send', 'client_to_server', 'server_to_enqueue', 'queue_wait',
+          'write_flush', 'receive_to_flush', 'total')
+
+class LatencyHistogram:
+    """HDR 风格的对数-线性直方图
+
+    以微秒为单位，每个 2 的幂区间再等分为 16 份，相对误差不超过约 3%，
+    记录时只做整数运算和一次数组自增，内存大小固定。
+    """
+
+    SUB_BITS = 5
+    SUB_COUNT = 1 << SUB_BITS
+    HALF_COUNT = SUB_COUNT >> 1
+
+    def __init__(self, max_seconds: float = 60.0):
+        self.max_value = int(max_seconds * 1e6)
+        self.counts = np.zeros(self._index(self.max_value) + 1, dtype=np.int64)
+        self.total = 0
+        self.sum = 0
+        self.min = 0
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        if value < self.SUB_COUNT:
+            return value
+        shift = value.bit_length() - self.SUB_BITS
+        return self.SUB_COUNT + (shift - 1) * self.HALF_COUNT + ((value >> shift) - self.HALF_COUNT)
+
+    def _value(self, index: int) -> float:
+        """分桶的代表值（区间中点，微秒）"""
+        if index < self.SUB_COUNT:
+            return float(index)
+        shift = (index - self.SUB_COUNT) // self.HALF_COUNT + 1
+        mantissa = (index - self.SUB_COUNT) % self.HALF_COUNT + self.HALF_COUNT
+        return (mantissa + 0.5) * (1 << shift)
+
+    def record(self, seconds: float):
+        """记录一个耗时（秒）"""
+        value = min(self.max_value, max(0, int(seconds * 1e6)))
+        self.counts[self._index(value)] += 1
+        if self.total == 0 or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.total += 1
+        self.sum += value
+
+    def percentile(self, percent: float) -> float:
+        """第 percent 百分位（微秒）"""
+        if self.total == 0:
+            return 0.0
+        rank = max(1, int(np.ceil(self.total * percent / 100.0)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self._value(index), float(self.max))
+
+    def get_summary(self) -> dict:
+        """获取统计摘要（毫秒）"""
+        if self.total == 0:
+            return {'count': 0}
+        return {
+            'count': self.total,
+            'min': round(self.min / 1000, 3),
+            'mean': round(self.sum / self.total / 1000, 3),
+            'p50': round(self.percentile(50) / 1000, 3),
+            'p90': round(self.percentile(90) / 1000, 3),
+            'p99': round(self.percentile(99) / 1000, 3),
+            'p999': round(self.percentile(99.9) / 1000, 3),
+            'max': round(self.max / 1000, 3)
+        }
+
+class LatencyTracker:
+    """控制链路延迟跟踪类
+
+    按 sample_rate 比例抽样命令，抽中的命令写入串口后在写线程中按阶段记录到直方图，
+    未抽中的命令没有额外开销，可在生产环境常开。
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in STAGES}
+        self.outcomes: Dict[str, int] = {}
+        self.started = time.time()
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def should_sample(self) -> bool:
+        """本条命令是否抽样"""
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record_command(self, item, timing: dict):
+        """串口命令完成回调：按阶段记录耗时
+
+        timing 包含 received（服务器收到时间），可选 client_time（页面发出时间，已换算到
+        服务器时钟）和 keydown_delay（按键到发出的耗时），单位均为秒。
+        """
+        with self.lock:
+            self.outcomes[item.status] = self.outcomes.get(item.status, 0) + 1
+            if item.status != 'sent':
+                return
+
+            received = timing['received']
+            client_time = timing.get('client_time')
+            keydown_delay = timing.get('keydown_delay')
+
+            stages = {
+                'server_to_enqueue': item.enqueued - received,
+                'queue_wait': item.write_start - item.enqueued,
+                'write_flush': item.wire_time - item.write_start,
+                'receive_to_flush': item.wire_time - received
+            }
+            if keydown_delay is not None:
+                stages['keydown_to_send'] = keydown_delay
+            if client_time:
+                # 时钟偏差估计有误差，负值按 0 计
+                stages['client_to_server'] = max(0.0, received - client_time)
+                if keydown_delay is not None:
+                    stages['total'] = item.wire_time - client_time + keydown_delay
+
+            for stage, seconds in stages.items():
+                self.histograms[stage].record(seconds)
+
+    def reset(self):
+        """清空统计"""
+        with self.lock:
+            self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+            self.outcomes = {}
+            self.started = time.time()
+        self.logger.info("控制延迟统计已清空")
+
+    def get_compact(self) -> dict:
+        """各阶段的 p50/p99 (毫秒)，供状态面板使用"""
+        with self.lock:
+            compact = {}
+            for stage, histogram in self.histograms.items():
+                if histogram.total:
+                    compact[stage] = {
+                        'count': histogram.total,
+                        'p50': round(histogram.percentile(50) / 1000, 2),
+                        'p99': round(histogram.percentile(99) / 1000, 2)
+                    }
+            return compact
+
+    def get_status(self) -> dict:
+        """获取完整统计"""
+        with self.lock:
+            return {
+                'sample_rate': self.sample_rate,
+                'since': self.started,
+                'outcomes': dict(self.outcomes),
+                'stages': {stage: histogram.get_summary()
+                           for stage, histogram in self.histograms.items()}
+            }
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+指标导出模块 - 以 Prometheus 文本格式 (0.0.4) 输出计数器、仪表和直方图
+
+热路径上的计数和直方图按线程分片：每个线程第一次写入时登记一个只由它自己写入的计数单元，
+之后的自增不加锁；抓取时汇总所有单元，已退出线程的单元并入累计值后移除。
+帧广播、串口处理器、连接监控中已有的统计属性都只由各自的线程写入，
+由抓取时调用的收集函数直接读取，热路径上不增加任何操作。
+"""
+
+import time
+import threading
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 默认直方图分桶 (秒)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class ThreadCells:
+    """按线程分片的计数单元"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.cells: Dict[threading.Thread, List[float]] = {}
+        # 已退出线程的累计值
+        self.retired = [0] * size
+
+    def cell(self) -> List[float]:
+        """当前线程的计数单元，只有登记时加锁"""
+        cell = getattr(self.local, 'cell', None)
+        if cell is None:
+            cell = [0] * self.size
+            with self.lock:
+                self.cells[threading.current_thread()] = cell
+            self.local.cell = cell
+        return cell
+
+    def snapshot(self) -> List[float]:
+        """汇总所有线程的计数"""
+        with self.lock:
+            for thread in [t for t in self.cells if not t.is_alive()]:
+                cell = self.cells.pop(thread)
+                for i, value in enumerate(cell):
+                    self.retired[i] += value
+            totals = list(self.retired)
+            for cell in self.cells.values():
+                for i, value in enumerate(cell):
+                    totals[i] += value
+        return totals
+
+class CounterValue:
+    """单个计数器"""
+
+    def __init__(self):
+        self.cells = ThreadCells(1)
+
+    def inc(self, amount: float = 1):
+        self.cells.cell()[0] += amount
+
+    @property
+    def value(self) -> float:
+        return self.cells.snapshot()[0]
+
+class HistogramValue:
+    """单个直方图，分桶为上界 (le)，最后一个分桶为 +Inf"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # 各分桶计数 + 溢出分桶 + 总和
+        self.cells = ThreadCells(len(self.buckets) + 2)
+
+    def observe(self, value: float):
+        cell = self.cells.cell()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        """返回 (累积分桶计数, 总和, 样本数)"""
+        totals = self.cells.snapshot()
+        cumulative = []
+        count = 0
+        for value in totals[:-1]:
+            count += value
+            cumulative.append(count)
+        return cumulative, totals[-1], count
+
+class MetricFamily:
+    """一个指标族及其样本，由收集函数在抓取时生成
+
+    计数器的族名自动加上 _total 后缀，HELP/TYPE 行与样本同名。
+    """
+
+    def __init__(self, name: str, kind: str, help_text: str):
+        if kind == 'counter' and not name.endswith('_total'):
+            name += '_total'
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.samples: List[Tuple[str, Dict[str, str], float]] = []
+
+    def add(self, labels: Dict[str, object], value: Optional[float]):
+        """添加一个计数器或仪表样本，value 为 None 时跳过"""
+        if value is not None:
+            self.samples.append(('', labels, float(value)))
+        return self
+
+    def add_histogram(self, labels: Dict[str, object], histogram: HistogramValue):
+        """添加一个直方图的分桶、总和和样本数"""
+        cumulative, total, count = histogram.snapshot()
+        bounds = [_format_value(b) for b in histogram.buckets] + ['+Inf']
+        for bound, value in zip(bounds, cumulative):
+            self.samples.append(('_bucket', {**labels, 'le': bound}, value))
+        self.samples.append(('_sum', labels, total))
+        self.samples.append(('_count', labels, count))
+        return self
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples:
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+class Counter:
+    """带标签的计数器，labels() 返回对应标签值的计数器"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self.lock = threading.Lock()
+
+    def _new_child(self):
+        return CounterValue()
+
+    def labels(self, *values):
+        """按标签值获取子指标，只有第一次出现时加锁创建"""
+        key = tuple(str(v) for v in values)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self._new_child())
+        return child
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, self.kind, self.help_text)
+        for key, child in list(self.children.items()):
+            family.add(dict(zip(self.labelnames, key)), child.value)
+        return family
+
+class Histogram(Counter):
+    """带标签的直方图"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = buckets
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, self.kind, self.help_text)
+        for key, child in list(self.children.items()):
+            family.add_histogram(dict(zip(self.labelnames, key)), child)
+        return family
+
+class MetricsRegistry:
+    """指标注册表
+
+    register() 登记热路径上更新的 Counter/Histogram；
+    add_collector() 登记收集函数，抓取时调用，返回 MetricFamily 列表。
+    """
+
+    def __init__(self):
+        self.metrics: List[Counter] = []
+        self.collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+        self.scrapes = 0
+        self.last_scrape_ms = 0.0
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[MetricFamily]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """生成 Prometheus 文本格式，单个收集函数出错时跳过并记录"""
+        start = time.perf_counter()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect().render())
+        for collector in self.collectors:
+            try:
+                for family in collector():
+                    if family.samples:
+                        lines.extend(family.render())
+            except Exception as e:
+                self.logger.error(f"收集指标失败: {e}")
+        self.scrapes += 1
+        self.last_scrape_ms = (time.perf_counter() - start) * 1000
+        return '\n'.join(lines) + '\n'
+
+    def get_status(self) -> dict:
+        """获取导出状态"""
+        return {
+            'metrics': len(self.metrics),
+            'collectors': len(self.collectors),
+            'scrapes': self.scrapes,
+            'last_scrape_ms': round(self.last_scrape_ms, 2)
+        }
+
+def _format_labels(labels: Dict[str, object]) -> str:
+    if not labels:
+        return ''
+    items = []
+    for key, value in labels.items():
+        text = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        items.append(f'{key}="{text}"')
+    return '{' + ','.join(items) + '}'
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+指标历史模块 - 固定内存的多分辨率时间序列
+
+每个分辨率一组预分配的 NumPy 环形缓冲区，每个时间槽保存该时段内样本的最小值、最大值和平均值。
+每个原始样本同时累加到所有分辨率的当前时间槽，时间槽结束时写入环形缓冲区（自动降采样），
+缓冲区写满后覆盖最旧的数据，内存占用与运行时长无关。
+
+退出时保存为 .npz 二进制文件，启动时加载，序列和分辨率配置不一致时丢弃旧文件。
+"""
+
+import os
+import time
+import threading
+import logging
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 默认分辨率：(时间槽秒数, 槽数) - 1秒 x 10分钟, 10秒 x 24小时, 1分钟 x 7天
+DEFAULT_TIERS = ((1, 600), (10, 8640), (60, 10080))
+
+class MetricsTier:
+    """一个分辨率的环形缓冲区"""
+
+    def __init__(self, resolution: int, capacity: int, series_count: int):
+        self.resolution = resolution
+        self.capacity = capacity
+        # 时间槽起始时间 (0 表示空槽)
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.min = np.full((series_count, capacity), np.nan, dtype=np.float32)
+        self.max = np.full((series_count, capacity), np.nan, dtype=np.float32)
+        self.avg = np.full((series_count, capacity), np.nan, dtype=np.float32)
+        self.head = 0
+
+        # 当前时间槽的累加值
+        self.slot = None
+        self.acc_min = np.full(series_count, np.nan)
+        self.acc_max = np.full(series_count, np.nan)
+        self.acc_sum = np.zeros(series_count)
+        self.acc_count = np.zeros(series_count)
+
+    def add(self, timestamp: float, values: np.ndarray):
+        """累加一个样本，进入新的时间槽时先写入上一个时间槽（values 中 NaN 表示缺失）"""
+        slot = int(timestamp // self.resolution)
+        if slot != self.slot:
+            self.flush()
+            self.slot = slot
+        valid = ~np.isnan(values)
+        self.acc_min[valid] = np.fmin(self.acc_min[valid], values[valid])
+        self.acc_max[valid] = np.fmax(self.acc_max[valid], values[valid])
+        self.acc_sum[valid] += values[valid]
+        self.acc_count[valid] += 1
+
+    def flush(self):
+        """把当前时间槽写入环形缓冲区"""
+        if self.slot is None or not self.acc_count.any():
+            return
+        index = self.head
+        self.times[index] = self.slot * self.resolution
+        self.min[:, index] = self.acc_min
+        self.max[:, index] = self.acc_max
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.avg[:, index] = np.where(self.acc_count > 0, self.acc_sum / self.acc_count, np.nan)
+        self.head = (index + 1) % self.capacity
+
+        self.acc_min.fill(np.nan)
+        self.acc_max.fill(np.nan)
+        self.acc_sum.fill(0)
+        self.acc_count.fill(0)
+
+    def query(self, since: float) -> np.ndarray:
+        """返回 since 之后的时间槽下标（按时间排序）"""
+        indices = np.nonzero(self.times >= max(since, 1.0))[0]
+        order = np.argsort(self.times[indices])
+        return indices[order]
+
+class MetricsHistory:
+    """指标历史类"""
+
+    def __init__(self, series: Sequence[str], tiers: Sequence[Tuple[int, int]] = DEFAULT_TIERS,
+                 path: Optional[str] = None):
+        self.series: List[str] = list(series)
+        self.index = {name: i for i, name in enumerate(self.series)}
+        self.tier_config = [tuple(tier) for tier in tiers]
+        self.tiers = [MetricsTier(res, cap, len(self.series)) for res, cap in self.tier_config]
+        self.path = path
+        self.lock = threading.Lock()
+        self.samples = 0
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def record(self, values: Dict[str, float], timestamp: Optional[float] = None):
+        """记录一个样本，values 中不属于已知序列的键被忽略"""
+        row = np.full(len(self.series), np.nan)
+        for name, value in values.items():
+            i = self.index.get(name)
+            if i is not None and value is not None:
+                row[i] = value
+        timestamp = timestamp or time.time()
+        with self.lock:
+            for tier in self.tiers:
+                tier.add(timestamp, row)
+            self.samples += 1
+
+    def get_history(self, names: Optional[List[str]] = None, seconds: float = 600.0) -> dict:
+        """获取最近 seconds 秒的历史，自动选择能覆盖该范围的最细分辨率"""
+        names = [name for name in (names or self.series) if name in self.index]
+        seconds = max(1.0, seconds)
+        with self.lock:
+            tier = next((t for t in self.tiers if t.resolution * t.capacity >= seconds),
+                        self.tiers[-1])
+            indices = tier.query(time.time() - seconds)
+            result = {
+                'resolution': tier.resolution,
+                'times': tier.times[indices].tolist(),
+                'series': {}
+            }
+            for name in names:
+                i = self.index[name]
+                result['series'][name] = {
+                    stat: _to_list(getattr(tier, stat)[i, indices])
+                    for stat in ('min', 'max', 'avg')
+                }
+        return result
+
+    def save(self) -> bool:
+        """保存到二进制文件（先写临时文件再替换）"""
+        if not self.path:
+            return False
+        try:
+            with self.lock:
+                for tier in self.tiers:
+                    tier.flush()
+                arrays = {
+                    'series': np.array(self.series),
+                    'tiers': np.array(self.tier_config, dtype=np.int64)
+                }
+                for n, tier in enumerate(self.tiers):
+                    arrays[f'times_{n}'] = tier.times
+                    arrays[f'min_{n}'] = tier.min
+                    arrays[f'max_{n}'] = tier.max
+                    arrays[f'avg_{n}'] = tier.avg
+                    arrays[f'head_{n}'] = np.array(tier.head)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, self.path)
+            self.logger.info(f"指标历史已保存: {self.path}")
+            return True
+        except Exception as e:
+            self.logger.error(f"保存指标历史失败: {e}")
+            return False
+
+    def load(self) -> bool:
+        """从二进制文件加载，序列或分辨率配置变化时放弃加载"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path) as data:
+                if (data['series'].tolist() != self.series
+                        or [tuple(t) for t in data['tiers'].tolist()] != self.tier_config):
+                    self.logger.warning("指标历史文件的配置与当前不一致，已忽略")
+                    return False
+                with self.lock:
+                    for n, tier in enumerate(self.tiers):
+                        tier.times[:] = data[f'times_{n}']
+                        tier.min[:] = data[f'min_{n}']
+                        tier.max[:] = data[f'max_{n}']
+                        tier.avg[:] = data[f'avg_{n}']
+                        tier.head = int(data[f'head_{n}'])
+            self.logger.info(f"指标历史已加载: {self.path}")
+            return True
+        except Exception as e:
+            self.logger.error(f"加载指标历史失败: {e}")
+            return False
+
+    def get_status(self) -> dict:
+        """获取指标历史状态"""
+        return {
+            'series': self.series,
+            'tiers': [{'resolution': res, 'capacity': cap} for res, cap in self.tier_config],
+            'samples': self.samples,
+            'memory_bytes': sum(t.times.nbytes + t.min.nbytes + t.max.nbytes + t.avg.nbytes
+                                for t in self.tiers),
+            'path': self.path
+        }
+
+def _to_list(values: np.ndarray) -> list:
+    """NaN 转为 None，保留两位小数"""
+    return [None if np.isnan(v) else round(float(v), 2) for v in values]
+
+def parse_range(text: str, default: float = 600.0) -> float:
+    """解析时间范围，如 600、90s、10m、24h、7d"""
+    text = (text or '').strip().lower()
+    if not text:
+        return default
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运动控制协议模块 - 旧版单字节命令和带校验的帧协议
+
+legacy  每条命令一个字节 F/B/L/R/S（原有协议，下位机无需修改）
+framed  版本化的二进制帧，携带速度、转向和序号:
+
+    同步字 0xAA | 版本 | 序号 | 类型 | 负载长度 | 负载 | 校验
+
+    类型 0x01 SET  负载为若干 (执行器编号 uint8, 值 int8)，一帧可更新多个执行器
+    类型 0x02 STOP 无负载，立即停车
+    校验为版本到负载末尾所有字节的异或
+
+速度和转向取值 -100 ~ 100，转向为正表示右转。
+"""
+
+import struct
+from functools import reduce
+from typing import Dict, List, Optional, Tuple
+
+SYNC = 0xAA
+PROTOCOL_VERSION = 1
+
+FRAME_SET = 0x01
+FRAME_STOP = 0x02
+
+ACTUATOR_SPEED = 0x01
+ACTUATOR_STEERING = 0x02
+
+# 同步字, 版本, 序号, 类型, 负载长度
+HEADER = struct.Struct('<BBBBB')
+ACTUATOR_UPDATE = struct.Struct('<Bb')
+MAX_PAYLOAD = 64
+
+LEGACY_STOP = 'S'
+
+# 旧版命令对应的 (速度, 转向)
+LEGACY_DRIVE = {
+    'F': (100, 0),
+    'B': (-100, 0),
+    'L': (0, -100),
+    'R': (0, 100),
+    'S': (0, 0)
+}
+
+def clamp(value: float, limit: int = 100) -> int:
+    """限制到 [-limit, limit] 并取整"""
+    return int(max(-limit, min(limit, round(value))))
+
+def checksum(data: bytes) -> int:
+    """异或校验"""
+    return reduce(lambda a, b: a ^ b, data, 0)
+
+def drive_values(speed: float, steering: float) -> Dict[int, int]:
+    """速度和转向转换为执行器更新"""
+    return {ACTUATOR_SPEED: clamp(speed), ACTUATOR_STEERING: clamp(steering)}
+
+def legacy_to_values(command: str) -> Dict[int, int]:
+    """旧版命令转换为执行器更新"""
+    speed, steering = LEGACY_DRIVE.get(command, (0, 0))
+    return drive_values(speed, steering)
+
+def values_to_legacy(values: Dict[int, int]) -> str:
+    """执行器更新转换为最接近的旧版命令"""
+    speed = values.get(ACTUATOR_SPEED, 0)
+    steering = values.get(ACTUATOR_STEERING, 0)
+    if speed == 0 and steering == 0:
+        return 'S'
+    if abs(steering) > abs(speed):
+        return 'R' if steering > 0 else 'L'
+    return 'F' if speed > 0 else 'B'
+
+class LegacyProtocol:
+    """旧版单字节协议，执行器更新按最接近的命令发送"""
+
+    name = 'legacy'
+
+    def encode(self, item) -> bytes:
+        if item.values is not None:
+            return values_to_legacy(item.values).encode()
+        return item.command.encode()
+
+class FramedProtocol:
+    """帧协议编码器，序号按帧递增（8位回绕）"""
+
+    name = 'framed'
+
+    def __init__(self):
+        self.seq = 0
+
+    def encode(self, item) -> bytes:
+        """编码一条命令，并把帧序号记录到命令上"""
+        self.seq = (self.seq + 1) & 0xFF
+        item.seq = self.seq
+
+        if item.command == LEGACY_STOP:
+            frame_type = FRAME_STOP
+            payload = b''
+        else:
+            frame_type = FRAME_SET
+            values = item.values if item.values is not None else legacy_to_values(item.command)
+            payload = b''.join(ACTUATOR_UPDATE.pack(actuator, clamp(value, 127))
+                               for actuator, value in sorted(values.items()))
+
+        frame = HEADER.pack(SYNC, PROTOCOL_VERSION, self.seq, frame_type, len(payload)) + payload
+        return frame + bytes((checksum(frame[1:]),))
+
+class FrameParser:
+    """帧协议解析器（下位机一侧，供模拟器使用）
+
+    支持半帧拼接；同步字、版本、长度或校验不对时丢弃一个字节后重新寻找同步字。
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.bad_frames = 0
+
+    def feed(self, data: bytes) -> List[Tuple[int, int, Optional[Dict[int, int]]]]:
+        """输入字节流，返回解析出的 (序号, 类型, 执行器更新) 列表"""
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(bytes((SYNC,)))
+            if start < 0:
+                self.buffer.clear()
+                break
+            if start:
+                del self.buffer[:start]
+            if len(self.buffer) < HEADER.size:
+                break
+
+            _, version, seq, frame_type, length = HEADER.unpack_from(self.buffer)
+            if version != PROTOCOL_VERSION or length > MAX_PAYLOAD or length % ACTUATOR_UPDATE.size:
+                self.bad_frames += 1
+                del self.buffer[:1]
+                continue
+            end = HEADER.size + length
+            if len(self.buffer) < end + 1:
+                break
+            if checksum(self.buffer[1:end]) != self.buffer[end]:
+                self.bad_frames += 1
+                del self.buffer[:1]
+                continue
+
+            values = None
+            if frame_type == FRAME_SET:
+                values = dict(ACTUATOR_UPDATE.iter_unpack(bytes(self.buffer[HEADER.size:end])))
+            frames.append((seq, frame_type, values))
+            del self.buffer[:end + 1]
+        return frames
+
+def create_protocol(name: str):
+    """按名称创建协议编码器"""
+    if name == 'framed':
+        return FramedProtocol()
+    return LegacyProtocol()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+拍照模块 - 在后台线程中完成高质量JPEG编码和写盘
+"""
+
+import os
+import cv2
+import time
+import uuid
+import queue
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Callable
+
+class PhotoWorker:
+    """后台拍照写盘类
+
+    请求线程只负责把帧放入队列并立即返回任务编号，
+    编码 (质量95) 和文件写入在工作线程中完成。
+    """
+
+    def __init__(self, photos_dir: str, jpeg_quality: int = 95,
+                 max_pending: int = 32, max_history: int = 200):
+        self.photos_dir = photos_dir
+        self.jpeg_quality = jpeg_quality
+        self.max_history = max_history
+
+        self.job_queue = queue.Queue(maxsize=max_pending)
+        self.is_running = False
+        self.worker_thread = None
+
+        # 任务状态，按提交顺序保留最近的记录
+        self.jobs: Dict[str, dict] = OrderedDict()
+        self.jobs_lock = threading.Lock()
+        # 文件名序号，同一毫秒内提交的多张照片（如连拍取到同一帧）不会重名
+        self.sequence = 0
+
+        # 统计信息
+        self.photos_saved = 0
+        self.photos_failed = 0
+        self.photos_rejected = 0
+
+        # 编码参数只构建一次
+        self.encode_param = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """启动写盘线程"""
+        if self.is_running:
+            return
+
+        os.makedirs(self.photos_dir, exist_ok=True)
+        self.is_running = True
+        self.worker_thread = threading.Thread(target=self._worker_loop)
+        self.worker_thread.daemon = True
+        self.worker_thread.start()
+        self.logger.info(f"拍照写盘线程已启动: {self.photos_dir}")
+
+    def stop(self):
+        """停止写盘线程，等待已排队的照片写完"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        self.job_queue.put(None)
+        if self.worker_thread and self.worker_thread.is_alive():
+            self.worker_thread.join(timeout=10)
+        self.logger.info("拍照写盘线程已停止")
+
+    def submit(self, frame, frame_time: float, prefix: str = 'photo',
+               on_done: Optional[Callable[[dict], None]] = None) -> Optional[dict]:
+        """提交一帧待保存，队列已满时返回 None
+
+        frame 必须是调用方独占的数组，写盘完成前不能被修改。
+        on_done 在写盘线程中以任务信息为参数调用。
+        """
+        with self.jobs_lock:
+            self.sequence += 1
+            sequence = self.sequence
+        ms = int((frame_time % 1) * 1000)
+        filename = f"{prefix}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(frame_time))}" \
+                   f"_{ms:03d}_{sequence:04d}.jpg"
+        job = {
+            'job_id': uuid.uuid4().hex[:12],
+            'filename': filename,
+            'path': os.path.join(self.photos_dir, filename),
+            'frame_time': frame_time,
+            'status': 'pending',
+            'submitted': time.time()
+        }
+
+        try:
+            self.job_queue.put_nowait((job, frame, on_done))
+        except queue.Full:
+            self.photos_rejected += 1
+            self.logger.warning("拍照队列已满，丢弃本次拍照")
+            return None
+
+        with self.jobs_lock:
+            self.jobs[job['job_id']] = job
+            while len(self.jobs) > self.max_history:
+                self.jobs.popitem(last=False)
+        return dict(job)
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        """获取任务状态"""
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _worker_loop(self):
+        """写盘循环"""
+        # 降低写盘线程的调度优先级，避免与视频采集线程争抢CPU
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+
+        while True:
+            item = self.job_queue.get()
+            if item is None:
+                break
+            job, frame, on_done = item
+            try:
+                if cv2.imwrite(job['path'], frame, self.encode_param):
+                    job['status'] = 'done'
+                    self.photos_saved += 1
+                    self.logger.info(f"照片已保存: {job['path']}")
+                else:
+                    job['status'] = 'failed'
+                    job['error'] = '写入失败'
+                    self.photos_failed += 1
+                    self.logger.error(f"照片保存失败: {job['path']}")
+            except Exception as e:
+                job['status'] = 'failed'
+                job['error'] = str(e)
+                self.photos_failed += 1
+                self.logger.error(f"拍照错误: {e}")
+            job['completed'] = time.time()
+
+            if on_done:
+                try:
+                    on_done(job)
+                except Exception as e:
+                    self.logger.error(f"拍照完成回调错误: {e}")
+
+    def get_status(self) -> dict:
+        """获取写盘状态"""
+        return {
+            'running': self.is_running,
+            'pending': self.job_queue.qsize(),
+            'saved': self.photos_saved,
+            'failed': self.photos_failed,
+            'rejected': self.photos_rejected
+        }
+
+
+class CaptureSession:
+    """连拍/定时拍摄任务 - 按截止时间节拍从帧源取帧，提交给写盘线程
+
+    写盘跟不上时队列满，多出的帧直接丢弃并计数，不阻塞取帧节拍。
+    """
+
+    def __init__(self, worker: PhotoWorker, frame_source: Callable, mode: str,
+                 interval: float, count: int = 0, prefix: str = ''):
+        self.session_id = uuid.uuid4().hex[:12]
+        self.worker = worker
+        # frame_source 返回 (帧副本, 拍摄时间)
+        self.frame_source = frame_source
+        self.mode = mode
+        self.interval = interval
+        # count 为 0 表示不限数量，直到手动停止
+        self.count = count
+        # 文件名前缀，多车时用于区分小车
+        self.prefix = prefix
+
+        self.is_running = False
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.started = 0.0
+        self.finished = 0.0
+
+        # 统计信息
+        self.lock = threading.Lock()
+        self.captured = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.saved = 0
+        self.failed = 0
+        self.last_filename = ''
+
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """启动拍摄线程"""
+        self.is_running = True
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.logger.info(f"{self.mode} 拍摄开始: 间隔 {self.interval:.3f}s, "
+                         f"数量 {self.count or '不限'}")
+
+    def stop(self):
+        """停止拍摄"""
+        self.is_running = False
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+
+    def _run(self):
+        """拍摄循环"""
+        prefix = self.prefix + ('burst' if self.mode == 'burst' else 'timelapse')
+        last_frame_time = 0.0
+        next_deadline = time.monotonic()
+        taken = 0
+
+        while self.is_running and (self.count == 0 or taken < self.count):
+            try:
+                frame, frame_time = self.frame_source()
+                if frame is None:
+                    self.logger.warning(f"{self.mode} 拍摄取帧失败")
+                elif frame_time == last_frame_time:
+                    # 摄像头还没有产生新帧
+                    self.duplicates += 1
+                else:
+                    last_frame_time = frame_time
+                    taken += 1
+                    job = self.worker.submit(frame, frame_time, prefix=prefix,
+                                             on_done=self._on_job_done)
+                    with self.lock:
+                        if job is None:
+                            self.dropped += 1
+                        else:
+                            self.captured += 1
+                            self.last_filename = job['filename']
+            except Exception as e:
+                self.logger.error(f"{self.mode} 拍摄错误: {e}")
+
+            # 定时拍摄间隔可能很长，用事件等待以便随时停止
+            next_deadline += self.interval
+            delay = next_deadline - time.monotonic()
+            if delay > 0:
+                self.stop_event.wait(delay)
+            else:
+                next_deadline = time.monotonic()
+
+        self.is_running = False
+        self.finished = time.time()
+        self.logger.info(f"{self.mode} 拍摄结束: 提交 {self.captured} 张, 丢弃 {self.dropped} 张")
+
+    def _on_job_done(self, job: dict):
+        """写盘完成回调"""
+        with self.lock:
+            if job['status'] == 'done':
+                self.saved += 1
+            else:
+                self.failed += 1
+
+    def get_status(self) -> dict:
+        """获取拍摄任务状态"""
+        with self.lock:
+            return {
+                'session_id': self.session_id,
+                'mode': self.mode,
+                'running': self.is_running,
+                'interval': self.interval,
+                'count': self.count,
+                'captured': self.captured,
+                'dropped': self.dropped,
+                'duplicates': self.duplicates,
+                'saved': self.saved,
+                'failed': self.failed,
+                'pending': self.captured - self.saved - self.failed,
+                'last_filename': self.last_filename,
+                'started': self.started,
+                'finished': self.finished
+            }
+
+
+class CaptureSessionManager:
+    """连拍和定时拍摄管理类 - 同一时间最多一个定时拍摄任务"""
+
+    def __init__(self, worker: PhotoWorker, frame_source: Callable,
+                 min_interval: float = 0.03, max_burst: int = 100, max_history: int = 20,
+                 prefix: str = ''):
+        self.worker = worker
+        self.frame_source = frame_source
+        self.prefix = prefix
+        self.min_interval = min_interval
+        self.max_burst = max_burst
+        self.max_history = max_history
+
+        self.sessions: Dict[str, CaptureSession] = OrderedDict()
+        self.timelapse: Optional[CaptureSession] = None
+        self.lock = threading.Lock()
+
+    def _add_session(self, session: CaptureSession):
+        with self.lock:
+            self.sessions[session.session_id] = session
+            # 只清理已结束的旧任务
+            for session_id in list(self.sessions):
+                if len(self.sessions) <= self.max_history:
+                    break
+                if not self.sessions[session_id].is_running:
+                    del self.sessions[session_id]
+        session.start()
+
+    def start_burst(self, count: int, interval: float) -> CaptureSession:
+        """开始连拍"""
+        count = max(1, min(int(count), self.max_burst))
+        session = CaptureSession(self.worker, self.frame_source, 'burst',
+                                 max(self.min_interval, interval), count, self.prefix)
+        self._add_session(session)
+        return session
+
+    def start_timelapse(self, interval: float, count: int = 0) -> CaptureSession:
+        """开始定时拍摄，已有定时任务时先停止"""
+        self.stop_timelapse()
+        session = CaptureSession(self.worker, self.frame_source, 'timelapse',
+                                 max(self.min_interval, interval), max(0, int(count)),
+                                 self.prefix)
+        self.timelapse = session
+        self._add_session(session)
+        return session
+
+    def stop_timelapse(self) -> Optional[CaptureSession]:
+        """停止定时拍摄"""
+        session = self.timelapse
+        if session:
+            session.stop()
+            self.timelapse = None
+        return session
+
+    def get_session(self, session_id: str) -> Optional[CaptureSession]:
+        """按编号获取拍摄任务"""
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def stop_all(self):
+        """停止所有拍摄任务"""
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.stop()
+        self.timelapse = None
+
+    def get_status(self) -> dict:
+        """获取管理器状态"""
+        with self.lock:
+            active = [s.session_id for s in self.sessions.values() if s.is_running]
+        return {
+            'active_sessions': active,
+            'timelapse': self.timelapse.get_status() if self.timelapse else None
+        }
@@ -6,37 +6,139 @@
 
 import serial
 import time
+import random
 import threading
 import logging
-from typing import Optional, Callable
+from typing import Optional, Callable, Dict, List
+
+from motion_protocol import create_protocol, drive_values, values_to_legacy, \
+    legacy_to_values, LEGACY_STOP
+
+STOP_COMMAND = LEGACY_STOP
+
+class SerialCommand:
+    """一条待写入串口的命令，写入、被合并或失败后 done 被置位
+
+    values 为帧协议下的执行器更新，seq 为写入时分配的帧序号，
+    write_start 为开始 write() 的时间；on_done 在命令完成时以命令本身为参数调用。
+    """
+    
+    __slots__ = ('command', 'values', 'seq', 'enqueued', 'write_start', 'wire_time',
+                 'status', 'reason', 'done', 'on_done')
+    
+    def __init__(self, command: str, values: Optional[Dict[int, int]] = None,
+                 on_done: Optional[Callable] = None):
+        self.command = command
+        self.values = values
+        self.seq = 0
+        self.enqueued = time.time()
+        self.write_start = 0.0
+        self.wire_time = 0.0
+        self.status = 'queued'
+        self.reason = ''
+        self.done = threading.Event()
+        self.on_done = on_done
+    
+    def finish(self, status: str, wire_time: float = 0.0, reason: str = ''):
+        self.status = status
+        self.wire_time = wire_time
+        self.reason = reason
+        self.done.set()
+        if self.on_done:
+            try:
+                self.on_done(self)
+            except Exception as e:
+                logging.getLogger(__name__).error(f"命令完成回调错误: {e}")
+    
+    def wait(self, timeout: float) -> bool:
+        """等待命令写入串口，超时返回 False"""
+        return self.done.wait(timeout)
 
 class SerialHandler:
-    """简化的串口处理类"""
+    """串口处理类
+
+    写串口和读串口各有一个线程；连接丢失后由监督线程按带抖动的指数退避自动重连，
+    退避从 reconnect_initial 开始翻倍，上限为 reconnect_interval。
+    连续失败超过 max_retries 次后不再放弃，而是以上限间隔继续重试。
+    断线期间运动命令直接拒绝并给出原因，停止命令保留到重连后写入。
+    """
     
     def __init__(self, port: str = '/dev/ttyS0', baudrate: int = 9600, 
-                 timeout: int = 1, max_retries: int = 3):
+                 timeout: int = 1, max_retries: int = 3,
+                 reconnect_interval: float = 2.0, reconnect_initial: float = 0.05,
+                 auto_reconnect: bool = True, protocol: str = 'legacy'):
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
         self.max_retries = max_retries
+        self.reconnect_interval = reconnect_interval
+        self.reconnect_initial = reconnect_initial
+        self.auto_reconnect = auto_reconnect
+        # 运动命令编码: legacy 单字节命令 / framed 带速度转向的帧协议
+        self.protocol = create_protocol(protocol)
         
         self.serial_conn: Optional[serial.Serial] = None
         self.is_connected = False
         self.retry_count = 0
+        self.last_write_time = 0.0
         
         # 线程锁
         self.lock = threading.Lock()
         
-        # 状态回调
+        # 写串口线程和合并队列：运动命令只保留最新一条，停止命令优先写入
+        self.queue_cond = threading.Condition()
+        self.pending_stop: Optional[SerialCommand] = None
+        self.pending_motion: Optional[SerialCommand] = None
+        self.writer_running = False
+        self.writer_thread = None
+        
+        # 读串口线程，每个连接一个，收到的数据交给 on_receive 回调
+        self.reader_running = False
+        self.reader_thread = None
+        self.bytes_received = 0
+        
+        # 自动重连监督线程
+        self.connection_lost = threading.Event()
+        self.closing = threading.Event()
+        self.supervisor_thread = None
+        self.lost_time = 0.0
+        
+        # 写入统计
+        self.commands_queued = 0
+        self.commands_sent = 0
+        self.commands_coalesced = 0
+        self.commands_failed = 0
+        self.commands_rejected = 0
+        self.writes = 0
+        self.batched_writes = 0
+        self.bytes_written = 0
+        self.last_wire_delay = 0.0
+        self.avg_wire_delay = 0.0
+        self.max_wire_delay = 0.0
+        
+        # 重连统计
+        self.disconnect_count = 0
+        self.reconnect_attempts = 0
+        self.reconnect_successes = 0
+        self.last_disconnect_reason = ''
+        self.last_reconnect_latency = 0.0
+        self.max_reconnect_latency = 0.0
+        
+        # 状态回调，连接和断开成对调用
         self.on_connected: Optional[Callable] = None
         self.on_disconnected: Optional[Callable] = None
+        self.on_receive: Optional[Callable[[bytes], None]] = None
+        self.notified_connected = False
         
         # 日志设置
         self.logger = logging.getLogger(__name__)
         
     def connect(self) -> bool:
-        """连接串口"""
+        """连接串口（已连接时重新打开）"""
+        self.closing.clear()
         with self.lock:
+            # 重新打开失败时需要补发断开回调
+            was_connected = self.is_connected
             try:
                 if self.serial_conn and self.serial_conn.is_open:
                     self.serial_conn.close()
@@ -52,10 +154,9 @@ class SerialHandler:
                 
                 self.logger.info(f"串口连接成功: {self.port}")
                 
-                if self.on_connected:
-                    self.on_connected()
-                    
-                return True
+                self._start_writer()
+                self._start_reader(self.serial_conn)
+                connected = True
                 
             except Exception as e:
                 self.logger.error(f"串口连接失败: {e}")
@@ -66,10 +167,32 @@ class SerialHandler:
                     except:
                         pass
                     self.serial_conn = None
-                return False
+                connected = False
+        
+        if connected:
+            self.connection_lost.clear()
+            # 断线期间保留的停止命令在重连后立即写入
+            with self.queue_cond:
+                self.queue_cond.notify_all()
+            self._notify_connected()
+        else:
+            if was_connected:
+                self._fail_pending_motion('serial_disconnected')
+                self._notify_disconnected()
+            self._mark_lost('connect_failed')
+        return connected
     
     def disconnect(self):
-        """断开连接"""
+        """断开连接，不再自动重连"""
+        self.closing.set()
+        self.connection_lost.set()
+        if (self.supervisor_thread and self.supervisor_thread.is_alive()
+                and self.supervisor_thread is not threading.current_thread()):
+            self.supervisor_thread.join(timeout=2)
+        self.supervisor_thread = None
+        
+        self._stop_writer()
+        
         with self.lock:
             if self.serial_conn and self.serial_conn.is_open:
                 try:
@@ -78,44 +201,343 @@ class SerialHandler:
                     pass
             self.serial_conn = None
             self.is_connected = False
+        
+        self._stop_reader()
+        self._notify_disconnected()
             
+        self.logger.info("串口已断开")
+    
+    def _notify_connected(self):
+        """调用连接回调（与断开回调成对）"""
+        if self.notified_connected:
+            return
+        self.notified_connected = True
+        if self.on_connected:
+            try:
+                self.on_connected()
+            except Exception as e:
+                self.logger.error(f"串口连接回调错误: {e}")
+    
+    def _notify_disconnected(self):
+        """调用断开回调（与连接回调成对）"""
+        if not self.notified_connected:
+            return
+        self.notified_connected = False
         if self.on_disconnected:
-            self.on_disconnected()
+            try:
+                self.on_disconnected()
+            except Exception as e:
+                self.logger.error(f"串口断开回调错误: {e}")
+    
+    def _handle_connection_lost(self, conn, reason: str):
+        """读写线程发现串口异常时调用：关闭串口并交给监督线程重连"""
+        with self.lock:
+            # 只处理当前连接，旧连接的线程退出时不影响新连接
+            if conn is not self.serial_conn or not self.is_connected:
+                return
+            self.is_connected = False
+            try:
+                conn.close()
+            except:
+                pass
+            self.serial_conn = None
+            self.disconnect_count += 1
+        
+        self.logger.warning(f"串口连接丢失: {reason}")
+        
+        self._fail_pending_motion('serial_disconnected')
+        self._notify_disconnected()
+        self._mark_lost(reason)
+    
+    def _fail_pending_motion(self, reason: str):
+        """运动命令已过时，断线期间不保留；停止命令留到重连后写入"""
+        with self.queue_cond:
+            if self.pending_motion:
+                self.pending_motion.finish('failed', reason=reason)
+                self.pending_motion = None
+                self.commands_failed += 1
+    
+    def _mark_lost(self, reason: str):
+        """记录断线并唤醒监督线程"""
+        if self.closing.is_set() or not self.auto_reconnect:
+            return
+        if not self.connection_lost.is_set():
+            self.lost_time = time.monotonic()
+            self.last_disconnect_reason = reason
+            self.connection_lost.set()
+        self._start_supervisor()
+    
+    def _start_supervisor(self):
+        """启动自动重连监督线程"""
+        if self.supervisor_thread and self.supervisor_thread.is_alive():
+            return
+        self.supervisor_thread = threading.Thread(target=self._supervisor_loop)
+        self.supervisor_thread.daemon = True
+        self.supervisor_thread.start()
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """第 attempt 次重试前的等待时间：指数增长，取上限后在 [一半, 全部] 之间随机"""
+        delay = min(self.reconnect_interval, self.reconnect_initial * (2 ** min(attempt, 16)))
+        return delay / 2 + random.uniform(0, delay / 2)
+    
+    def _supervisor_loop(self):
+        """自动重连循环"""
+        while not self.closing.is_set():
+            if not self.connection_lost.wait(timeout=1.0):
+                continue
+            if self.closing.is_set():
+                break
+            if self.is_connected:
+                self.connection_lost.clear()
+                continue
             
-        self.logger.info("串口已断开")
+            if self.closing.wait(self._backoff_delay(self.retry_count)):
+                break
+            # 等待期间可能已被手动重连
+            if self.is_connected:
+                continue
+            
+            self.reconnect_attempts += 1
+            if self.connect():
+                latency = time.monotonic() - self.lost_time
+                self.reconnect_successes += 1
+                self.last_reconnect_latency = latency
+                self.max_reconnect_latency = max(self.max_reconnect_latency, latency)
+                self.logger.info(f"串口自动重连成功，耗时 {latency:.3f}s")
+            else:
+                self.retry_count += 1
+                if self.retry_count == self.max_retries:
+                    self.logger.error(f"串口重连已失败 {self.retry_count} 次，"
+                                      f"之后每 {self.reconnect_interval}s 重试一次")
     
-    def send_command(self, command: str) -> bool:
-        """发送命令"""
-        if not self.is_connected:
-            self.logger.warning("串口未连接，无法发送命令")
-            return False
+    def _start_writer(self):
+        """启动写串口线程"""
+        if self.writer_thread and self.writer_thread.is_alive():
+            return
+        self.writer_running = True
+        self.writer_thread = threading.Thread(target=self._writer_loop)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+    
+    def _stop_writer(self):
+        """停止写串口线程，丢弃未写入的命令"""
+        with self.queue_cond:
+            self.writer_running = False
+            for item in (self.pending_stop, self.pending_motion):
+                if item:
+                    item.finish('failed', reason='serial_closed')
+            self.pending_stop = None
+            self.pending_motion = None
+            self.queue_cond.notify_all()
+        if (self.writer_thread and self.writer_thread.is_alive()
+                and self.writer_thread is not threading.current_thread()):
+            self.writer_thread.join(timeout=2)
+        self.writer_thread = None
+    
+    def _start_reader(self, conn):
+        """为新连接启动读串口线程，旧连接的线程在串口关闭后自行退出"""
+        self.reader_running = True
+        self.reader_thread = threading.Thread(target=self._reader_loop, args=(conn,))
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+    
+    def _stop_reader(self):
+        """停止读串口线程（串口关闭后读操作会立即返回）"""
+        self.reader_running = False
+        if (self.reader_thread and self.reader_thread.is_alive()
+                and self.reader_thread is not threading.current_thread()):
+            self.reader_thread.join(timeout=2)
+        self.reader_thread = None
+    
+    def _reader_loop(self, conn):
+        """读串口循环：有多少读多少，没有数据时阻塞等待一个字节直到超时
+        
+        读操作不持有 self.lock，不会阻塞写线程。
+        """
+        while self.reader_running and conn is self.serial_conn:
+            try:
+                data = conn.read(conn.in_waiting or 1)
+            except Exception as e:
+                if self.reader_running:
+                    self._handle_connection_lost(conn, f"读取串口失败: {e}")
+                break
             
+            if data:
+                self.bytes_received += len(data)
+                if self.on_receive:
+                    try:
+                        self.on_receive(data)
+                    except Exception as e:
+                        self.logger.error(f"串口数据处理错误: {e}")
+    
+    def enqueue(self, command: str, values: Optional[Dict[int, int]] = None,
+                on_done: Optional[Callable] = None) -> SerialCommand:
+        """提交命令到写串口队列并立即返回
+        
+        停止命令插到队首，并使之前尚未写入的运动命令作废；
+        运动命令只保留最新一条，被替换的命令状态为 coalesced，
+        帧协议下被替换命令中未被覆盖的执行器更新会合并进新命令。
+        串口未连接时运动命令状态为 rejected，reason 说明原因；
+        正在自动重连时停止命令照常入队，重连后写入。
+        """
+        if self.protocol.name == 'framed' and command != STOP_COMMAND and values is None:
+            values = legacy_to_values(command)
+        item = SerialCommand(command, values, on_done)
+        
+        reconnecting = self.auto_reconnect and not self.closing.is_set()
+        if not self.is_connected and not (command == STOP_COMMAND and reconnecting):
+            reason = 'serial_reconnecting' if reconnecting else 'serial_disconnected'
+            self.logger.warning(f"串口未连接，无法发送命令: {command} ({reason})")
+            item.finish('rejected', reason=reason)
+            self.commands_rejected += 1
+            return item
+        
+        with self.queue_cond:
+            if command == STOP_COMMAND:
+                superseded = (self.pending_stop, self.pending_motion)
+                self.pending_stop = item
+                self.pending_motion = None
+            else:
+                superseded = (self.pending_motion,)
+                if self.pending_motion and self.pending_motion.values and item.values is not None:
+                    item.values = {**self.pending_motion.values, **item.values}
+                self.pending_motion = item
+            for old in superseded:
+                if old:
+                    old.finish('coalesced')
+                    self.commands_coalesced += 1
+            self.commands_queued += 1
+            self.queue_cond.notify()
+        return item
+    
+    def enqueue_drive(self, speed: float, steering: float,
+                      on_done: Optional[Callable] = None) -> SerialCommand:
+        """提交速度和转向 (-100 ~ 100)
+        
+        帧协议下原样发送；旧版协议下转换为最接近的单字节命令。速度和转向都为 0 时等同停止。
+        """
+        values = drive_values(speed, steering)
+        command = values_to_legacy(values)
+        if command == STOP_COMMAND or self.protocol.name != 'framed':
+            return self.enqueue(command, on_done=on_done)
+        return self.enqueue('D', values, on_done)
+    
+    def send_command(self, command: str) -> bool:
+        """发送命令（只入队，不等待串口写入）"""
+        return self.enqueue(command).status != 'rejected'
+    
+    def _writer_loop(self):
+        """写串口循环：停止命令在前、最新的运动命令在后，打包成一次写入；断线期间等待重连"""
+        while True:
+            with self.queue_cond:
+                self.queue_cond.wait_for(
+                    lambda: (self.is_connected and (self.pending_stop or self.pending_motion))
+                    or not self.writer_running,
+                    timeout=1.0
+                )
+                if not self.writer_running:
+                    break
+                if not self.is_connected:
+                    continue
+                items = [item for item in (self.pending_stop, self.pending_motion) if item]
+                self.pending_stop = None
+                self.pending_motion = None
+            if items:
+                self._write(items)
+    
+    def _write(self, items: List[SerialCommand]):
+        """把若干条命令编码后一次写入串口"""
+        error = None
         with self.lock:
+            conn = self.serial_conn
             try:
-                if self.serial_conn and self.serial_conn.is_open:
-                    data = command.encode()
-                    self.serial_conn.write(data)
-                    self.serial_conn.flush()
-                    self.logger.debug(f"已发送命令: {command}")
-                    return True
+                if conn and conn.is_open:
+                    data = b''.join(self.protocol.encode(item) for item in items)
+                    write_start = time.time()
+                    for item in items:
+                        item.write_start = write_start
+                    conn.write(data)
+                    conn.flush()
+                    wire_time = time.time()
+                    self.last_write_time = wire_time
+                    self.writes += 1
+                    self.bytes_written += len(data)
+                    if len(items) > 1:
+                        self.batched_writes += 1
+                    for item in items:
+                        item.finish('sent', wire_time)
+                        self._record_wire_delay(wire_time - item.enqueued)
+                    self.logger.debug(f"已发送命令: {[item.command for item in items]}")
+                    return
                 else:
-                    self.logger.warning("串口连接无效")
-                    self.is_connected = False
-                    return False
+                    error = "串口连接无效"
                     
             except Exception as e:
-                self.logger.error(f"发送命令失败: {e}")
-                self.is_connected = False
-                return False
+                error = f"发送命令失败: {e}"
+        
+        self.logger.error(error)
+        for item in items:
+            item.finish('failed', reason='serial_error')
+        self.commands_failed += len(items)
+        if conn:
+            self._handle_connection_lost(conn, error)
+    
+    def _record_wire_delay(self, delay: float):
+        """记录从入队到写入串口的耗时"""
+        self.commands_sent += 1
+        self.last_wire_delay = delay
+        self.max_wire_delay = max(self.max_wire_delay, delay)
+        if self.commands_sent == 1:
+            self.avg_wire_delay = delay
+        else:
+            self.avg_wire_delay = 0.9 * self.avg_wire_delay + 0.1 * delay
+    
+    @property
+    def queue_depth(self) -> int:
+        """尚未写入串口的命令数"""
+        return (self.pending_stop is not None) + (self.pending_motion is not None)
     
     def get_status(self) -> dict:
         """获取连接状态"""
+        if self.is_connected:
+            state = 'connected'
+        elif self.connection_lost.is_set() and not self.closing.is_set():
+            state = 'reconnecting'
+        else:
+            state = 'disconnected'
         return {
             'connected': self.is_connected,
+            'state': state,
             'port': self.port,
             'baudrate': self.baudrate,
+            'protocol': self.protocol.name,
             'retry_count': self.retry_count,
-            'max_retries': self.max_retries
+            'max_retries': self.max_retries,
+            'reconnect_interval': self.reconnect_interval,
+            'reconnect_attempts': self.reconnect_attempts,
+            'reconnect_successes': self.reconnect_successes,
+            'disconnect_count': self.disconnect_count,
+            'last_disconnect_reason': self.last_disconnect_reason,
+            'reconnect_latency_ms': {
+                'last': round(self.last_reconnect_latency * 1000, 1),
+                'max': round(self.max_reconnect_latency * 1000, 1)
+            },
+            'queue_depth': self.queue_depth,
+            'commands_queued': self.commands_queued,
+            'commands_sent': self.commands_sent,
+            'commands_coalesced': self.commands_coalesced,
+            'commands_failed': self.commands_failed,
+            'commands_rejected': self.commands_rejected,
+            'writes': self.writes,
+            'batched_writes': self.batched_writes,
+            'bytes_written': self.bytes_written,
+            'last_write_time': self.last_write_time,
+            'bytes_received': self.bytes_received,
+            'time_to_wire_ms': {
+                'last': round(self.last_wire_delay * 1000, 2),
+                'avg': round(self.avg_wire_delay * 1000, 2),
+                'max': round(self.max_wire_delay * 1000, 2)
+            }
         }
     
     def __enter__(self):
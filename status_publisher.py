@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+状态推送模块 - 一个线程生成状态，以 Server-Sent Events 分发给所有订阅者
+
+订阅者连接后先收到一次完整快照 (event: snapshot)，之后只在状态变化时收到增量
+(event: delta)。增量为 JSON Merge Patch (RFC 7386)：只包含变化的键，值为 null 表示删除。
+没有订阅者时不生成状态；订阅者落后太多、缺失的增量已被丢弃时改发一次快照。
+"""
+
+import json
+import time
+import threading
+import logging
+from collections import deque
+from typing import Callable, Dict, Iterator
+
+def merge_diff(old: Dict, new: Dict) -> Dict:
+    """计算从 old 到 new 的 JSON Merge Patch"""
+    diff = {}
+    for key, value in new.items():
+        if key not in old:
+            diff[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            sub = merge_diff(old[key], value)
+            if sub:
+                diff[key] = sub
+        elif old[key] != value:
+            diff[key] = value
+    for key in old:
+        if key not in new:
+            diff[key] = None
+    return diff
+
+class StatusPublisher:
+    """状态推送类
+
+    state_func 返回当前状态字典（只应包含变化时才需要推送的字段，不要放时间戳）。
+    发布线程每隔 interval 秒重新生成一次状态，notify() 可让它立即生成，
+    用于命令发送、串口断开等需要在毫秒级反映到页面的变化。
+    """
+
+    def __init__(self, state_func: Callable[[], Dict], interval: float = 0.5,
+                 history: int = 64, keepalive: float = 15.0):
+        self.state_func = state_func
+        self.interval = interval
+        self.keepalive = keepalive
+
+        self.condition = threading.Condition()
+        self.wakeup = threading.Event()
+        self.state: Dict = {}
+        self.version = 0
+        # 最近的 (版本, 增量)
+        self.deltas = deque(maxlen=history)
+        self.subscribers = 0
+        self.is_running = False
+        self.publish_thread = None
+
+        # 统计信息
+        self.snapshots_sent = 0
+        self.deltas_sent = 0
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """启动发布线程"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.publish_thread = threading.Thread(target=self._publish_loop)
+        self.publish_thread.daemon = True
+        self.publish_thread.start()
+        self.logger.info("状态推送已启动")
+
+    def stop(self):
+        """停止发布线程，唤醒所有订阅者使其退出"""
+        self.is_running = False
+        self.wakeup.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.publish_thread and self.publish_thread.is_alive():
+            self.publish_thread.join(timeout=2)
+        self.logger.info("状态推送已停止")
+
+    def notify(self):
+        """状态可能已变化，立即重新生成"""
+        self.wakeup.set()
+
+    def _publish_loop(self):
+        """发布循环：有订阅者时定时或被唤醒后生成状态，有变化则发布增量"""
+        while self.is_running:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if not self.is_running:
+                break
+            if not self.subscribers:
+                continue
+            try:
+                self._refresh()
+            except Exception as e:
+                self.logger.error(f"生成状态失败: {e}")
+
+    def _refresh(self):
+        """重新生成状态，变化时版本号加一并通知订阅者"""
+        state = self.state_func()
+        with self.condition:
+            delta = merge_diff(self.state, state)
+            if not delta:
+                return
+            self.state = state
+            self.version += 1
+            self.deltas.append((self.version, delta))
+            self.condition.notify_all()
+
+    def _event(self, name: str, version: int, data: Dict) -> str:
+        return f"event: {name}\nid: {version}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+    def events(self) -> Iterator[str]:
+        """订阅者的事件流（SSE 文本），由每个订阅者的请求线程迭代"""
+        with self.condition:
+            self.subscribers += 1
+        try:
+            # 第一个订阅者到来时状态可能还未生成
+            if not self.state:
+                self._refresh()
+            with self.condition:
+                version, state = self.version, self.state
+            self.snapshots_sent += 1
+            yield "retry: 2000\n\n"
+            yield self._event('snapshot', version, {**state, 'server_time': time.time()})
+
+            while self.is_running:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.version != version or not self.is_running,
+                                            timeout=self.keepalive)
+                    if not self.is_running:
+                        break
+                    if self.version == version:
+                        message = ": keepalive\n\n"
+                    elif self.deltas and self.deltas[0][0] <= version + 1:
+                        # 合并错过的增量，一次发送
+                        delta = {}
+                        for delta_version, change in self.deltas:
+                            if delta_version > version:
+                                delta = self._merge(delta, change)
+                        message = self._event('delta', self.version, delta)
+                        self.deltas_sent += 1
+                    else:
+                        message = self._event('snapshot', self.version,
+                                              {**self.state, 'server_time': time.time()})
+                        self.snapshots_sent += 1
+                    version = self.version
+                yield message
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+    @staticmethod
+    def _merge(target: Dict, patch: Dict) -> Dict:
+        """把两个连续的增量合并为一个"""
+        result = dict(target)
+        for key, value in patch.items():
+            if isinstance(value, dict) and isinstance(result.get(key), dict):
+                result[key] = StatusPublisher._merge(result[key], value)
+            else:
+                result[key] = value
+        return result
+
+    def get_status(self) -> dict:
+        """获取推送状态"""
+        return {
+            'running': self.is_running,
+            'subscribers': self.subscribers,
+            'version': self.version,
+            'interval': self.interval,
+            'snapshots_sent': self.snapshots_sent,
+            'deltas_sent': self.deltas_sent
+        }
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+遥测模块 - 解析下位机串口输出的遥测帧，按通道保存到固定大小的环形缓冲
+
+帧格式为一行文本，字段以逗号分隔，每个字段为 "通道:值"，例如:
+    bat:7.42,encl:1532,encr:1528
+    ack:F
+数值字段写入环形缓冲，非数值字段（如命令确认）只保留最新值。
+"""
+
+import time
+import threading
+import logging
+import numpy as np
+from typing import Optional, Dict, List
+
+class TelemetryBuffer:
+    """遥测解析和环形缓冲类
+
+    串口读线程把收到的字节块交给 feed()，按换行切帧，半帧留到下次拼接；
+    超长无换行的数据视为乱码丢弃，从下一个换行处重新同步。
+    每个通道有独立的数值和时间戳环形数组，首次出现时分配，之后不再分配。
+    """
+
+    def __init__(self, capacity: int = 2048, max_channels: int = 32, max_line: int = 256):
+        self.capacity = capacity
+        self.max_channels = max_channels
+        self.max_line = max_line
+
+        # 接收缓冲，只保存未完成的半帧
+        self.rx_buffer = bytearray()
+        # 丢弃乱码后，下一个换行之前的数据属于同一段乱码
+        self.resync = False
+
+        # 通道名(bytes) -> 环形缓冲
+        self.lock = threading.Lock()
+        self.channels: Dict[bytes, dict] = {}
+        self.texts: Dict[str, dict] = {}
+
+        # 统计信息
+        self.bytes_received = 0
+        self.frames_parsed = 0
+        self.bad_frames = 0
+        self.bytes_discarded = 0
+        self.last_frame_time = 0.0
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def feed(self, data: bytes, timestamp: Optional[float] = None):
+        """接收一块串口数据，解析其中所有完整的帧"""
+        if timestamp is None:
+            timestamp = time.time()
+        self.bytes_received += len(data)
+        buffer = self.rx_buffer
+        buffer += data
+
+        start = 0
+        while True:
+            end = buffer.find(b'\n', start)
+            if end < 0:
+                break
+            if self.resync:
+                self.resync = False
+                self.bytes_discarded += end - start
+            elif end - start <= self.max_line:
+                self._parse_line(bytes(buffer[start:end]), timestamp)
+            else:
+                self.bad_frames += 1
+                self.bytes_discarded += end - start
+            start = end + 1
+        del buffer[:start]
+
+        # 长时间收不到换行说明是乱码或波特率不匹配，丢弃后等待下一个换行重新同步
+        if len(buffer) > self.max_line:
+            self.bytes_discarded += len(buffer)
+            self.bad_frames += 1
+            self.resync = True
+            buffer.clear()
+
+    def _parse_line(self, line: bytes, timestamp: float):
+        """解析一行遥测帧，任一字段格式错误则整帧丢弃"""
+        line = line.strip()
+        if not line:
+            return
+
+        values = []
+        try:
+            for field in line.split(b','):
+                key, sep, value = field.partition(b':')
+                key = key.strip()
+                if not sep or not key:
+                    raise ValueError(field)
+                values.append((key, value.strip()))
+        except ValueError:
+            self.bad_frames += 1
+            return
+
+        with self.lock:
+            for key, value in values:
+                try:
+                    self._append(key, float(value), timestamp)
+                except ValueError:
+                    try:
+                        name = key.decode('ascii')
+                        self.texts[name] = {'value': value.decode('ascii'), 'time': timestamp}
+                    except UnicodeDecodeError:
+                        self.bad_frames += 1
+                        return
+        self.frames_parsed += 1
+        self.last_frame_time = timestamp
+
+    def _append(self, key: bytes, value: float, timestamp: float):
+        """追加一个数值到通道环形缓冲（需持有锁）"""
+        channel = self.channels.get(key)
+        if channel is None:
+            if len(self.channels) >= self.max_channels:
+                return
+            channel = {
+                'name': key.decode('ascii'),
+                'values': np.zeros(self.capacity, dtype=np.float64),
+                'times': np.zeros(self.capacity, dtype=np.float64),
+                'index': 0,
+                'count': 0
+            }
+            self.channels[key] = channel
+
+        index = channel['index']
+        channel['values'][index] = value
+        channel['times'][index] = timestamp
+        channel['index'] = (index + 1) % self.capacity
+        channel['count'] = min(channel['count'] + 1, self.capacity)
+
+    def get_latest(self) -> dict:
+        """获取各通道的最新值"""
+        latest = {}
+        with self.lock:
+            for channel in self.channels.values():
+                last = (channel['index'] - 1) % self.capacity
+                latest[channel['name']] = {
+                    'value': float(channel['values'][last]),
+                    'time': float(channel['times'][last])
+                }
+            for name, text in self.texts.items():
+                latest[name] = dict(text)
+        return latest
+
+    def get_history(self, names: Optional[List[str]] = None, seconds: float = 60.0) -> dict:
+        """获取最近 seconds 秒内的历史数据，按时间先后排列"""
+        since = time.time() - seconds
+        history = {}
+        with self.lock:
+            for channel in self.channels.values():
+                if names and channel['name'] not in names:
+                    continue
+                count = channel['count']
+                # 按写入顺序取出环形缓冲中的有效数据
+                order = (np.arange(channel['index'] - count, channel['index'])) % self.capacity
+                times = channel['times'][order]
+                mask = times >= since
+                history[channel['name']] = {
+                    'times': times[mask].tolist(),
+                    'values': channel['values'][order][mask].tolist()
+                }
+        return history
+
+    def get_status(self) -> dict:
+        """获取解析统计"""
+        return {
+            'channels': [channel['name'] for channel in self.channels.values()],
+            'capacity': self.capacity,
+            'bytes_received': self.bytes_received,
+            'frames_parsed': self.frames_parsed,
+            'bad_frames': self.bad_frames,
+            'bytes_discarded': self.bytes_discarded,
+            'last_frame_time': self.last_frame_time
+        }
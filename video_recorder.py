@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+录像模块 - 复用视频流已编码的JPEG帧，按固定时长分段写入 MJPEG-AVI 文件
+"""
+
+import os
+import time
+import struct
+import threading
+import logging
+from collections import deque
+from typing import Optional, List
+
+class AviMjpegWriter:
+    """MJPEG-AVI 写入器 - 直接写入已编码的JPEG数据，不重新编码
+
+    文件以固定帧率 fps 播放：按时间戳计算每帧应处的位置，输入有间隔时
+    （静止画面保活、采集变慢等）重复写入上一帧补齐，回放速度与实际时间一致。
+    """
+
+    def __init__(self, path: str, width: int, height: int, fps: float = 30.0):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.fps = fps
+
+        self.file = open(path, 'wb')
+        self.index: List[tuple] = []
+        self.movi_size = 4  # 'movi' 标识本身
+        self.first_time = 0.0
+        self.last_time = 0.0
+        self.last_frame = b''
+        self.frames_padded = 0
+
+        # 先写入占位文件头，关闭时回填
+        self.file.write(self._build_header(0, fps))
+
+    def _build_header(self, frame_count: int, fps: float) -> bytes:
+        """构建 AVI 文件头"""
+        # 以 1/1000 帧为单位表示帧率，避免浮点误差
+        scale = 1000
+        rate = max(1, int(round(fps * scale)))
+        usec_per_frame = int(1000000 / max(fps, 0.001))
+        max_frame = max((size for _, size in self.index), default=0)
+
+        avih = struct.pack('<14I', usec_per_frame, 0, 0, 0x10, frame_count, 0, 1,
+                           max_frame, self.width, self.height, 0, 0, 0, 0)
+        strh = struct.pack('<4s4sIHHIIIIIIII4h', b'vids', b'MJPG', 0, 0, 0, 0,
+                           scale, rate, 0, frame_count, max_frame, 0xFFFFFFFF, 0,
+                           0, 0, self.width, self.height)
+        strf = struct.pack('<IiiHH4sIiiII', 40, self.width, self.height, 1, 24, b'MJPG',
+                           self.width * self.height * 3, 0, 0, 0, 0)
+
+        strl = b'strl' + self._chunk(b'strh', strh) + self._chunk(b'strf', strf)
+        hdrl = b'hdrl' + self._chunk(b'avih', avih) + self._list(strl)
+        riff_size = 4 + 8 + len(hdrl) + 8 + self.movi_size + 8 + 16 * len(self.index)
+
+        return (b'RIFF' + struct.pack('<I', riff_size) + b'AVI ' + self._list(hdrl)
+                + b'LIST' + struct.pack('<I', self.movi_size) + b'movi')
+
+    @staticmethod
+    def _chunk(fourcc: bytes, data: bytes) -> bytes:
+        return fourcc + struct.pack('<I', len(data)) + data
+
+    @staticmethod
+    def _list(data: bytes) -> bytes:
+        return b'LIST' + struct.pack('<I', len(data)) + data
+
+    def write_frame(self, jpeg_bytes: bytes, timestamp: float) -> int:
+        """写入一帧JPEG，返回为补齐帧率重复写入的帧数"""
+        padded = 0
+        if self.first_time:
+            slot = int(round((timestamp - self.first_time) * self.fps))
+            while self.frame_count < slot:
+                self._write_chunk(self.last_frame)
+                padded += 1
+        else:
+            self.first_time = timestamp
+        self._write_chunk(jpeg_bytes)
+        self.last_frame = jpeg_bytes
+        self.last_time = timestamp
+        self.frames_padded += padded
+        return padded
+
+    def _write_chunk(self, jpeg_bytes: bytes):
+        size = len(jpeg_bytes)
+        # 索引中的偏移量相对于 'movi' 标识
+        self.index.append((self.movi_size, size))
+        self.file.write(b'00dc' + struct.pack('<I', size))
+        self.file.write(jpeg_bytes)
+        if size % 2:
+            self.file.write(b'\x00')
+        self.movi_size += 8 + size + (size % 2)
+
+    @property
+    def frame_count(self) -> int:
+        return len(self.index)
+
+    @property
+    def duration(self) -> float:
+        return self.last_time - self.first_time if self.first_time else 0.0
+
+    def close(self):
+        """写入索引并回填文件头"""
+        index_data = b''.join(struct.pack('<4sIII', b'00dc', 0x10, offset, size)
+                              for offset, size in self.index)
+        try:
+            self.file.write(self._chunk(b'idx1', index_data))
+        except OSError:
+            self.file.close()
+            raise
+
+        try:
+            self.file.seek(0)
+            self.file.write(self._build_header(self.frame_count, self.fps))
+        finally:
+            self.file.close()
+
+
+class SegmentRecorder:
+    """分段录像类
+
+    作为视频流档位的一个订阅者取用生产者已编码的帧，不会另开采集循环。
+    未录像时为被动订阅者，只在有其他观看者或拍照使采集运行时维护最近几秒的预录缓冲，
+    不会让摄像头在无人观看时继续采集；开始录像时转为普通订阅者并先写入预录缓冲中的帧。
+    按固定时长切分文件，目录总大小超限时从最旧的文件开始删除。
+    """
+
+    def __init__(self, broadcaster, output_dir: str, profile_name: Optional[str] = None,
+                 segment_seconds: float = 60.0, preroll_seconds: float = 5.0,
+                 max_total_mb: float = 1024.0):
+        self.broadcaster = broadcaster
+        self.output_dir = output_dir
+        self.profile = broadcaster.get_profile(profile_name)
+        self.segment_seconds = segment_seconds
+        self.preroll_seconds = preroll_seconds
+        self.max_total_bytes = int(max_total_mb * 1024 * 1024)
+
+        self.is_running = False
+        self.recorder_thread = None
+        self.client = None
+
+        # 录像状态
+        self.lock = threading.Lock()
+        self.recording = False
+        self.writer: Optional[AviMjpegWriter] = None
+        self.preroll = deque()
+        self.record_started = 0.0
+
+        # 统计信息
+        self.segments_written = 0
+        self.segments_evicted = 0
+        self.frames_written = 0
+        self.frames_padded = 0
+        self.write_errors = 0
+        self.last_segment = ''
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """启动录像线程（开始维护预录缓冲）"""
+        if self.is_running:
+            return
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.is_running = True
+        self.recorder_thread = threading.Thread(target=self._record_loop)
+        self.recorder_thread.daemon = True
+        self.recorder_thread.start()
+        self.logger.info(f"录像模块已启动: {self.output_dir} [{self.profile.name}]，"
+                         f"预录 {self.preroll_seconds}s，分段 {self.segment_seconds}s")
+
+    def stop(self):
+        """停止录像线程并关闭当前文件"""
+        self.is_running = False
+        if self.recorder_thread and self.recorder_thread.is_alive():
+            self.recorder_thread.join(timeout=3)
+        with self.lock:
+            self.recording = False
+            self._close_segment()
+        self.logger.info("录像模块已停止")
+
+    def start_recording(self) -> dict:
+        """开始录像，预录缓冲中的帧会写入第一个分段"""
+        with self.lock:
+            if not self.recording:
+                self.recording = True
+                self.record_started = time.time()
+                if self.client:
+                    self.broadcaster.set_passive(self.client, False)
+                self.logger.info("开始录像")
+        return self.get_status()
+
+    def stop_recording(self) -> dict:
+        """停止录像"""
+        with self.lock:
+            if self.recording:
+                self.recording = False
+                self._close_segment()
+                if self.client:
+                    self.broadcaster.set_passive(self.client, True)
+                self.logger.info("停止录像")
+        return self.get_status()
+
+    def _record_loop(self):
+        """录像循环：订阅档位的已编码帧
+
+        写入失败（磁盘满、分段被删除等）时关闭当前分段，下一帧写入新分段，不退出循环。
+        循环因其他原因退出时清除 is_running，之后的 start() 可以重新启动线程。
+        """
+        with self.lock:
+            client = self.client = self.broadcaster.add_client(
+                'recorder', self.profile.name, passive=not self.recording)
+        try:
+            while self.is_running and self.broadcaster.is_running:
+                frame_bytes = client.next_frame(timeout=1.0)
+                if frame_bytes is None:
+                    continue
+                timestamp = time.time()
+
+                with self.lock:
+                    if self.recording:
+                        try:
+                            self._write(frame_bytes, timestamp)
+                        except OSError as e:
+                            self.write_errors += 1
+                            self.logger.error(f"写入录像分段失败: {e}")
+                            self._close_segment()
+                    else:
+                        self.preroll.append((timestamp, frame_bytes))
+                        while self.preroll and timestamp - self.preroll[0][0] > self.preroll_seconds:
+                            self.preroll.popleft()
+                client.record_write(len(frame_bytes), 0.0)
+        except Exception as e:
+            self.logger.error(f"录像循环错误: {e}")
+        finally:
+            with self.lock:
+                self.client = None
+            self.broadcaster.remove_client(client)
+            self.is_running = False
+
+    def _write(self, frame_bytes: bytes, timestamp: float):
+        """写入一帧，必要时切换分段（需持有锁）"""
+        if self.writer and timestamp - self.writer.first_time >= self.segment_seconds:
+            self._close_segment()
+
+        if self.writer is None:
+            self._open_segment(timestamp)
+            # 先写入预录缓冲，采集曾经停止时缓冲中可能留有过旧的帧
+            while self.preroll:
+                ts, data = self.preroll.popleft()
+                if timestamp - ts > self.preroll_seconds:
+                    continue
+                self.frames_padded += self.writer.write_frame(data, ts)
+                self.frames_written += 1
+
+        self.frames_padded += self.writer.write_frame(frame_bytes, timestamp)
+        self.frames_written += 1
+
+    def _open_segment(self, timestamp: float):
+        """打开新的分段文件"""
+        ms = int((timestamp % 1) * 1000)
+        filename = f"segment_{time.strftime('%Y%m%d_%H%M%S', time.localtime(timestamp))}_{ms:03d}.avi"
+        path = os.path.join(self.output_dir, filename)
+        self.writer = AviMjpegWriter(path, self.profile.width, self.profile.height,
+                                     self.profile.fps)
+        self.last_segment = filename
+        self.logger.info(f"录像分段开始: {filename}")
+
+    def _close_segment(self):
+        """关闭当前分段并清理旧文件（需持有锁）"""
+        if self.writer is None:
+            return
+        try:
+            self.writer.close()
+            self.segments_written += 1
+            self.logger.info(f"录像分段已保存: {self.writer.path}，"
+                             f"{self.writer.frame_count} 帧，{self.writer.duration:.1f}s")
+        except Exception as e:
+            self.logger.error(f"关闭录像分段失败: {e}")
+        self.writer = None
+        self._evict_old_segments()
+
+    def _evict_old_segments(self):
+        """目录总大小超限时从最旧的分段开始删除"""
+        try:
+            segments = sorted(f for f in os.listdir(self.output_dir)
+                              if f.startswith('segment_') and f.endswith('.avi'))
+            sizes = {f: os.path.getsize(os.path.join(self.output_dir, f)) for f in segments}
+            total = sum(sizes.values())
+            for filename in segments:
+                if total <= self.max_total_bytes:
+                    break
+                os.remove(os.path.join(self.output_dir, filename))
+                total -= sizes[filename]
+                self.segments_evicted += 1
+                self.logger.info(f"录像空间超限，已删除旧分段: {filename}")
+        except Exception as e:
+            self.logger.error(f"清理录像分段失败: {e}")
+
+    def list_segments(self) -> List[dict]:
+        """获取分段文件列表（最新的在前）"""
+        segments = []
+        if not os.path.exists(self.output_dir):
+            return segments
+        for filename in sorted(os.listdir(self.output_dir), reverse=True):
+            if filename.startswith('segment_') and filename.endswith('.avi'):
+                file_stat = os.stat(os.path.join(self.output_dir, filename))
+                segments.append({
+                    'filename': filename,
+                    'size': file_stat.st_size,
+                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S',
+                                               time.localtime(file_stat.st_mtime))
+                })
+        return segments
+
+    def get_status(self) -> dict:
+        """获取录像状态"""
+        preroll_seconds = 0.0
+        if len(self.preroll) > 1:
+            preroll_seconds = self.preroll[-1][0] - self.preroll[0][0]
+        return {
+            'running': self.is_running,
+            'recording': self.recording,
+            'profile': self.profile.name,
+            'record_started': self.record_started if self.recording else 0,
+            'preroll_frames': len(self.preroll),
+            'preroll_seconds': round(preroll_seconds, 2),
+            'current_segment': self.writer.path if self.writer else '',
+            'last_segment': self.last_segment,
+            'segments_written': self.segments_written,
+            'segments_evicted': self.segments_evicted,
+            'frames_written': self.frames_written,
+            'frames_padded': self.frames_padded,
+            'write_errors': self.write_errors
+        }
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Web 服务器模块 - 可选的服务器后端 ([network] server)
+
+    werkzeug  Werkzeug 开发服务器 (app.run threaded=True)，每个连接一个线程，数量不限
+    pooled    基于 Werkzeug 的固定线程池服务器：控制、状态等短请求由 workers 个线程处理，
+              视频流等长连接另有 stream_workers 个名额，名额用完时新的长连接立即收到 503，
+              不会占用短请求的线程，观看者再多也不会让 /control 排队
+
+Werkzeug 每个连接只处理一个请求 (Connection: close)，因此按连接的请求行分类即按请求分类。
+分类时只用 MSG_PEEK 查看请求行，不消耗数据，之后照常交给 Werkzeug 的请求处理器。
+"""
+
+import json
+import time
+import queue
+import socket
+import threading
+import logging
+from typing import Callable, Optional
+
+from werkzeug.serving import BaseWSGIServer
+
+SERVER_BACKENDS = ('pooled', 'werkzeug')
+
+# 长连接名额用完时的响应
+REJECT_BODY = json.dumps({'success': False, 'message': '长连接数已达上限'}).encode()
+REJECT_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                   b'Content-Type: application/json\r\n'
+                   b'Retry-After: 5\r\n'
+                   b'Connection: close\r\n'
+                   b'Content-Length: %d\r\n\r\n' % len(REJECT_BODY)) + REJECT_BODY
+
+# 请求行超时或格式错误时的响应
+TIMEOUT_RESPONSE = (b'HTTP/1.1 408 Request Timeout\r\n'
+                    b'Connection: close\r\n'
+                    b'Content-Length: 0\r\n\r\n')
+BAD_REQUEST_RESPONSE = (b'HTTP/1.1 400 Bad Request\r\n'
+                        b'Connection: close\r\n'
+                        b'Content-Length: 0\r\n\r\n')
+
+class WorkerPool:
+    """固定数量的守护线程，按提交顺序执行任务"""
+
+    def __init__(self, size: int, name: str):
+        self.size = size
+        self.tasks = queue.Queue()
+        self.busy = 0
+        self.lock = threading.Lock()
+        for i in range(size):
+            thread = threading.Thread(target=self._worker, name=f'{name}-{i}')
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, func: Callable, *args):
+        self.tasks.put((func, args))
+
+    def _worker(self):
+        while True:
+            func, args = self.tasks.get()
+            with self.lock:
+                self.busy += 1
+            try:
+                func(*args)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+
+class PooledWSGIServer(BaseWSGIServer):
+    """固定线程池 WSGI 服务器
+
+    接受线程只负责把连接放入短请求队列；短请求线程查看请求行，
+    长连接 (is_long_lived 返回 True 的路径) 占到名额后转交长连接线程，否则返回 503。
+    请求行必须在 peek_timeout 秒内完整到达，否则返回 408 并关闭连接；
+    短请求在处理期间的每次套接字读写最多等待 request_timeout 秒，慢客户端不会一直占用线程。
+    """
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, workers: int = 8, stream_workers: int = 8,
+                 is_long_lived: Optional[Callable[[str], bool]] = None,
+                 peek_timeout: float = 5.0, request_timeout: float = 30.0):
+        super().__init__(host, port, app)
+        self.is_long_lived = is_long_lived or (lambda path: False)
+        self.peek_timeout = peek_timeout
+        self.request_timeout = request_timeout
+        self.request_pool = WorkerPool(workers, 'http')
+        self.stream_pool = WorkerPool(stream_workers, 'stream')
+        self.stream_slots = threading.Semaphore(stream_workers)
+
+        # 统计信息（connections 只由接受线程写入）
+        self.stats_lock = threading.Lock()
+        self.connections = 0
+        self.streams_accepted = 0
+        self.streams_rejected = 0
+        self.requests_timed_out = 0
+
+        # 日志设置
+        self.logger = logging.getLogger(__name__)
+
+    def process_request(self, request, client_address):
+        """接受线程：放入短请求队列后立即返回继续接受连接"""
+        self.connections += 1
+        self.request_pool.submit(self._dispatch, request, client_address)
+
+    def _dispatch(self, request, client_address):
+        """短请求线程：长连接转交长连接线程，其余就地处理"""
+        try:
+            path = self._peek_path(request)
+        except socket.timeout:
+            with self.stats_lock:
+                self.requests_timed_out += 1
+            self._reject(request, TIMEOUT_RESPONSE)
+            return
+        except OSError:
+            self.shutdown_request(request)
+            return
+        if path is None:
+            self._reject(request, BAD_REQUEST_RESPONSE)
+            return
+
+        if self.is_long_lived(path):
+            if self.stream_slots.acquire(blocking=False):
+                with self.stats_lock:
+                    self.streams_accepted += 1
+                request.settimeout(None)
+                self.stream_pool.submit(self._serve, request, client_address, True)
+            else:
+                with self.stats_lock:
+                    self.streams_rejected += 1
+                self.logger.warning(f"长连接名额已满，拒绝 {client_address[0]} {path}")
+                self._reject(request)
+            return
+        request.settimeout(self.request_timeout)
+        self._serve(request, client_address, False)
+
+    def _serve(self, request, client_address, long_lived: bool):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            if long_lived:
+                self.stream_slots.release()
+
+    def _peek_path(self, request) -> Optional[str]:
+        """查看请求行中的路径（不含查询参数）
+
+        整个请求行共用一个截止时间，超时抛出 socket.timeout；
+        连接关闭或请求行格式错误时返回 None。
+        """
+        deadline = time.monotonic() + self.peek_timeout
+        data = b''
+        while b'\n' not in data and len(data) < 4096:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout('请求行超时')
+            request.settimeout(remaining)
+            peeked = request.recv(4096, socket.MSG_PEEK)
+            if not peeked:
+                return None
+            if len(peeked) == len(data):
+                # 请求行尚未完整到达，MSG_PEEK 会立即返回相同的数据
+                time.sleep(min(0.005, remaining))
+            data = peeked
+        parts = data.split(b'\n', 1)[0].split()
+        if len(parts) < 3:
+            return None
+        return parts[1].split(b'?', 1)[0].decode('latin-1')
+
+    def _reject(self, request, response: bytes = REJECT_RESPONSE):
+        try:
+            request.settimeout(1.0)
+            request.sendall(response)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def get_status(self) -> dict:
+        """获取服务器状态"""
+        return {
+            'backend': 'pooled',
+            'workers': self.request_pool.size,
+            'workers_busy': self.request_pool.busy,
+            'queued': self.request_pool.tasks.qsize(),
+            'stream_workers': self.stream_pool.size,
+            'streams_active': self.stream_pool.busy,
+            'streams_accepted': self.streams_accepted,
+            'streams_rejected': self.streams_rejected,
+            'requests_timed_out': self.requests_timed_out,
+            'connections': self.connections
+        }
+
+def create_server(backend: str, host: str, port: int, app, workers: int = 8,
+                  stream_workers: int = 8,
+                  is_long_lived: Optional[Callable[[str], bool]] = None):
+    """按后端名称创建服务器，返回具有 serve_forever()/shutdown() 的服务器对象"""
+    if backend == 'werkzeug':
+        from werkzeug.serving import make_server
+        return make_server(host, port, app, threaded=True)
+    if backend != 'pooled':
+        logging.getLogger(__name__).warning(f"未知的服务器后端 {backend}，使用 pooled")
+    return PooledWSGIServer(host, port, app, workers=workers, stream_workers=stream_workers,
+                            is_long_lived=is_long_lived)